@@ -23,4 +23,24 @@ app.conf.beat_schedule = {
         'task': 'banking.tasks.send_currency_email',
         'schedule': crontab(),
     },
+    'refresh-currency': {
+        'task': 'banking.tasks.refresh_currency',
+        'schedule': 60.0 * 5,
+    },
+    'compact-balance-shards': {
+        'task': 'banking.tasks.compact_balance_shards',
+        'schedule': 60.0,
+    },
+    'delete-expired-idempotency-keys': {
+        'task': 'banking.tasks.delete_expired_idempotency_keys',
+        'schedule': crontab(minute=30, hour=3),
+    },
+    'dispatch-outbox': {
+        'task': 'banking.tasks.dispatch_outbox',
+        'schedule': 5.0,
+    },
+    'delete-dispatched-events': {
+        'task': 'banking.tasks.delete_dispatched_events',
+        'schedule': crontab(minute=45, hour=3),
+    },
 }
\ No newline at end of file
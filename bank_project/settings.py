@@ -14,7 +14,7 @@ import os
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 from celery.schedules import crontab
-from decouple import config
+from decouple import config, Csv
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -154,6 +154,12 @@ else:
 
 CONTACT_EMAIL = 'no-reply@example.com'
 
+# Currency email is sent by parallel tasks, CURRENCY_EMAIL_CHUNK_SIZE
+# recipients per SMTP connection. A failed chunk is retried on its own.
+CURRENCY_EMAIL_CHUNK_SIZE = 500
+CURRENCY_EMAIL_CHUNK_RETRIES = 5
+CURRENCY_EMAIL_CHUNK_RETRY_DELAY = 60
+
 # Django REST Framework
 
 REST_FRAMEWORK = {
@@ -205,6 +211,26 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'banking.tasks.send_currency_email',
         'schedule': crontab(minute=0, hour=9),
     },
+    'refresh-currency': {
+        'task': 'banking.tasks.refresh_currency',
+        'schedule': 60.0 * 5,
+    },
+    'compact-balance-shards': {
+        'task': 'banking.tasks.compact_balance_shards',
+        'schedule': 60.0,
+    },
+    'delete-expired-idempotency-keys': {
+        'task': 'banking.tasks.delete_expired_idempotency_keys',
+        'schedule': crontab(minute=30, hour=3),
+    },
+    'dispatch-outbox': {
+        'task': 'banking.tasks.dispatch_outbox',
+        'schedule': 5.0,
+    },
+    'delete-dispatched-events': {
+        'task': 'banking.tasks.delete_dispatched_events',
+        'schedule': crontab(minute=45, hour=3),
+    },
 }
 
 # Redis
@@ -226,9 +252,110 @@ CACHES = {
 # Cache time to live is 15 minutes.
 CACHE_TTL = 60 * 15
 
+# Currency exchange rate
+# Rates are refreshed by the refresh-currency beat task every 5 minutes.
+# Rates older than CURRENCY_STALE_AFTER seconds are still served while
+# a refresh is queued.
+CURRENCY_STALE_AFTER = CACHE_TTL
+CURRENCY_MAX_AGE = 60 * 60 * 24
+# Providers are asked in order until one answers. Set
+# CURRENCY_PROVIDERS=banking.currency.LocalProvider to work offline with
+# rates from CURRENCY_LOCAL_FILE answered after CURRENCY_LOCAL_LATENCY seconds.
+CURRENCY_PROVIDERS = config(
+    'CURRENCY_PROVIDERS',
+    default='banking.currency.PrivatBankProvider,banking.currency.NBUProvider',
+    cast=Csv()
+)
+CURRENCY_LOCAL_LATENCY = config('CURRENCY_LOCAL_LATENCY', default=0, cast=float)
+# (connect, read) timeouts and size of keep-alive connection pool
+CURRENCY_TIMEOUT = (3.05, 5)
+CURRENCY_POOL_SIZE = 10
+# A provider is skipped for 60 seconds after 3 failures in a row
+CURRENCY_CIRCUIT_FAILURES = 3
+CURRENCY_CIRCUIT_RESET = 60
+
+# Transfers
+# Attempts and backoff (in seconds) for transfers that hit a deadlock
+# or a serialization failure.
+TRANSFER_RETRY_ATTEMPTS = 3
+TRANSFER_RETRY_BACKOFF = 0.05
+TRANSFER_RETRY_BACKOFF_MAX = 1
+# Max number of transfers in one /transfer/batch/ request
+TRANSFER_BATCH_MAX_SIZE = 5000
+
+# Deposits
+# Number of file records applied in one transaction by deposit import
+DEPOSIT_IMPORT_CHUNK_SIZE = 1000
+# Largest file accepted by the import endpoint, bigger files are imported
+# with the import_deposits management command
+DEPOSIT_IMPORT_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+
+# Account statements
+# Number of rows fetched from the database cursor at a time
+STATEMENT_CHUNK_SIZE = 2000
+
+# Idempotency-Key header
+# Responses are kept for a day
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+
+# Account write queue
+# With async writes on, create endpoints of transfers, transactions,
+# deposits and withdrawals answer 202 and queue the operation on
+# banking.writes.<partition> Celery queues. Run one worker with
+# concurrency 1 per partition queue.
+BANKING_ASYNC_WRITES = config('BANKING_ASYNC_WRITES', default=False, cast=bool)
+BANKING_WRITE_PARTITIONS = 8
+BANKING_WRITE_QUEUE = 'banking.writes'
+BANKING_WRITE_BATCH_SIZE = 100
+
 # Elasticksearch
+# Client is built on first use in every process. It keeps up to
+# ELASTICSEARCH_POOL_SIZE connections per node, a request waits
+# ELASTICSEARCH_TIMEOUT seconds and is retried on another node on timeout.
+# With ELASTICSEARCH_SNIFF on, nodes of the cluster are discovered on start
+# and after a node fails.
+ELASTICSEARCH_SNIFF = config('ELASTICSEARCH_SNIFF', default=False, cast=bool)
 ELASTICSEARCH_DSL = {
     'default': {
-        'hosts': '127.0.0.1:9200'
+        'hosts': config('ELASTICSEARCH_HOSTS', default='127.0.0.1:9200',
+                        cast=Csv()),
+        'maxsize': config('ELASTICSEARCH_POOL_SIZE', default=10, cast=int),
+        'timeout': config('ELASTICSEARCH_TIMEOUT', default=5, cast=float),
+        'retry_on_timeout': True,
+        'max_retries': 2,
+        'sniff_on_start': ELASTICSEARCH_SNIFF,
+        'sniff_on_connection_fail': ELASTICSEARCH_SNIFF,
+        'sniffer_timeout': 60 if ELASTICSEARCH_SNIFF else None,
     },
-}
\ No newline at end of file
+}
+
+# Documents are updated by a Celery task after the transaction commits,
+# in bulk requests of SEARCH_INDEX_BATCH_SIZE documents
+ELASTICSEARCH_DSL_SIGNAL_PROCESSOR = 'banking.signals.AsyncSignalProcessor'
+SEARCH_INDEX_BATCH_SIZE = 500
+
+# Account search engine: banking.search.ElasticsearchBackend, or
+# banking.search.DatabaseBackend to search with database indexes only
+SEARCH_BACKEND = config('SEARCH_BACKEND',
+                        default='banking.search.ElasticsearchBackend')
+
+# Account events are written to the outbox with the change and published
+# by the dispatch_outbox task in batches of OUTBOX_BATCH_SIZE, as one
+# message to OUTBOX_QUEUE and as deliveries to webhooks of account
+# holders. Dispatched events are kept OUTBOX_RETENTION seconds.
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_QUEUE = 'banking.events'
+OUTBOX_RETENTION = 60 * 60 * 24 * 7
+
+# Webhooks are sent by the deliver_webhooks command over WEBHOOK_POOL_SIZE
+# pooled connections, up to WEBHOOK_BATCH_SIZE events in one request and
+# WEBHOOK_ENDPOINT_CONCURRENCY requests to one endpoint at a time.
+# Failed requests are retried after WEBHOOK_BACKOFF seconds, doubled
+# every attempt up to WEBHOOK_BACKOFF_MAX, WEBHOOK_MAX_ATTEMPTS times.
+WEBHOOK_POOL_SIZE = 100
+WEBHOOK_ENDPOINT_CONCURRENCY = 4
+WEBHOOK_BATCH_SIZE = 50
+WEBHOOK_TIMEOUT = 10
+WEBHOOK_MAX_ATTEMPTS = 10
+WEBHOOK_BACKOFF = 10
+WEBHOOK_BACKOFF_MAX = 60 * 60
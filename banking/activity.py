@@ -0,0 +1,112 @@
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import CharField, F, Q, Value
+from django.db.models.functions import Cast
+
+from banking.models import Transfer, Transaction, Deposit, Withdrawal
+
+DEPOSIT = 'deposit'
+TRANSACTION = 'transaction'
+TRANSFER_IN = 'transfer_in'
+TRANSFER_OUT = 'transfer_out'
+WITHDRAWAL = 'withdrawal'
+KINDS = (DEPOSIT, TRANSACTION, TRANSFER_IN, TRANSFER_OUT, WITHDRAWAL)
+
+FIELDS = ('id', 'date', 'amount', 'kind', 'comment', 'counterparty')
+
+STATEMENT_CHUNK_SIZE = getattr(settings, 'STATEMENT_CHUNK_SIZE', 2000)
+
+
+def get_branches(account_id):
+    """
+    Return kind, queryset, comment and counterparty expressions
+    for every table with movements of the account
+    """
+    text = CharField()
+    return (
+        (DEPOSIT, Deposit.objects.filter(account_id=account_id),
+         F('comment'), Value(None, output_field=text)),
+        (TRANSACTION, Transaction.objects.filter(account_id=account_id),
+         F('comment'), F('merchant')),
+        (TRANSFER_IN, Transfer.objects.filter(account_to_id=account_id),
+         F('comment'), Cast('account_from__uid', text)),
+        (TRANSFER_OUT, Transfer.objects.filter(account_from_id=account_id),
+         F('comment'), Cast('account_to__uid', text)),
+        (WITHDRAWAL, Withdrawal.objects.filter(account_id=account_id),
+         Value('', output_field=text), Value(None, output_field=text)),
+    )
+
+
+def after(queryset, kind, cursor):
+    """
+    Filter rows of one kind that go after cursor (date, kind, id)
+    in the newest first order. Kind is the same for the whole table,
+    so the condition on it is resolved here and the database gets
+    a range on (date, id) only.
+    """
+    date, cursor_kind, pk = cursor
+    if kind < cursor_kind:
+        return queryset.filter(date__lte=date)
+    if kind == cursor_kind:
+        return queryset.filter(Q(date__lt=date) | Q(date=date, id__lt=pk))
+    return queryset.filter(date__lt=date)
+
+
+def get_activity(account_id, cursor=None, limit=None):
+    """
+    Movements of account from all history tables in one UNION ALL query,
+    newest first by (date, kind, id). Rows are dicts with FIELDS keys.
+    :param cursor: (date, kind, id) of the last row of the previous page
+    :param limit: number of rows, pushed into every table where supported
+    """
+    queries = []
+    for kind, queryset, comment, counterparty in get_branches(account_id):
+        if cursor is not None:
+            queryset = after(queryset, kind, cursor)
+        # Both comment and counterparty are annotations to keep the same
+        # column order in every part of the union
+        queryset = queryset.values(
+            'id', 'date', 'amount',
+            kind=Value(kind, output_field=CharField()),
+            note=comment,
+            counterparty=counterparty,
+        ).order_by()
+        if limit is not None and \
+                connection.features.supports_slicing_ordering_in_compound:
+            queryset = queryset.order_by('-date', '-id')[:limit]
+        queries.append(queryset)
+
+    activity = queries[0].union(*queries[1:], all=True) \
+        .order_by('-date', '-kind', '-id')
+    if limit is not None:
+        activity = activity[:limit]
+    return activity
+
+
+def format_row(row):
+    """ Turn union row into a movement with FIELDS keys """
+    counterparty = row['counterparty']
+    if row['kind'] in (TRANSFER_IN, TRANSFER_OUT) and counterparty:
+        # Account uid cast to text is hex without dashes on some databases
+        counterparty = str(uuid.UUID(counterparty))
+    return {
+        'id': row['id'],
+        'date': row['date'],
+        'amount': row['amount'],
+        'kind': row['kind'],
+        'comment': row['note'],
+        'counterparty': counterparty,
+    }
+
+
+def iter_statement(account_id):
+    """
+    Yield all movements of account newest first. Rows are read with
+    a server-side cursor where supported, so memory does not grow with
+    the length of history.
+    """
+    rows = get_activity(account_id).iterator(chunk_size=STATEMENT_CHUNK_SIZE)
+    for row in rows:
+        yield format_row(row)
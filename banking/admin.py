@@ -1,7 +1,9 @@
 from django.contrib import admin
 
 from banking.models import Customer, Account, Transfer, Transaction, Deposit, \
-    Withdrawal
+    Withdrawal, DepositImport, LedgerEntry, BalanceShard, ShardCredit, \
+    IdempotencyKey, ExchangeRate, EmailRun, OutboxEvent, WebhookSubscription, \
+    WebhookDelivery
 
 admin.site.register(Customer)
 admin.site.register(Account)
@@ -9,3 +11,28 @@ admin.site.register(Transfer)
 admin.site.register(Transaction)
 admin.site.register(Deposit)
 admin.site.register(Withdrawal)
+admin.site.register(DepositImport)
+admin.site.register(BalanceShard)
+admin.site.register(ShardCredit)
+admin.site.register(IdempotencyKey)
+admin.site.register(ExchangeRate)
+admin.site.register(EmailRun)
+admin.site.register(OutboxEvent)
+admin.site.register(WebhookSubscription)
+admin.site.register(WebhookDelivery)
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    """ The ledger is append-only, entries can only be viewed """
+    list_display = ('account', 'sequence', 'kind', 'amount', 'balance',
+                    'reference', 'date')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
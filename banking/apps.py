@@ -1,5 +1,14 @@
+import os
+
 from django.apps import AppConfig
 
 
 class BankingConfig(AppConfig):
     name = 'banking'
+
+    def ready(self):
+        from banking.search import reset_clients
+
+        # Celery and gunicorn workers fork after Django is set up
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=reset_clients)
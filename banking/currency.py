@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import time
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from banking.exceptions import CurrencyUnavailable
+
+logger = logging.getLogger(__name__)
+
+CURRENCY_PROVIDERS = getattr(settings, 'CURRENCY_PROVIDERS', [
+    'banking.currency.PrivatBankProvider',
+    'banking.currency.NBUProvider',
+])
+CURRENCY_TIMEOUT = getattr(settings, 'CURRENCY_TIMEOUT', (3.05, 5))
+CURRENCY_POOL_SIZE = getattr(settings, 'CURRENCY_POOL_SIZE', 10)
+# Consecutive failures that open the circuit and seconds it stays open
+CIRCUIT_FAILURES = getattr(settings, 'CURRENCY_CIRCUIT_FAILURES', 3)
+CIRCUIT_RESET = getattr(settings, 'CURRENCY_CIRCUIT_RESET', 60)
+CURRENCY_LOCAL_FILE = getattr(
+    settings, 'CURRENCY_LOCAL_FILE',
+    os.path.join(os.path.dirname(__file__), 'data', 'currency.json'))
+CURRENCY_LOCAL_LATENCY = getattr(settings, 'CURRENCY_LOCAL_LATENCY', 0)
+
+CURRENCY_FIELDS = ('ccy', 'base_ccy', 'buy', 'sale')
+
+# The latest rate of a currency is kept in the in-process cache
+# for LATEST_RATE_TTL seconds
+RATE_CACHE_SIZE = 1024
+LATEST_RATE_TTL = 60
+
+
+class CircuitBreaker:
+    """
+    Skip a provider for CIRCUIT_RESET seconds after CIRCUIT_FAILURES
+    failures in a row. State is kept in cache and shared by all workers.
+    """
+    def __init__(self, name):
+        self.failures_key = f'currency:circuit:{name}:failures'
+        self.open_key = f'currency:circuit:{name}:open'
+
+    def is_open(self):
+        return cache.get(self.open_key) is not None
+
+    def success(self):
+        cache.delete(self.failures_key)
+
+    def failure(self):
+        cache.add(self.failures_key, 0, timeout=CIRCUIT_RESET)
+        if cache.incr(self.failures_key) >= CIRCUIT_FAILURES:
+            cache.set(self.open_key, 1, timeout=CIRCUIT_RESET)
+            cache.delete(self.failures_key)
+
+
+class Provider:
+    """
+    Source of currency exchange rate.
+    fetch() returns list of dicts with CURRENCY_FIELDS.
+    """
+    name = None
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(self.name)
+
+    def fetch(self):
+        raise NotImplementedError
+
+
+class HTTPProvider(Provider):
+    """ Provider with pooled keep-alive connections and strict timeouts """
+    url = None
+
+    def __init__(self):
+        super().__init__()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=CURRENCY_POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def fetch(self):
+        response = self.session.get(self.url, timeout=CURRENCY_TIMEOUT)
+        response.raise_for_status()
+        return self.parse(response.json())
+
+    def parse(self, data):
+        raise NotImplementedError
+
+
+class PrivatBankProvider(HTTPProvider):
+    name = 'privatbank'
+    url = 'https://api.privatbank.ua/p24api/pubinfo?json&exchange&coursid=11'
+
+    def parse(self, data):
+        return [{field: rate[field] for field in CURRENCY_FIELDS}
+                for rate in data]
+
+
+class NBUProvider(HTTPProvider):
+    """ Official rate of National Bank of Ukraine, the same to buy and sell """
+    name = 'nbu'
+    url = 'https://bank.gov.ua/NBUStatService/v1/statdirectory/exchange?json'
+    currencies = ('USD', 'EUR')
+
+    def parse(self, data):
+        return [
+            {'ccy': rate['cc'], 'base_ccy': 'UAH',
+             'buy': str(rate['rate']), 'sale': str(rate['rate'])}
+            for rate in data if rate['cc'] in self.currencies
+        ]
+
+
+class LocalProvider(Provider):
+    """
+    Rates from CURRENCY_LOCAL_FILE answered after CURRENCY_LOCAL_LATENCY
+    seconds, for development and load tests without the bank
+    """
+    name = 'local'
+
+    def fetch(self):
+        if CURRENCY_LOCAL_LATENCY:
+            time.sleep(CURRENCY_LOCAL_LATENCY)
+        with open(CURRENCY_LOCAL_FILE) as f:
+            return [{field: rate[field] for field in CURRENCY_FIELDS}
+                    for rate in json.load(f)]
+
+
+@lru_cache(maxsize=None)
+def get_providers():
+    """ Providers of CURRENCY_PROVIDERS setting in the order of failover """
+    return [import_string(path)() for path in CURRENCY_PROVIDERS]
+
+
+def fetch_rates():
+    """
+    Return rates of the first provider that answers.
+    Providers with open circuit are skipped.
+    Raise CurrencyUnavailable if none answers.
+    """
+    for provider in get_providers():
+        if provider.breaker.is_open():
+            continue
+        try:
+            rates = provider.fetch()
+        except (requests.RequestException, ValueError, KeyError,
+                TypeError, OSError) as err:
+            logger.warning('Currency provider %s failed: %s',
+                           provider.name, err)
+            provider.breaker.failure()
+            continue
+        provider.breaker.success()
+        return rates
+    raise CurrencyUnavailable()
+
+
+def record_rates(rates, previous=None):
+    """ Store changed rates in ExchangeRate history """
+    from banking.models import ExchangeRate
+    created = ExchangeRate.record(rates, previous)
+    if created:
+        _latest_rate.cache_clear()
+    return created
+
+
+@lru_cache(maxsize=RATE_CACHE_SIZE)
+def _latest_rate(ccy, period):
+    from banking.models import ExchangeRate
+    return ExchangeRate.objects.filter(ccy=ccy).order_by('-date', '-id').first()
+
+
+def get_latest_rate(ccy):
+    """ Last stored ExchangeRate of ccy or None """
+    return _latest_rate(ccy, int(time.time() // LATEST_RATE_TTL))
+
+
+def clear_rate_cache():
+    _latest_rate.cache_clear()
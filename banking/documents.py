@@ -1,7 +1,8 @@
-from django.conf import settings
+from django.contrib.auth import get_user_model
 from django_elasticsearch_dsl import DocType, fields, Index
+from elasticsearch_dsl import analyzer, token_filter
 
-from .models import Account
+from .models import Account, Transaction
 
 accounts = Index('accounts')
 
@@ -13,9 +14,12 @@ accounts.settings(
 
 @accounts.doc_type
 class AccountDocument(DocType):
+    uid = fields.KeywordField()
     holder = fields.ObjectField(properties={
+        'id': fields.IntegerField(),
         'email': fields.TextField(),
     })
+
     class Meta:
         model = Account
         fields = [
@@ -23,4 +27,55 @@ class AccountDocument(DocType):
             'status'
         ]
 
-        related_models = [settings.AUTH_USER_MODEL]
\ No newline at end of file
+        related_models = [get_user_model()]
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('holder')
+
+    def prepare_uid(self, instance):
+        return str(instance.uid)
+
+    def get_instances_from_related(self, related_instance):
+        """ Account of saved user """
+        return Account.objects.filter(holder=related_instance)
+
+
+transactions = Index('transactions')
+
+transactions.settings(
+    number_of_shards=1,
+    number_of_replicas=0
+)
+
+# Every prefix of a merchant word is indexed, so a search box query
+# matches with a term lookup instead of a prefix scan
+merchant_analyzer = analyzer(
+    'merchant_prefix',
+    tokenizer='standard',
+    filter=[
+        'lowercase',
+        token_filter('merchant_edge_ngram', 'edge_ngram',
+                     min_gram=1, max_gram=20),
+    ]
+)
+
+
+@transactions.doc_type
+class TransactionDocument(DocType):
+    account = fields.IntegerField()
+    amount = fields.DoubleField()
+    merchant = fields.TextField(
+        analyzer=merchant_analyzer,
+        search_analyzer='standard'
+    )
+
+    class Meta:
+        model = Transaction
+        fields = [
+            'id',
+            'comment',
+            'date',
+        ]
+
+    def prepare_account(self, instance):
+        return instance.account_id
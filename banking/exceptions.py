@@ -18,3 +18,21 @@ class InvalidAmount(APIException):
     status_code = status.HTTP_400_BAD_REQUEST
     default_detail = 'Not enough money on balance.'
     default_code = 'amount_error'
+
+
+class ImportConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Import with this name was made from another file.'
+    default_code = 'import_error'
+
+
+class InvalidCursor(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'Invalid cursor.'
+    default_code = 'cursor_error'
+
+
+class CurrencyUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Currency exchange rate is temporarily unavailable.'
+    default_code = 'currency_error'
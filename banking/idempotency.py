@@ -0,0 +1,139 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from banking.models import IdempotencyKey
+from banking.utils import retry_on_conflict
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_TTL = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 60 * 60 * 24)
+
+
+def get_fingerprint(request):
+    """ Hash of request data to catch keys reused for other requests """
+    data = json.dumps(request.data, sort_keys=True, cls=JSONEncoder)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def get_stored(cache_key, user, path, key):
+    """
+    Return stored response as dict with fingerprint, status and data,
+    look in cache first and then in the durable table.
+    """
+    stored = cache.get(cache_key)
+    if stored is not None:
+        return stored
+
+    created = timezone.now() - timedelta(seconds=IDEMPOTENCY_TTL)
+    row = IdempotencyKey.objects.filter(
+        user=user,
+        path=path,
+        key=key,
+        state=IdempotencyKey.DONE,
+        created__gte=created
+    ).values('fingerprint', 'status', 'data').first()
+    if row is not None:
+        cache.set(cache_key, row, timeout=IDEMPOTENCY_TTL)
+    return row
+
+
+def claim(user, path, key, fingerprint):
+    """
+    Insert the key row in progress in the current transaction.
+    While another transaction holds the key the insert waits for it.
+    :return: IdempotencyKey, None if the key was taken
+    """
+    created = timezone.now() - timedelta(seconds=IDEMPOTENCY_TTL)
+    IdempotencyKey.objects.filter(user=user, path=path, key=key,
+                                  created__lt=created).delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, path=path, key=key, fingerprint=fingerprint)
+    except IntegrityError:
+        return None
+
+
+def store(cache_key, row, response):
+    """ Save response in the claimed row and cache it after commit """
+    row.state = IdempotencyKey.DONE
+    row.status = response.status_code
+    row.data = json.dumps(response.data, cls=JSONEncoder)
+    row.save(update_fields=['state', 'status', 'data'])
+    stored = {
+        'fingerprint': row.fingerprint,
+        'status': row.status,
+        'data': row.data,
+    }
+    transaction.on_commit(
+        lambda: cache.set(cache_key, stored, timeout=IDEMPOTENCY_TTL))
+
+
+def replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        content = {'idempotency_error':
+                   'Idempotency-Key was already used for another request.'}
+        return Response(content, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    response = Response(json.loads(stored['data']), status=stored['status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(func):
+    """
+    Make a POST view method idempotent with the Idempotency-Key header.
+    The first request with a key takes an IdempotencyKey row and runs
+    the view in the same transaction, its response is written to the row
+    before commit and cached after. Repeated requests get the stored
+    response without running the view, requests that come while the first
+    one is in flight wait on the row until it commits or rolls back.
+    """
+    @wraps(func)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return func(self, request, *args, **kwargs)
+        if len(key) > 255:
+            content = {'idempotency_error': 'Idempotency-Key is too long.'}
+            return Response(content, status=status.HTTP_400_BAD_REQUEST)
+
+        user, path = request.user, request.path
+        cache_key = f'idempotency:{user.pk}:{path}:{key}'
+        fingerprint = get_fingerprint(request)
+
+        stored = get_stored(cache_key, user, path, key)
+        if stored is not None:
+            return replay(stored, fingerprint)
+
+        @retry_on_conflict
+        def run():
+            with transaction.atomic():
+                row = claim(user, path, key, fingerprint)
+                if row is None:
+                    return None
+                response = func(self, request, *args, **kwargs)
+                if response.status_code < 500:
+                    store(cache_key, row, response)
+                else:
+                    row.delete()
+                return response
+
+        response = run()
+        if response is not None:
+            return response
+        stored = get_stored(cache_key, user, path, key)
+        if stored is not None:
+            return replay(stored, fingerprint)
+        content = {'idempotency_error':
+                   'A request with this Idempotency-Key is in progress.'}
+        return Response(content, status=status.HTTP_409_CONFLICT)
+    return wrapper
@@ -0,0 +1,153 @@
+import csv
+import hashlib
+import json
+import uuid
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+
+from banking.exceptions import ImportConflict
+from banking.models import Account, Deposit, DepositImport, LedgerEntry, \
+    OutboxEvent, bulk_insert
+from banking.utils import chunks
+
+CHUNK_SIZE = getattr(settings, 'DEPOSIT_IMPORT_CHUNK_SIZE', 1000)
+MAX_UPLOAD_SIZE = getattr(settings, 'DEPOSIT_IMPORT_MAX_UPLOAD_SIZE',
+                          10 * 1024 * 1024)
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+FORMATS = (CSV, NDJSON)
+
+
+def get_format(filename):
+    """ Guess file format by extension """
+    if filename.lower().endswith(('.ndjson', '.jsonl')):
+        return NDJSON
+    return CSV
+
+
+def get_digest(blocks):
+    """ SHA-256 hex digest of file content given as byte blocks """
+    digest = hashlib.sha256()
+    for block in blocks:
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def read_records(lines, fmt):
+    """
+    Yield deposit records one by one from an iterable of text lines.
+    CSV needs a header with account, amount and comment columns,
+    NDJSON lines are objects with the same keys.
+    """
+    if fmt == CSV:
+        yield from csv.DictReader(lines)
+    else:
+        for line in lines:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield {}
+
+
+def clean_record(record):
+    """
+    Return account uid, amount and comment of the record.
+    Raise ValidationError if record is broken.
+    """
+    if not isinstance(record, dict):
+        raise ValidationError('Invalid record.')
+    try:
+        uid = uuid.UUID(str(record.get('account')))
+    except ValueError:
+        raise ValidationError('Invalid account.')
+    amount = Deposit._meta.get_field('amount').clean(record.get('amount'), None)
+    return uid, amount, record.get('comment') or ''
+
+
+def apply_chunk(checkpoint, chunk):
+    """
+    Write deposits of one chunk and move the checkpoint in one transaction.
+    Every account gets one balance increment for its total in the chunk
+    and a ledger entry per deposit.
+    """
+    cleaned = []
+    errors = 0
+    for record in chunk:
+        try:
+            cleaned.append(clean_record(record))
+        except ValidationError:
+            errors += 1
+
+    accounts = dict(
+        Account.objects.filter(uid__in={uid for uid, _, _ in cleaned})
+        .values_list('uid', 'pk')
+    )
+    uids = {pk: uid for uid, pk in accounts.items()}
+    credits = defaultdict(list)
+    deposits = []
+    for uid, amount, comment in cleaned:
+        pk = accounts.get(uid)
+        if pk is None:
+            errors += 1
+            continue
+        credits[pk].append(amount)
+        deposits.append(Deposit(account_id=pk, amount=amount, comment=comment))
+
+    with transaction.atomic():
+        positions = Account.credit_many(credits)
+        bulk_insert(deposits)
+
+        received = defaultdict(list)
+        for deposit in deposits:
+            received[deposit.account_id].append(deposit)
+        entries = []
+        for pk, objs in received.items():
+            entries += LedgerEntry.build(
+                pk, LedgerEntry.DEPOSIT, *positions[pk],
+                [obj.amount for obj in objs], [obj.pk for obj in objs]
+            )
+        LedgerEntry.bulk_record(entries)
+        OutboxEvent.objects.bulk_create([
+            OutboxEvent.build(OutboxEvent.DEPOSIT, deposit.account_id,
+                              uids[deposit.account_id], deposit)
+            for deposit in deposits
+        ])
+        DepositImport.objects.filter(pk=checkpoint.pk).update(
+            records=F('records') + len(chunk),
+            deposits=F('deposits') + len(deposits),
+            errors=F('errors') + errors,
+        )
+
+
+def import_deposits(lines, name, fmt=CSV, chunk_size=CHUNK_SIZE, digest=''):
+    """
+    Stream deposits from lines and apply them chunk by chunk.
+    Import with the same name continues after the last applied chunk.
+    Raise ImportConflict if the name was used for a file with another digest.
+    :param lines: iterable of text lines, e.g. open file
+    :param name: unique name of the import
+    :param digest: SHA-256 of the file, see get_digest
+    :return: DepositImport checkpoint
+    """
+    checkpoint, _ = DepositImport.objects.get_or_create(
+        name=name, defaults={'digest': digest})
+    if digest and checkpoint.digest and checkpoint.digest != digest:
+        raise ImportConflict()
+    if checkpoint.status == DepositImport.DONE:
+        return checkpoint
+
+    records = islice(read_records(lines, fmt), checkpoint.records, None)
+    for chunk in chunks(records, chunk_size):
+        apply_chunk(checkpoint, chunk)
+
+    DepositImport.objects.filter(pk=checkpoint.pk).update(
+        status=DepositImport.DONE)
+    checkpoint.refresh_from_db()
+    return checkpoint
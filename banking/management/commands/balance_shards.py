@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from banking.models import Account
+
+
+class Command(BaseCommand):
+    help = 'Spread credits of a hot account over balance shards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('uid', help='Account public identifier')
+        parser.add_argument(
+            'count',
+            type=int,
+            help='Number of shards, 0 to turn sharding off'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            account = Account.objects.get(uid=options['uid'])
+        except (Account.DoesNotExist, ValueError):
+            raise CommandError('No such account')
+
+        account.set_balance_shards(options['count'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{account.uid}: {account.balance_shards} balance shards'
+        ))
@@ -0,0 +1,47 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from banking.webhooks import WebhookWorker, WEBHOOK_POOL_SIZE, \
+    WEBHOOK_ENDPOINT_CONCURRENCY, WEBHOOK_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Send account events to webhook endpoints of account holders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Stop when no delivery is due instead of waiting for more'
+        )
+        parser.add_argument(
+            '--pool-size',
+            type=int,
+            default=WEBHOOK_POOL_SIZE,
+            help='Open connections to all endpoints together'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=WEBHOOK_ENDPOINT_CONCURRENCY,
+            help='Requests to one endpoint at a time'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=WEBHOOK_BATCH_SIZE,
+            help='Events in one request'
+        )
+
+    def handle(self, *args, **options):
+        worker = WebhookWorker(
+            pool_size=options['pool_size'],
+            concurrency=options['concurrency'],
+            batch_size=options['batch_size']
+        )
+        delivered = asyncio.run(worker.run(once=options['once']))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{delivered} events delivered'
+        ))
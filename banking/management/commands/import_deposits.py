@@ -0,0 +1,44 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from banking.imports import import_deposits, get_format, get_digest, \
+    FORMATS, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Import deposits from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='File format, guessed by extension by default'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE
+        )
+        parser.add_argument(
+            '--name',
+            help='Import name used to resume, file name by default'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or get_format(path)
+        name = options['name'] or os.path.basename(path)
+
+        with open(path, 'rb') as f:
+            digest = get_digest(iter(lambda: f.read(64 * 1024), b''))
+        with open(path, newline='', encoding='utf-8') as lines:
+            checkpoint = import_deposits(
+                lines, name, fmt=fmt, chunk_size=options['chunk_size'],
+                digest=digest)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{checkpoint.name}: {checkpoint.records} records, '
+            f'{checkpoint.deposits} deposits, {checkpoint.errors} errors'
+        ))
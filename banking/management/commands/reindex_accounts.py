@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from banking.documents import accounts, AccountDocument
+from banking.reindex import reindex, CHUNK_SIZE, THREAD_COUNT
+
+
+class Command(BaseCommand):
+    help = 'Rebuild accounts search index and swap it in without downtime'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Documents in one bulk request'
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=THREAD_COUNT,
+            help='Number of parallel bulk requests'
+        )
+        parser.add_argument(
+            '--keep-old',
+            action='store_true',
+            help='Do not delete the index replaced by the new one'
+        )
+
+    def handle(self, *args, **options):
+        name, indexed, failed = reindex(
+            accounts, AccountDocument,
+            chunk_size=options['chunk_size'],
+            thread_count=options['threads'],
+            keep_old=options['keep_old']
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{name}: {indexed} accounts indexed, {failed} failed'
+        ))
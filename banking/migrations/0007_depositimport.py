@@ -0,0 +1,29 @@
+# Generated by Django 2.2.10 on 2026-10-18 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0006_auto_20200328_1047'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepositImport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('records', models.PositiveIntegerField(default=0, help_text='Records read from the file so far')),
+                ('deposits', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(choices=[('running', 'running'), ('done', 'done')], default='running', max_length=10)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 2.2.10 on 2026-10-18 18:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def open_ledger(apps, schema_editor):
+    """ Start ledger of existing accounts with their current balance """
+    Account = apps.get_model('banking', 'Account')
+    LedgerEntry = apps.get_model('banking', 'LedgerEntry')
+    accounts = Account.objects.exclude(balance=0)
+    LedgerEntry.objects.bulk_create(
+        LedgerEntry(
+            account_id=pk,
+            sequence=1,
+            kind='opening',
+            amount=balance,
+            balance=balance
+        )
+        for pk, balance in accounts.values_list('pk', 'balance').iterator()
+    )
+    accounts.update(sequence=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0007_depositimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='sequence',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of the last ledger entry'),
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveIntegerField()),
+                ('kind', models.CharField(choices=[('opening', 'opening'), ('transfer', 'transfer'), ('transaction', 'transaction'), ('deposit', 'deposit'), ('withdrawal', 'withdrawal')], max_length=12)),
+                ('amount', models.DecimalField(decimal_places=2, help_text='Negative for debits', max_digits=12)),
+                ('balance', models.DecimalField(decimal_places=2, help_text='Balance after the entry', max_digits=12)),
+                ('reference', models.PositiveIntegerField(help_text='Id of transfer, transaction, deposit or withdrawal', null=True)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger', to='banking.Account')),
+            ],
+            options={
+                'verbose_name_plural': 'ledger entries',
+                'ordering': ['account', 'sequence'],
+                'unique_together': {('account', 'sequence')},
+            },
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.10 on 2026-10-18 18:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0008_ledgerentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='balance_shards',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, help_text='Number of shard rows credits are spread over, 0 keeps the whole balance in the account row'),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, help_text='Balance after the entry', max_digits=12, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='sequence',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.CreateModel(
+            name='BalanceShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='banking.Account')),
+            ],
+            options={
+                'unique_together': {('account', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.10 on 2026-10-18 19:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0010_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Operation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='Public identifier')),
+                ('kind', models.CharField(choices=[('transfer', 'transfer'), ('transaction', 'transaction'), ('deposit', 'deposit'), ('withdrawal', 'withdrawal')], max_length=12)),
+                ('partition', models.PositiveSmallIntegerField()),
+                ('payload', models.TextField(help_text='Operation data in JSON')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=10)),
+                ('result', models.TextField(blank=True, help_text='Result or error in JSON')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('processed', models.DateTimeField(blank=True, null=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='operations', to='banking.Account')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(fields=['partition', 'status', 'id'], name='operation_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.10 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0011_operation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deposit',
+            index=models.Index(fields=['account', '-date', '-id'], name='deposit_account_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', '-date', '-id'], name='transaction_account_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['account_from', '-date', '-id'], name='transfer_from_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['account_to', '-date', '-id'], name='transfer_to_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawal',
+            index=models.Index(fields=['account', '-date', '-id'], name='withdrawal_account_date_idx'),
+        ),
+    ]
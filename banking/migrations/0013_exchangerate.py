@@ -0,0 +1,32 @@
+# Generated by Django 2.2.10 on 2026-10-18 19:13
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0012_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ccy', models.CharField(max_length=3)),
+                ('base_ccy', models.CharField(max_length=3)),
+                ('buy', models.DecimalField(decimal_places=5, max_digits=16)),
+                ('sale', models.DecimalField(decimal_places=5, max_digits=16)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='exchangerate',
+            index=models.Index(fields=['ccy', '-date', '-id'], name='exchangerate_ccy_date_idx'),
+        ),
+    ]
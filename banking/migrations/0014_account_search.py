@@ -0,0 +1,98 @@
+from django.db import migrations
+
+# SQLite keeps an FTS5 table of holder email and name per account row,
+# filled by triggers. Django rebuilds tables on some SQLite schema changes,
+# a migration that rebuilds banking_account must create the triggers again.
+SQLITE_CREATE = [
+    """
+    CREATE VIRTUAL TABLE banking_account_search
+    USING fts5(email, name, tokenize='unicode61')
+    """,
+    """
+    CREATE TRIGGER banking_account_search_insert
+    AFTER INSERT ON banking_account BEGIN
+        INSERT INTO banking_account_search(rowid, email, name)
+        SELECT NEW.id, email, first_name || ' ' || last_name
+        FROM users_customuser WHERE id = NEW.holder_id;
+    END
+    """,
+    """
+    CREATE TRIGGER banking_account_search_delete
+    AFTER DELETE ON banking_account BEGIN
+        DELETE FROM banking_account_search WHERE rowid = OLD.id;
+    END
+    """,
+    """
+    CREATE TRIGGER banking_account_search_holder
+    AFTER UPDATE OF holder_id ON banking_account BEGIN
+        DELETE FROM banking_account_search WHERE rowid = OLD.id;
+        INSERT INTO banking_account_search(rowid, email, name)
+        SELECT NEW.id, email, first_name || ' ' || last_name
+        FROM users_customuser WHERE id = NEW.holder_id;
+    END
+    """,
+    """
+    CREATE TRIGGER banking_account_search_user
+    AFTER UPDATE OF email, first_name, last_name ON users_customuser BEGIN
+        UPDATE banking_account_search
+        SET email = NEW.email, name = NEW.first_name || ' ' || NEW.last_name
+        WHERE rowid IN (
+            SELECT id FROM banking_account WHERE holder_id = NEW.id
+        );
+    END
+    """,
+    """
+    INSERT INTO banking_account_search(rowid, email, name)
+    SELECT a.id, u.email, u.first_name || ' ' || u.last_name
+    FROM banking_account a JOIN users_customuser u ON u.id = a.holder_id
+    """,
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS banking_account_search_insert',
+    'DROP TRIGGER IF EXISTS banking_account_search_delete',
+    'DROP TRIGGER IF EXISTS banking_account_search_holder',
+    'DROP TRIGGER IF EXISTS banking_account_search_user',
+    'DROP TABLE IF EXISTS banking_account_search',
+]
+
+# PostgreSQL serves ILIKE '%phrase%' and similarity() from trigram indexes
+POSTGRESQL_CREATE = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """
+    CREATE INDEX IF NOT EXISTS users_email_trgm_idx
+    ON users_customuser USING gin (email gin_trgm_ops)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS users_name_trgm_idx
+    ON users_customuser
+    USING gin ((first_name || ' ' || last_name) gin_trgm_ops)
+    """,
+]
+
+POSTGRESQL_DROP = [
+    'DROP INDEX IF EXISTS users_email_trgm_idx',
+    'DROP INDEX IF EXISTS users_name_trgm_idx',
+]
+
+
+def run(statements):
+    def forwards(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return forwards
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+        ('banking', '0013_exchangerate'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_CREATE, 'postgresql': POSTGRESQL_CREATE}),
+            run({'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP}),
+        ),
+    ]
@@ -0,0 +1,84 @@
+from django.db import migrations
+
+# SQLite indexes merchants in an FTS5 table over banking_transaction,
+# kept in sync by triggers. Prefix indexes of 1 to 3 characters serve
+# the first keystrokes of a search box without scanning the term list.
+SQLITE_CREATE = [
+    """
+    CREATE VIRTUAL TABLE banking_transaction_search
+    USING fts5(merchant, content='banking_transaction', content_rowid='id',
+               tokenize='unicode61', prefix='1 2 3')
+    """,
+    """
+    CREATE TRIGGER banking_transaction_search_insert
+    AFTER INSERT ON banking_transaction BEGIN
+        INSERT INTO banking_transaction_search(rowid, merchant)
+        VALUES (NEW.id, NEW.merchant);
+    END
+    """,
+    """
+    CREATE TRIGGER banking_transaction_search_delete
+    AFTER DELETE ON banking_transaction BEGIN
+        INSERT INTO banking_transaction_search(
+            banking_transaction_search, rowid, merchant)
+        VALUES ('delete', OLD.id, OLD.merchant);
+    END
+    """,
+    """
+    CREATE TRIGGER banking_transaction_search_update
+    AFTER UPDATE OF merchant ON banking_transaction BEGIN
+        INSERT INTO banking_transaction_search(
+            banking_transaction_search, rowid, merchant)
+        VALUES ('delete', OLD.id, OLD.merchant);
+        INSERT INTO banking_transaction_search(rowid, merchant)
+        VALUES (NEW.id, NEW.merchant);
+    END
+    """,
+    """
+    INSERT INTO banking_transaction_search(banking_transaction_search)
+    VALUES ('rebuild')
+    """,
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS banking_transaction_search_insert',
+    'DROP TRIGGER IF EXISTS banking_transaction_search_delete',
+    'DROP TRIGGER IF EXISTS banking_transaction_search_update',
+    'DROP TABLE IF EXISTS banking_transaction_search',
+]
+
+# Django compares UPPER(merchant::text) for icontains, the index is built
+# on the same expression so LIKE '%term%' is served by trigrams
+POSTGRESQL_CREATE = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """
+    CREATE INDEX IF NOT EXISTS transaction_merchant_trgm_idx
+    ON banking_transaction
+    USING gin ((UPPER(merchant::text)) gin_trgm_ops)
+    """,
+]
+
+POSTGRESQL_DROP = [
+    'DROP INDEX IF EXISTS transaction_merchant_trgm_idx',
+]
+
+
+def run(statements):
+    def forwards(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return forwards
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0014_account_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_CREATE, 'postgresql': POSTGRESQL_CREATE}),
+            run({'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP}),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.10 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0015_transaction_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255)),
+                ('message', models.TextField()),
+                ('chunks', models.PositiveIntegerField(default=0, help_text='Chunks of recipients dispatched')),
+                ('chunks_done', models.PositiveIntegerField(default=0)),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0, help_text='Recipients of chunks that failed after all retries')),
+                ('status', models.CharField(choices=[('running', 'running'), ('done', 'done')], default='running', max_length=10)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+    ]
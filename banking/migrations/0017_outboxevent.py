@@ -0,0 +1,34 @@
+# Generated by Django 2.2.10 on 2026-10-18 19:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0016_emailrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='Public identifier')),
+                ('kind', models.CharField(choices=[('deposit', 'deposit'), ('transaction', 'transaction'), ('transfer_in', 'transfer in'), ('transfer_out', 'transfer out'), ('withdrawal', 'withdrawal'), ('status', 'status')], max_length=12)),
+                ('payload', models.TextField(help_text='Event data in JSON')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('dispatched', models.DateTimeField(blank=True, null=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='banking.Account')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(condition=models.Q(dispatched__isnull=True), fields=['id'], name='outboxevent_pending_idx'),
+        ),
+    ]
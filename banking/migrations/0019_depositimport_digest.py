@@ -0,0 +1,18 @@
+# Generated by Django 2.2.10 on 2026-10-18 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0018_webhooks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='depositimport',
+            name='digest',
+            field=models.CharField(blank=True, help_text='SHA-256 of the imported file', max_length=64),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.10 on 2026-10-18 20:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_pending_entries(apps, schema_editor):
+    """ Turn ledger entries waiting for a shard fold into shard credits """
+    LedgerEntry = apps.get_model('banking', 'LedgerEntry')
+    ShardCredit = apps.get_model('banking', 'ShardCredit')
+    pending = LedgerEntry.objects.filter(sequence__isnull=True).order_by('pk')
+    ShardCredit.objects.bulk_create(
+        ShardCredit(
+            account_id=entry.account_id,
+            kind=entry.kind,
+            amount=entry.amount,
+            reference=entry.reference
+        )
+        for entry in pending.iterator()
+    )
+    pending.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0019_depositimport_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardCredit',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('opening', 'opening'), ('transfer', 'transfer'), ('transaction', 'transaction'), ('deposit', 'deposit'), ('withdrawal', 'withdrawal')], max_length=12)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('reference', models.PositiveIntegerField(help_text='Id of transfer or deposit', null=True)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shard_credits', to='banking.Account')),
+            ],
+        ),
+        migrations.RunPython(move_pending_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.10 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0020_shardcredit'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, help_text='Balance after the entry', max_digits=12),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='sequence',
+            field=models.PositiveIntegerField(),
+        ),
+    ]
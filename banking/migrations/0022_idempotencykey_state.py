@@ -0,0 +1,34 @@
+# Generated by Django 2.2.10 on 2026-10-18 19:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0021_ledgerentry_not_null'),
+    ]
+
+    operations = [
+        # Keys stored so far have their response
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='state',
+            field=models.CharField(choices=[('in_progress', 'in progress'), ('done', 'done')], default='done', max_length=12),
+        ),
+        migrations.AlterField(
+            model_name='idempotencykey',
+            name='state',
+            field=models.CharField(choices=[('in_progress', 'in progress'), ('done', 'done')], default='in_progress', max_length=12),
+        ),
+        migrations.AlterField(
+            model_name='idempotencykey',
+            name='data',
+            field=models.TextField(blank=True, help_text='Response data in JSON'),
+        ),
+        migrations.AlterField(
+            model_name='idempotencykey',
+            name='status',
+            field=models.PositiveSmallIntegerField(help_text='Status code of the response', null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.10 on 2026-10-18 20:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0022_idempotencykey_state'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='webhookdelivery',
+            name='webhookdelivery_pending_idx',
+        ),
+        migrations.AlterField(
+            model_name='webhookdelivery',
+            name='status',
+            field=models.CharField(choices=[('pending', 'pending'), ('sending', 'sending'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='webhookdelivery',
+            index=models.Index(condition=models.Q(status__in=['pending', 'sending']), fields=['next_attempt'], name='webhookdelivery_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.10 on 2026-10-18 20:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0023_webhookdelivery_sending'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='reference',
+            field=models.PositiveIntegerField(help_text='Id of transfer, transaction, deposit or withdrawal, empty for opening entries only', null=True),
+        ),
+        migrations.AlterField(
+            model_name='shardcredit',
+            name='reference',
+            field=models.PositiveIntegerField(help_text='Id of transfer or deposit'),
+        ),
+        migrations.AddConstraint(
+            model_name='ledgerentry',
+            constraint=models.CheckConstraint(check=models.Q(('kind', 'opening'), ('reference__isnull', False), _connector='OR'), name='ledgerentry_reference_required'),
+        ),
+    ]
@@ -1,12 +1,22 @@
+import functools
+import json
+import operator
+import random
+import secrets
 import uuid
+from collections import defaultdict
 from decimal import Decimal
 
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
-from django.db import models, transaction
+from django.db import connections, models, router, transaction
+from django.db.models import F, Q, Case, When, Value, Sum, sql
+from django.utils import timezone
 
 from banking.exceptions import InvalidAccountReceiver, InvalidAccount, \
     InvalidAmount
+from banking.utils import retry_on_conflict
 
 
 class AccountActiveManager(models.Manager):
@@ -14,6 +24,108 @@ class AccountActiveManager(models.Manager):
         return super().get_queryset().filter(status=Account.ACTIVE)
 
 
+def generate_secret():
+    return secrets.token_hex(32)
+
+
+def lock_accounts(*accounts):
+    """
+    Lock account rows with SELECT ... FOR UPDATE in primary key order.
+    A fixed order means two transfers between the same accounts in
+    opposite directions wait for each other instead of deadlocking.
+    Return {pk: status} of the locked rows.
+    """
+    pks = sorted({account.pk for account in accounts})
+    return dict(
+        Account.objects.select_for_update()
+        .filter(pk__in=pks)
+        .order_by('pk')
+        .values_list('pk', 'status')
+    )
+
+
+def can_return_from_update(connection):
+    """ PostgreSQL and SQLite 3.35+ support UPDATE ... RETURNING """
+    if connection.vendor == 'postgresql':
+        return True
+    return (connection.vendor == 'sqlite'
+            and connection.Database.sqlite_version_info >= (3, 35))
+
+
+def update_returning(queryset, fields, **values):
+    """
+    Update rows of queryset and read fields of the changed rows.
+    Backends with UPDATE ... RETURNING do both in one query, others lock
+    the rows first so the read sees exactly the rows that were changed.
+    :return: list of tuples of field values
+    """
+    connection = connections[queryset.db]
+    if not can_return_from_update(connection):
+        pks = list(queryset.select_for_update().values_list('pk', flat=True))
+        if not pks:
+            return []
+        changed = queryset.model.objects.filter(pk__in=pks)
+        changed.update(**values)
+        return list(changed.values_list(*fields))
+
+    query = queryset.query.chain(sql.UpdateQuery)
+    query.add_update_values(values)
+    compiler = query.get_compiler(queryset.db)
+    compiler.pre_sql_setup()
+    statement, params = compiler.as_sql()
+    model_fields = [queryset.model._meta.get_field(name) for name in fields]
+    columns = ', '.join(connection.ops.quote_name(field.column)
+                        for field in model_fields)
+    with connection.cursor() as cursor:
+        cursor.execute(f'{statement} RETURNING {columns}', params)
+        rows = cursor.fetchall()
+    return [
+        tuple(from_db(field, value) for field, value in zip(model_fields, row))
+        for row in rows
+    ]
+
+
+def from_db(field, value):
+    # SQLite gives back the result of decimal arithmetic as int or float
+    if isinstance(field, models.DecimalField) and value is not None:
+        return Decimal(str(value)).quantize(
+            Decimal(10) ** -field.decimal_places)
+    return value
+
+
+def update_account(pk, condition=Q(), **values):
+    """
+    Update account row if it matches condition and read its new balance
+    and sequence.
+    :return: (balance, sequence), None if the row didn't match
+    """
+    rows = update_returning(Account.objects.filter(condition, pk=pk),
+                            ['balance', 'sequence'], **values)
+    return rows[0] if rows else None
+
+
+def bulk_insert(objs):
+    """
+    Insert objs of one model with bulk_create and set their pks.
+    Backends that can't return ids of a bulk insert (SQLite) hold the
+    write lock of the insert to the end of the transaction, so the newest
+    rows read back in the same transaction are the inserted ones, in order.
+    """
+    if not objs:
+        return objs
+    model = type(objs[0])
+    using = router.db_for_write(model)
+    if connections[using].features.can_return_ids_from_bulk_insert:
+        return model.objects.bulk_create(objs)
+    with transaction.atomic(using=using, savepoint=False):
+        model.objects.bulk_create(objs)
+        pks = list(model.objects.order_by('-pk')
+                   .values_list('pk', flat=True)[:len(objs)])
+    for obj, pk in zip(objs, reversed(pks)):
+        obj.pk = pk
+    return objs
+
+
 class Customer(models.Model):
     uid = models.UUIDField(
         unique=True,
@@ -77,6 +189,17 @@ class Account(models.Model):
         max_length=10,
         default=INACTIVE
     )
+    sequence = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text='Number of the last ledger entry'
+    )
+    balance_shards = models.PositiveSmallIntegerField(
+        default=0,
+        editable=False,
+        help_text='Number of shard rows credits are spread over, '
+                  '0 keeps the whole balance in the account row'
+    )
 
     objects = models.Manager() # Default manager
     active = AccountActiveManager()  # New manager for active accounts
@@ -87,6 +210,371 @@ class Account(models.Model):
     def __str__(self):
         return f'{self.uid}, {self.status}'
 
+    def set_status(self, status):
+        """ Change status and record the change for downstream systems """
+        with transaction.atomic():
+            self.status = status
+            self.save(update_fields=['status'])
+            OutboxEvent.record(OutboxEvent.STATUS, self, status=status)
+
+    def debit(self, amount, entries=1):
+        """
+        Take amount from balance with a single conditional UPDATE.
+        The row is changed only if it still holds enough money, so
+        concurrent debits can't overdraw the account. Debits of a sharded
+        account that miss money fold the shards in and try again.
+        :param entries: number of ledger entries the amount is made of
+        """
+        updated = update_account(
+            self.pk,
+            Q(balance__gte=amount),
+            balance=F('balance') - amount,
+            sequence=F('sequence') + entries
+        )
+        if updated is None:
+            if self.balance_shards and self.compact_shards():
+                return self.debit(amount, entries)
+            raise InvalidAmount()
+        self.balance, self.sequence = updated
+
+    def credit(self, amount, entries=1):
+        """
+        Add amount to balance with a single UPDATE.
+        Credits of a sharded account go to a random shard row.
+        :param entries: number of ledger entries the amount is made of
+        :return: True if amount went to a shard
+        """
+        if self.balance_shards:
+            updated = BalanceShard.objects.filter(
+                account_id=self.pk,
+                index=random.randrange(self.balance_shards)
+            ).update(balance=F('balance') + amount)
+            if updated:
+                return True
+            # Shards were taken away since the account was read
+            self.balance_shards = Account.objects.filter(pk=self.pk) \
+                .values_list('balance_shards', flat=True).get()
+            return self.credit(amount, entries)
+
+        self.balance, self.sequence = update_account(
+            self.pk,
+            balance=F('balance') + amount,
+            sequence=F('sequence') + entries
+        )
+        return False
+
+    @classmethod
+    def credit_many(cls, credits):
+        """
+        Add amounts to many balances with a single UPDATE.
+        Credits of sharded accounts go to a random shard of each.
+        :param credits: dict {account pk: list of amounts}
+        :return: dict {account pk: (balance, sequence)} after the update,
+        (None, None) for sharded accounts
+        """
+        if not credits:
+            return {}
+        decimal_field = models.DecimalField(max_digits=12, decimal_places=2)
+        increment = Case(
+            *[When(pk=pk, then=Value(sum(amounts)))
+              for pk, amounts in credits.items()],
+            output_field=decimal_field
+        )
+        entries = Case(
+            *[When(pk=pk, then=Value(len(amounts)))
+              for pk, amounts in credits.items()],
+            output_field=models.PositiveIntegerField()
+        )
+        rows = update_returning(
+            cls.objects.filter(pk__in=credits, balance_shards=0),
+            ['id', 'balance', 'sequence'],
+            balance=F('balance') + increment,
+            sequence=F('sequence') + entries
+        )
+        positions = {pk: (balance, sequence) for pk, balance, sequence in rows}
+        if len(positions) == len(credits):
+            return positions
+
+        counts = list(
+            cls.objects.filter(pk__in=set(credits) - set(positions))
+            .values_list('pk', 'balance_shards')
+        )
+        shards = [(pk, random.randrange(count)) for pk, count in counts
+                  if count]
+        missed = [pk for pk, count in counts if not count]
+        if shards:
+            increment = Case(
+                *[When(account_id=pk, then=Value(sum(credits[pk])))
+                  for pk, _ in shards],
+                output_field=decimal_field
+            )
+            chosen = functools.reduce(operator.or_, [
+                Q(account_id=pk, index=index) for pk, index in shards
+            ])
+            updated = BalanceShard.objects.filter(chosen) \
+                .update(balance=F('balance') + increment)
+            if updated < len(shards):
+                # Shards were taken away since balance_shards was read
+                credited = set(BalanceShard.objects.filter(chosen)
+                               .values_list('account_id', 'index'))
+                missed += [pk for pk, index in shards
+                           if (pk, index) not in credited]
+            positions.update({pk: (None, None) for pk, _ in shards})
+
+        for account in cls.objects.filter(pk__in=missed):
+            amounts = credits[account.pk]
+            if account.credit(sum(amounts), entries=len(amounts)):
+                positions[account.pk] = (None, None)
+            else:
+                positions[account.pk] = (account.balance, account.sequence)
+        return positions
+
+    def current_balance(self):
+        """ Balance with money waiting in shards """
+        if not self.balance_shards:
+            return self.balance
+        shards = self.shards.aggregate(total=Sum('balance'))['total']
+        return self.balance + (shards or 0)
+
+    def set_balance_shards(self, count):
+        """
+        Spread credits of account over count shard rows,
+        0 keeps the whole balance in the account row again.
+        """
+        with transaction.atomic():
+            self.compact_shards()
+            BalanceShard.objects.filter(account=self, index__gte=count).delete()
+            BalanceShard.objects.bulk_create(
+                [BalanceShard(account=self, index=index)
+                 for index in range(count)],
+                ignore_conflicts=True
+            )
+            Account.objects.filter(pk=self.pk).update(balance_shards=count)
+            self.balance_shards = count
+
+    def compact_shards(self):
+        """
+        Fold shard balances into the account row.
+        Shard credits waiting for the fold are entered into the ledger in
+        the order they were made.
+        :return: True if anything was folded
+        """
+        with transaction.atomic():
+            # Lock the account row first, like debits do, then every shard
+            # so no credit lands while we fold
+            lock_accounts(self)
+            total = sum(
+                BalanceShard.objects.select_for_update()
+                .filter(account_id=self.pk)
+                .values_list('balance', flat=True)
+            )
+            pending = list(self.shard_credits.order_by('pk'))
+            if not total and not pending:
+                return False
+
+            self.balance, self.sequence = update_account(
+                self.pk,
+                balance=F('balance') + total,
+                sequence=F('sequence') + len(pending)
+            )
+            BalanceShard.objects.filter(account_id=self.pk).update(balance=0)
+
+            balance, sequence = self.balance, self.sequence
+            entries = []
+            for credit in reversed(pending):
+                entries.append(LedgerEntry(
+                    account_id=self.pk,
+                    sequence=sequence,
+                    kind=credit.kind,
+                    amount=credit.amount,
+                    balance=balance,
+                    reference=credit.reference
+                ))
+                balance -= credit.amount
+                sequence -= 1
+            LedgerEntry.objects.bulk_create(entries[::-1])
+            ShardCredit.objects.filter(
+                pk__in=[credit.pk for credit in pending]).delete()
+        return True
+
+
+class BalanceShard(models.Model):
+    """
+    Part of balance of a sharded account.
+    Credits spread over shard rows instead of waiting on one account row.
+    """
+    account = models.ForeignKey(
+        Account,
+        on_delete=models.CASCADE,
+        related_name='shards'
+    )
+    index = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0
+    )
+
+    class Meta:
+        unique_together = ('account', 'index')
+
+    def __str__(self):
+        return f'Account {self.account_id} shard {self.index}: {self.balance}'
+
+
+class LedgerEntry(models.Model):
+    """
+    Append-only record of every balance change.
+    Entries of an account are numbered by Account.sequence and keep
+    the balance after the change, so history and reconciliation read
+    the (account, sequence) index only. Credits to balance shards wait
+    as ShardCredit rows and are entered when the shards are compacted.
+    """
+    OPENING = 'opening'
+    TRANSFER = 'transfer'
+    TRANSACTION = 'transaction'
+    DEPOSIT = 'deposit'
+    WITHDRAWAL = 'withdrawal'
+    KIND_CHOICES = (
+        (OPENING, 'opening'),
+        (TRANSFER, 'transfer'),
+        (TRANSACTION, 'transaction'),
+        (DEPOSIT, 'deposit'),
+        (WITHDRAWAL, 'withdrawal'),
+    )
+
+    account = models.ForeignKey(
+        Account,
+        on_delete=models.CASCADE,
+        related_name='ledger'
+    )
+    sequence = models.PositiveIntegerField()
+    kind = models.CharField(
+        choices=KIND_CHOICES,
+        max_length=12
+    )
+    amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        help_text='Negative for debits'
+    )
+    balance = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        help_text='Balance after the entry'
+    )
+    reference = models.PositiveIntegerField(
+        null=True,
+        help_text='Id of transfer, transaction, deposit or withdrawal, '
+                  'empty for opening entries only'
+    )
+    date = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    class Meta:
+        ordering = ['account', 'sequence']
+        unique_together = ('account', 'sequence')
+        verbose_name_plural = 'ledger entries'
+        constraints = [
+            models.CheckConstraint(
+                check=Q(kind='opening') | Q(reference__isnull=False),
+                name='ledgerentry_reference_required'),
+        ]
+
+    def __str__(self):
+        return f'Account {self.account_id} #{self.sequence}: {self.amount}'
+
+    @classmethod
+    def build(cls, account_id, kind, balance, sequence, amounts, references):
+        """
+        Make entries for the last changes of account balance, oldest first.
+        Changes that went to balance shards give ShardCredit objects.
+        :param balance: balance after the last change, None for shards
+        :param sequence: sequence of the last change, None for shards
+        :param amounts: signed amounts of the changes
+        :param references: ids of movement rows
+        """
+        if sequence is None:
+            return [
+                ShardCredit(account_id=account_id, kind=kind, amount=amount,
+                            reference=reference)
+                for amount, reference in zip(amounts, references)
+            ]
+        entries = []
+        for amount, reference in zip(reversed(amounts), reversed(references)):
+            entries.append(cls(
+                account_id=account_id,
+                sequence=sequence,
+                kind=kind,
+                amount=amount,
+                balance=balance,
+                reference=reference
+            ))
+            balance -= amount
+            sequence -= 1
+        return entries[::-1]
+
+    @classmethod
+    def bulk_record(cls, entries):
+        """ Insert entries made by build, one query per model """
+        by_model = defaultdict(list)
+        for entry in entries:
+            by_model[type(entry)].append(entry)
+        for model, objs in by_model.items():
+            model.objects.bulk_create(objs)
+
+    @classmethod
+    def record(cls, account, kind, amount, reference, pending=False):
+        """
+        Write entry for the last change of account balance.
+        :param pending: amount went to a balance shard
+        """
+        if pending:
+            return ShardCredit.objects.create(
+                account=account,
+                kind=kind,
+                amount=amount,
+                reference=reference
+            )
+        return cls.objects.create(
+            account=account,
+            sequence=account.sequence,
+            kind=kind,
+            amount=amount,
+            balance=account.balance,
+            reference=reference
+        )
+
+
+class ShardCredit(models.Model):
+    """
+    Credit to a balance shard waiting to be entered into the ledger.
+    Compacting the shards turns these into ledger entries and removes them.
+    """
+    account = models.ForeignKey(
+        Account,
+        on_delete=models.CASCADE,
+        related_name='shard_credits'
+    )
+    kind = models.CharField(
+        choices=LedgerEntry.KIND_CHOICES,
+        max_length=12
+    )
+    amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=2
+    )
+    reference = models.PositiveIntegerField(
+        help_text='Id of transfer or deposit'
+    )
+    date = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    def __str__(self):
+        return f'Account {self.account_id} shard credit: {self.amount}'
+
 
 class Transfer(models.Model):
     account_from = models.ForeignKey(
@@ -113,25 +601,34 @@ class Transfer(models.Model):
 
     class Meta:
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['account_from', '-date', '-id'],
+                         name='transfer_from_date_idx'),
+            models.Index(fields=['account_to', '-date', '-id'],
+                         name='transfer_to_date_idx'),
+        ]
 
     def __str__(self):
         return f'{self.account_from} - {self.account_to}'
 
     @classmethod
+    @retry_on_conflict
     def make_transfer(cls, account_from, account_to, amount, comment):
-        if account_from.balance < amount:
-            raise InvalidAmount()
         if account_from == account_to:
             raise InvalidAccount()
         if account_to.status == Account.INACTIVE or account_to.status == Account.BLOCKED:
             raise InvalidAccountReceiver()
 
         with transaction.atomic():
-            account_from.balance -= amount
-            account_from.save()
-
-            account_to.balance += amount
-            account_to.save()
+            # Credits of sharded receivers don't touch the account row
+            if account_to.balance_shards:
+                statuses = lock_accounts(account_from)
+            else:
+                statuses = lock_accounts(account_from, account_to)
+            if statuses.get(account_to.pk, account_to.status) != Account.ACTIVE:
+                raise InvalidAccountReceiver()
+            account_from.debit(amount)
+            pending = account_to.credit(amount)
 
             transfer = cls.objects.create(
                 account_from=account_from,
@@ -139,9 +636,114 @@ class Transfer(models.Model):
                 amount=amount,
                 comment=comment
             )
+            LedgerEntry.record(account_from, LedgerEntry.TRANSFER,
+                               -amount, transfer.pk)
+            LedgerEntry.record(account_to, LedgerEntry.TRANSFER,
+                               amount, transfer.pk, pending)
+            OutboxEvent.objects.bulk_create([
+                OutboxEvent.build(OutboxEvent.TRANSFER_OUT, account_from.pk,
+                                  account_from.uid, transfer, account_to.uid),
+                OutboxEvent.build(OutboxEvent.TRANSFER_IN, account_to.pk,
+                                  account_to.uid, transfer, account_from.uid),
+            ])
 
         return account_from, account_to, transfer
 
+    @classmethod
+    @retry_on_conflict
+    def make_batch_transfer(cls, account_from, transfers):
+        """
+        Make many transfers from one account.
+        Receivers are resolved and locked with one query, the source is
+        debited once with the total and transfers are written with
+        bulk_create. Items with a wrong receiver are skipped, if there is
+        not enough money for the rest the whole batch fails.
+        :param transfers: list of dicts with account_to uid, amount, comment
+        :return: account_from, list of per item results
+        """
+        uids = []
+        for item in transfers:
+            try:
+                uids.append(uuid.UUID(str(item['account_to'])))
+            except ValueError:
+                uids.append(None)
+
+        with transaction.atomic():
+            rows = Account.objects.select_for_update() \
+                .filter(Q(pk=account_from.pk) | Q(uid__in=set(uids) - {None})) \
+                .order_by('pk') \
+                .values_list('pk', 'uid', 'status')
+            receivers = {uid: (pk, status) for pk, uid, status in rows}
+
+            results = []
+            objs = []
+            credits = defaultdict(list)
+            for index, (item, uid) in enumerate(zip(transfers, uids)):
+                result = {
+                    'index': index,
+                    'account_to': str(item['account_to']),
+                    'amount': item['amount'],
+                }
+                pk, status = receivers.get(uid, (None, None))
+                if pk is None or status != Account.ACTIVE:
+                    error = InvalidAccountReceiver()
+                elif pk == account_from.pk:
+                    error = InvalidAccount()
+                else:
+                    error = None
+
+                if error is None:
+                    result['status'] = 'created'
+                    credits[pk].append(item['amount'])
+                    objs.append(cls(
+                        account_from=account_from,
+                        account_to_id=pk,
+                        amount=item['amount'],
+                        comment=item.get('comment', '')
+                    ))
+                else:
+                    result['status'] = 'failed'
+                    result[error.default_code] = error.default_detail
+                results.append(result)
+
+            if objs:
+                account_from.debit(sum(obj.amount for obj in objs),
+                                   entries=len(objs))
+                positions = Account.credit_many(credits)
+                bulk_insert(objs)
+
+                entries = LedgerEntry.build(
+                    account_from.pk, LedgerEntry.TRANSFER,
+                    account_from.balance, account_from.sequence,
+                    [-obj.amount for obj in objs], [obj.pk for obj in objs]
+                )
+                received = defaultdict(list)
+                for obj in objs:
+                    received[obj.account_to_id].append(obj)
+                for pk, transfers in received.items():
+                    entries += LedgerEntry.build(
+                        pk, LedgerEntry.TRANSFER, *positions[pk],
+                        [obj.amount for obj in transfers],
+                        [obj.pk for obj in transfers]
+                    )
+                LedgerEntry.bulk_record(entries)
+
+                receiver_uids = {pk: uid for uid, (pk, _) in receivers.items()}
+                events = []
+                for obj in objs:
+                    to_uid = receiver_uids[obj.account_to_id]
+                    events += [
+                        OutboxEvent.build(OutboxEvent.TRANSFER_OUT,
+                                          account_from.pk, account_from.uid,
+                                          obj, to_uid),
+                        OutboxEvent.build(OutboxEvent.TRANSFER_IN,
+                                          obj.account_to_id, to_uid,
+                                          obj, account_from.uid),
+                    ]
+                OutboxEvent.objects.bulk_create(events)
+
+        return account_from, results
+
 
 class Transaction(models.Model):
     account = models.ForeignKey(
@@ -165,20 +767,24 @@ class Transaction(models.Model):
 
     class Meta:
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['account', '-date', '-id'],
+                         name='transaction_account_date_idx'),
+        ]
 
     def __str__(self):
         return f'Account {self.account.uid} sent {self.amount} to {self.merchant}'
 
     @classmethod
     def make_transaction(cls, account, merchant, amount, comment):
-        if account.balance < amount:
-            raise InvalidAmount()
-
         with transaction.atomic():
-            account.balance -= amount
-            account.save()
+            account.debit(amount)
             tran = cls.objects.create(
                 amount=amount, account=account, merchant=merchant, comment=comment)
+            LedgerEntry.record(account, LedgerEntry.TRANSACTION,
+                               -amount, tran.pk)
+            OutboxEvent.record(OutboxEvent.TRANSACTION, account, tran,
+                               merchant)
 
         return account, tran
 
@@ -202,6 +808,10 @@ class Deposit(models.Model):
 
     class Meta:
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['account', '-date', '-id'],
+                         name='deposit_account_date_idx'),
+        ]
 
     def __str__(self):
         return f'Account {self.account.uid} made a {self.amount} deposit'
@@ -210,14 +820,16 @@ class Deposit(models.Model):
     def make_deposit(cls, account, amount, comment):
 
         with transaction.atomic():
-            account.balance += amount
-            account.save()
+            pending = account.credit(amount)
 
             deposit = cls.objects.create(
                 account=account,
                 amount=amount,
                 comment=comment
             )
+            LedgerEntry.record(account, LedgerEntry.DEPOSIT,
+                               amount, deposit.pk, pending)
+            OutboxEvent.record(OutboxEvent.DEPOSIT, account, deposit)
 
         return account, deposit
 
@@ -238,22 +850,491 @@ class Withdrawal(models.Model):
 
     class Meta:
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['account', '-date', '-id'],
+                         name='withdrawal_account_date_idx'),
+        ]
 
     def __str__(self):
         return f'Account {self.account.uid} made withdrawal a {self.amount}'
 
     @classmethod
     def make_withdrawal(cls, account, amount):
-        if account.balance < amount:
-            raise InvalidAmount()
-
         with transaction.atomic():
-            account.balance -= amount
-            account.save()
+            account.debit(amount)
 
             deposit = cls.objects.create(
                 account=account,
                 amount=amount
             )
+            LedgerEntry.record(account, LedgerEntry.WITHDRAWAL,
+                               -amount, deposit.pk)
+            OutboxEvent.record(OutboxEvent.WITHDRAWAL, account, deposit)
 
         return account, deposit
+
+
+class DepositImport(models.Model):
+    """
+    Checkpoint of a bulk deposit import.
+    Lets an interrupted import resume after the last applied chunk.
+    """
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = (
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+    )
+
+    name = models.CharField(
+        max_length=255,
+        unique=True
+    )
+    digest = models.CharField(
+        max_length=64,
+        blank=True,
+        help_text='SHA-256 of the imported file'
+    )
+    records = models.PositiveIntegerField(
+        default=0,
+        help_text='Records read from the file so far'
+    )
+    deposits = models.PositiveIntegerField(
+        default=0
+    )
+    errors = models.PositiveIntegerField(
+        default=0
+    )
+    status = models.CharField(
+        choices=STATUS_CHOICES,
+        max_length=10,
+        default=RUNNING
+    )
+    created = models.DateTimeField(
+        auto_now_add=True
+    )
+    updated = models.DateTimeField(
+        auto_now=True
+    )
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        return f'{self.name}, {self.status}'
+
+
+class IdempotencyKey(models.Model):
+    """
+    Money-moving request made with Idempotency-Key header.
+    The row is taken in progress in the transaction of the request and
+    gets the response before commit, so the key is held as long as the
+    request runs and is stored together with its changes.
+    """
+    IN_PROGRESS = 'in_progress'
+    DONE = 'done'
+    STATE_CHOICES = (
+        (IN_PROGRESS, 'in progress'),
+        (DONE, 'done'),
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    key = models.CharField(
+        max_length=255
+    )
+    path = models.CharField(
+        max_length=255
+    )
+    fingerprint = models.CharField(
+        max_length=64,
+        help_text='Hash of request data'
+    )
+    state = models.CharField(
+        choices=STATE_CHOICES,
+        max_length=12,
+        default=IN_PROGRESS
+    )
+    status = models.PositiveSmallIntegerField(
+        null=True,
+        help_text='Status code of the response'
+    )
+    data = models.TextField(
+        blank=True,
+        help_text='Response data in JSON'
+    )
+    created = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    class Meta:
+        ordering = ['-created']
+        unique_together = ('user', 'path', 'key')
+
+    def __str__(self):
+        return f'{self.key}, {self.path}'
+
+
+class Operation(models.Model):
+    """
+    Money-moving request queued for the account write queue.
+    Operations of one partition are applied in order by a single consumer.
+    """
+    TRANSFER = 'transfer'
+    TRANSACTION = 'transaction'
+    DEPOSIT = 'deposit'
+    WITHDRAWAL = 'withdrawal'
+    KIND_CHOICES = (
+        (TRANSFER, 'transfer'),
+        (TRANSACTION, 'transaction'),
+        (DEPOSIT, 'deposit'),
+        (WITHDRAWAL, 'withdrawal'),
+    )
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'pending'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    )
+
+    uid = models.UUIDField(
+        unique=True,
+        editable=False,
+        default=uuid.uuid4,
+        verbose_name='Public identifier',
+    )
+    kind = models.CharField(
+        choices=KIND_CHOICES,
+        max_length=12
+    )
+    account = models.ForeignKey(
+        Account,
+        on_delete=models.CASCADE,
+        related_name='operations'
+    )
+    partition = models.PositiveSmallIntegerField()
+    payload = models.TextField(
+        help_text='Operation data in JSON'
+    )
+    status = models.CharField(
+        choices=STATUS_CHOICES,
+        max_length=10,
+        default=PENDING
+    )
+    result = models.TextField(
+        blank=True,
+        help_text='Result or error in JSON'
+    )
+    created = models.DateTimeField(
+        auto_now_add=True
+    )
+    processed = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['partition', 'status', 'id'],
+                         name='operation_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.uid}, {self.status}'
+
+
+class ExchangeRate(models.Model):
+    """
+    Currency exchange rate in effect from date.
+    A row is stored only when the rate of its currency changes.
+    """
+    ccy = models.CharField(
+        max_length=3
+    )
+    base_ccy = models.CharField(
+        max_length=3
+    )
+    buy = models.DecimalField(
+        max_digits=16,
+        decimal_places=5
+    )
+    sale = models.DecimalField(
+        max_digits=16,
+        decimal_places=5
+    )
+    date = models.DateTimeField(
+        default=timezone.now
+    )
+
+    class Meta:
+        ordering = ['-date']
+        indexes = [
+            models.Index(fields=['ccy', '-date', '-id'],
+                         name='exchangerate_ccy_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.ccy} - {self.base_ccy}: {self.buy} / {self.sale}'
+
+    @classmethod
+    def record(cls, rates, previous=None):
+        """
+        Store rates that differ from previous ones
+        :param rates: list of dicts with ccy, base_ccy, buy and sale
+        :param previous: rates of the last refresh
+        """
+        previous = {rate['ccy']: rate for rate in previous or []}
+        date = timezone.now()
+        return cls.objects.bulk_create([
+            cls(date=date, **rate) for rate in rates
+            if previous.get(rate['ccy']) != rate
+        ])
+
+
+class EmailRun(models.Model):
+    """
+    Progress of a mass email sent in chunks by parallel tasks.
+    Counters are updated by every chunk as it finishes.
+    """
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = (
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+    )
+
+    subject = models.CharField(
+        max_length=255
+    )
+    message = models.TextField()
+    chunks = models.PositiveIntegerField(
+        default=0,
+        help_text='Chunks of recipients dispatched'
+    )
+    chunks_done = models.PositiveIntegerField(
+        default=0
+    )
+    sent = models.PositiveIntegerField(
+        default=0
+    )
+    failed = models.PositiveIntegerField(
+        default=0,
+        help_text='Recipients of chunks that failed after all retries'
+    )
+    status = models.CharField(
+        choices=STATUS_CHOICES,
+        max_length=10,
+        default=RUNNING
+    )
+    created = models.DateTimeField(
+        auto_now_add=True
+    )
+    updated = models.DateTimeField(
+        auto_now=True
+    )
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        return f'{self.subject}, {self.chunks_done}/{self.chunks} chunks'
+
+    @classmethod
+    def chunk_done(cls, pk, sent, failed=0):
+        """
+        Count a finished chunk of run pk. Chunks finish concurrently,
+        so counters are incremented in the database.
+        """
+        runs = cls.objects.filter(pk=pk)
+        runs.update(
+            chunks_done=F('chunks_done') + 1,
+            sent=F('sent') + sent,
+            failed=F('failed') + failed,
+            updated=timezone.now(),
+        )
+        runs.filter(chunks_done__gte=F('chunks'), status=cls.RUNNING) \
+            .update(status=cls.DONE, updated=timezone.now())
+
+
+class OutboxEvent(models.Model):
+    """
+    Change of an account for downstream systems, written in the same
+    transaction as the change itself. Pending events are claimed and
+    published in batches by banking.outbox.dispatch_events.
+    """
+    DEPOSIT = 'deposit'
+    TRANSACTION = 'transaction'
+    TRANSFER_IN = 'transfer_in'
+    TRANSFER_OUT = 'transfer_out'
+    WITHDRAWAL = 'withdrawal'
+    STATUS = 'status'
+    KIND_CHOICES = (
+        (DEPOSIT, 'deposit'),
+        (TRANSACTION, 'transaction'),
+        (TRANSFER_IN, 'transfer in'),
+        (TRANSFER_OUT, 'transfer out'),
+        (WITHDRAWAL, 'withdrawal'),
+        (STATUS, 'status'),
+    )
+
+    uid = models.UUIDField(
+        unique=True,
+        editable=False,
+        default=uuid.uuid4,
+        verbose_name='Public identifier',
+    )
+    kind = models.CharField(
+        choices=KIND_CHOICES,
+        max_length=12
+    )
+    account = models.ForeignKey(
+        Account,
+        on_delete=models.CASCADE,
+        related_name='events'
+    )
+    payload = models.TextField(
+        help_text='Event data in JSON'
+    )
+    created = models.DateTimeField(
+        auto_now_add=True
+    )
+    dispatched = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # Only pending events are indexed, the index stays small
+            # however long the dispatched history grows
+            models.Index(fields=['id'], name='outboxevent_pending_idx',
+                         condition=Q(dispatched__isnull=True)),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} of account {self.account_id}'
+
+    @classmethod
+    def build(cls, kind, account_id, account_uid, movement=None,
+              counterparty=None, **data):
+        """
+        Make event of account, movement fields go to the payload
+        :param movement: saved transfer, transaction, deposit or withdrawal
+        :param counterparty: uid of the other account or merchant
+        """
+        if movement is not None:
+            data.update(
+                id=movement.pk,
+                amount=movement.amount,
+                comment=getattr(movement, 'comment', ''),
+                counterparty=counterparty,
+                date=movement.date,
+            )
+        data['account'] = account_uid
+        return cls(kind=kind, account_id=account_id,
+                   payload=json.dumps(data, cls=DjangoJSONEncoder))
+
+    @classmethod
+    def record(cls, kind, account, movement=None, counterparty=None, **data):
+        event = cls.build(kind, account.pk, account.uid, movement,
+                          counterparty, **data)
+        event.save()
+        return event
+
+
+class WebhookSubscription(models.Model):
+    """
+    Endpoint of a user called with events of the user's account
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='webhooks'
+    )
+    url = models.URLField(
+        max_length=500
+    )
+    secret = models.CharField(
+        max_length=64,
+        default=generate_secret,
+        editable=False,
+        help_text='Key of the HMAC signature of request bodies'
+    )
+    active = models.BooleanField(
+        default=True
+    )
+    created = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        return f'{self.url}, {self.user_id}'
+
+
+class WebhookDelivery(models.Model):
+    """
+    Event waiting to be sent to a webhook endpoint, or the outcome.
+    Failed attempts are retried at next_attempt with exponential backoff.
+    While a worker sends it, next_attempt is the end of the worker's lease.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'pending'),
+        (SENDING, 'sending'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    )
+
+    subscription = models.ForeignKey(
+        WebhookSubscription,
+        on_delete=models.CASCADE,
+        related_name='deliveries'
+    )
+    event = models.UUIDField(
+        help_text='Public identifier of the outbox event'
+    )
+    payload = models.TextField(
+        help_text='Event in JSON'
+    )
+    status = models.CharField(
+        choices=STATUS_CHOICES,
+        max_length=10,
+        default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0
+    )
+    next_attempt = models.DateTimeField(
+        default=timezone.now
+    )
+    last_error = models.TextField(
+        blank=True
+    )
+    delivered = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        ordering = ['id']
+        verbose_name_plural = 'webhook deliveries'
+        indexes = [
+            models.Index(fields=['next_attempt'],
+                         name='webhookdelivery_pending_idx',
+                         condition=Q(status__in=['pending', 'sending'])),
+        ]
+
+    def __str__(self):
+        return f'{self.event} to {self.subscription_id}, {self.status}'
@@ -0,0 +1,138 @@
+import json
+import logging
+import zlib
+from decimal import Decimal
+from itertools import groupby
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+
+from banking.exceptions import InvalidAccountReceiver
+from banking.models import Account, Operation, Transfer, Transaction, \
+    Deposit, Withdrawal
+
+logger = logging.getLogger(__name__)
+
+WRITE_PARTITIONS = getattr(settings, 'BANKING_WRITE_PARTITIONS', 8)
+WRITE_QUEUE = getattr(settings, 'BANKING_WRITE_QUEUE', 'banking.writes')
+WRITE_BATCH_SIZE = getattr(settings, 'BANKING_WRITE_BATCH_SIZE', 100)
+
+# Field of validated data with the account the operation writes to
+ACCOUNT_FIELDS = {
+    Operation.TRANSFER: 'account_from',
+    Operation.TRANSACTION: 'account',
+    Operation.DEPOSIT: 'account',
+    Operation.WITHDRAWAL: 'account',
+}
+
+
+def get_partition(account):
+    """ Stable partition of account, the same in every process """
+    return zlib.crc32(str(account.uid).encode()) % WRITE_PARTITIONS
+
+
+def get_queue(partition):
+    return f'{WRITE_QUEUE}.{partition}'
+
+
+def enqueue(kind, validated_data):
+    """
+    Save validated data of a money-moving request as pending operation
+    and wake up the consumer of its partition after commit.
+    """
+    from banking.tasks import process_write_partition
+
+    data = dict(validated_data)
+    account = data.pop(ACCOUNT_FIELDS[kind])
+    payload = {
+        name: value.pk if isinstance(value, models.Model) else str(value)
+        for name, value in data.items()
+    }
+    operation = Operation.objects.create(
+        kind=kind,
+        account=account,
+        partition=get_partition(account),
+        payload=json.dumps(payload)
+    )
+    transaction.on_commit(lambda: process_write_partition.apply_async(
+        args=[operation.partition],
+        queue=get_queue(operation.partition)
+    ))
+    return operation
+
+
+def apply_operation(operation):
+    """
+    Run operation with the make_* method of its kind.
+    :return: result as dict
+    """
+    data = json.loads(operation.payload)
+    account = operation.account
+    amount = Decimal(data['amount'])
+
+    if operation.kind == Operation.TRANSFER:
+        account_to = Account.objects.filter(pk=data['account_to']).first()
+        if account_to is None:
+            raise InvalidAccountReceiver()
+        _, _, transfer = Transfer.make_transfer(
+            account, account_to, amount, data.get('comment', ''))
+        return {'transfer': transfer.pk}
+    if operation.kind == Operation.TRANSACTION:
+        _, tran = Transaction.make_transaction(
+            account, data['merchant'], amount, data.get('comment', ''))
+        return {'transaction': tran.pk}
+    if operation.kind == Operation.DEPOSIT:
+        _, deposit = Deposit.make_deposit(
+            account, amount, data.get('comment', ''))
+        return {'deposit': deposit.pk}
+    _, withdrawal = Withdrawal.make_withdrawal(account, amount)
+    return {'withdrawal': withdrawal.pk}
+
+
+def apply_group(operations):
+    """
+    Apply consecutive operations of one account in one transaction.
+    Every operation runs in its own savepoint, so a failed one
+    doesn't roll back the others. Unexpected errors fail the operation
+    and are logged, the rest of the partition goes on.
+    """
+    with transaction.atomic():
+        for operation in operations:
+            try:
+                with transaction.atomic():
+                    result = apply_operation(operation)
+            except APIException as err:
+                operation.status = Operation.FAILED
+                result = {err.default_code: str(err.detail)}
+            except Exception:
+                logger.exception('Operation %s failed', operation.uid)
+                operation.status = Operation.FAILED
+                result = {'error': 'Operation failed.'}
+            else:
+                operation.status = Operation.DONE
+            operation.result = json.dumps(result)
+            operation.processed = timezone.now()
+        Operation.objects.bulk_update(
+            operations, ['status', 'result', 'processed'])
+
+
+def process_partition(partition):
+    """
+    Apply pending operations of partition in the order they were queued.
+    :return: number of processed operations
+    """
+    processed = 0
+    while True:
+        operations = list(
+            Operation.objects.filter(partition=partition,
+                                     status=Operation.PENDING)
+            .select_related('account')
+            .order_by('id')[:WRITE_BATCH_SIZE]
+        )
+        if not operations:
+            return processed
+        for _, group in groupby(operations, key=lambda op: op.account_id):
+            apply_group(list(group))
+        processed += len(operations)
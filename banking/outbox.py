@@ -0,0 +1,94 @@
+import json
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from banking.models import OutboxEvent
+
+OUTBOX_BATCH_SIZE = getattr(settings, 'OUTBOX_BATCH_SIZE', 500)
+OUTBOX_MAX_BATCHES = getattr(settings, 'OUTBOX_MAX_BATCHES', 100)
+OUTBOX_PUBLISHERS = getattr(settings, 'OUTBOX_PUBLISHERS', [
+    'banking.outbox.CeleryPublisher',
+    'banking.webhooks.WebhookPublisher',
+])
+OUTBOX_TASK = getattr(settings, 'OUTBOX_TASK', 'banking.events')
+OUTBOX_QUEUE = getattr(settings, 'OUTBOX_QUEUE', 'banking.events')
+
+
+class CeleryPublisher:
+    """
+    Send a batch of events as one message to OUTBOX_QUEUE.
+    Consumers register a task named OUTBOX_TASK taking a list of events.
+    """
+
+    def publish(self, events):
+        from bank_project.celery import app
+
+        app.send_task(OUTBOX_TASK, args=[events], queue=OUTBOX_QUEUE)
+
+
+@lru_cache(maxsize=None)
+def get_publishers():
+    return [import_string(path)() for path in OUTBOX_PUBLISHERS]
+
+
+def format_event(event):
+    return {
+        'id': str(event.uid),
+        'kind': event.kind,
+        'created': event.created.isoformat(),
+        'data': json.loads(event.payload),
+    }
+
+
+def claim_events(size):
+    """
+    Lock up to size oldest pending events for the current transaction.
+    Rows locked by another dispatcher are skipped, so dispatchers work
+    on different batches in parallel.
+    """
+    pending = OutboxEvent.objects.filter(dispatched__isnull=True) \
+        .order_by('id')
+    if connection.features.has_select_for_update_skip_locked:
+        return list(pending.select_for_update(skip_locked=True)[:size])
+    # SQLite has no row locks. An empty UPDATE takes the database write
+    # lock before reading, so dispatchers take batches one after another.
+    pending.filter(pk=None).update(dispatched=None)
+    return list(pending[:size])
+
+
+def dispatch_batch(size=OUTBOX_BATCH_SIZE):
+    """
+    Publish one batch of pending events with every publisher and mark
+    them dispatched with one UPDATE. If publishing fails, the batch stays
+    pending.
+    :return: number of dispatched events
+    """
+    with transaction.atomic():
+        events = claim_events(size)
+        if not events:
+            return 0
+        batch = [format_event(event) for event in events]
+        for publisher in get_publishers():
+            publisher.publish(batch)
+        OutboxEvent.objects.filter(pk__in=[event.pk for event in events]) \
+            .update(dispatched=timezone.now())
+    return len(events)
+
+
+def dispatch_events(size=OUTBOX_BATCH_SIZE, max_batches=OUTBOX_MAX_BATCHES):
+    """
+    Dispatch batches until the outbox is drained or max_batches are sent.
+    Events are delivered at least once, consumers dedupe them by id.
+    :return: number of dispatched events
+    """
+    total = 0
+    for _ in range(max_batches):
+        dispatched = dispatch_batch(size)
+        total += dispatched
+        if dispatched < size:
+            break
+    return total
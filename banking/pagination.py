@@ -0,0 +1,204 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict, namedtuple
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+from banking.activity import get_activity, format_row, KINDS
+from banking.exceptions import InvalidCursor
+from banking.search import search, search_transactions
+
+Cursor = namedtuple('Cursor', ['reverse', 'date', 'id'])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on (date, id), newest first.
+    A page is read from the cursor position with a range condition
+    instead of OFFSET, so any page costs the same as the first one.
+    Total count is left out unless asked with ?count=true.
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('true', '1'):
+            self.count = queryset.count()
+
+        cursor = self.decode_cursor(request)
+        if cursor is None:
+            queryset = queryset.order_by('-date', '-id')
+        elif cursor.reverse:
+            queryset = queryset.filter(
+                Q(date__gt=cursor.date) | Q(date=cursor.date, id__gt=cursor.id)
+            ).order_by('date', 'id')
+        else:
+            queryset = queryset.filter(
+                Q(date__lt=cursor.date) | Q(date=cursor.date, id__lt=cursor.id)
+            ).order_by('-date', '-id')
+
+        # One extra row tells if there is a page after this one
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if cursor is not None and cursor.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        content = OrderedDict()
+        if self.count is not None:
+            content['count'] = self.count
+        content['next'] = self.get_next_link()
+        content['previous'] = self.get_previous_link()
+        content['results'] = data
+        return Response(content)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        last = self.page[-1]
+        return self.encode_cursor(Cursor(False, last.date, last.id))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            url = self.request.build_absolute_uri()
+            return remove_query_param(url, self.cursor_query_param)
+        first = self.page[0]
+        return self.encode_cursor(Cursor(True, first.date, first.id))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            reverse, date, pk = json.loads(urlsafe_b64decode(encoded.encode()))
+            date = parse_datetime(date)
+            if date is None:
+                raise ValueError
+            return Cursor(bool(reverse), date, int(pk))
+        except (TypeError, ValueError):
+            raise InvalidCursor()
+
+    def encode_cursor(self, cursor):
+        data = json.dumps([int(cursor.reverse), cursor.date.isoformat(),
+                           cursor.id])
+        encoded = urlsafe_b64encode(data.encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+
+class ActivityPagination(KeysetPagination):
+    """
+    Cursor pagination of account activity on (date, kind, id), newest first.
+    The cursor condition goes into every table of the union, so a page
+    is one query whatever its depth.
+    """
+    def paginate_activity(self, account, request):
+        self.request = request
+        cursor = self.decode_cursor(request)
+        rows = list(get_activity(account.pk, cursor, self.page_size + 1))
+        self.has_next = len(rows) > self.page_size
+        self.page = [format_row(row) for row in rows[:self.page_size]]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        return self.encode_cursor((last['date'], last['kind'], last['id']))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            date, kind, pk = json.loads(urlsafe_b64decode(encoded.encode()))
+            date = parse_datetime(date)
+            if date is None or kind not in KINDS:
+                raise ValueError
+            return date, kind, int(pk)
+        except (TypeError, ValueError):
+            raise InvalidCursor()
+
+    def encode_cursor(self, cursor):
+        date, kind, pk = cursor
+        data = json.dumps([date.isoformat(), kind, pk])
+        encoded = urlsafe_b64encode(data.encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+
+class SearchPagination(KeysetPagination):
+    """
+    Pagination of search results with search_after, the cursor holds
+    sort values of the last hit so every page is one search request
+    """
+    def paginate_search(self, phrase, request):
+        self.request = request
+        hits = self.search(phrase, request, self.decode_cursor(request),
+                           self.page_size + 1)
+        self.has_next = len(hits) > self.page_size
+        self.hits = hits[:self.page_size]
+        return [row for row, _ in self.hits]
+
+    def search(self, phrase, request, after, size):
+        return search(phrase, request.user, after, size)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        _, after = self.hits[-1]
+        return self.encode_cursor(after)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            after = json.loads(urlsafe_b64decode(encoded.encode()))
+        except ValueError:
+            raise InvalidCursor()
+        if not isinstance(after, list):
+            raise InvalidCursor()
+        return after
+
+    def encode_cursor(self, after):
+        encoded = urlsafe_b64encode(json.dumps(after).encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+
+class TransactionSearchPagination(SearchPagination):
+    """ Merchant search in transactions of accounts, newest first """
+    def __init__(self, accounts):
+        self.accounts = accounts
+
+    def search(self, phrase, request, after, size):
+        return search_transactions(phrase, self.accounts, after, size)
@@ -0,0 +1,74 @@
+from django.utils import timezone
+from elasticsearch.helpers import parallel_bulk
+
+CHUNK_SIZE = 1000
+THREAD_COUNT = 4
+
+
+def get_actions(doc, index_name, queryset, chunk_size):
+    """ Index actions of all instances streamed from the database """
+    doc_type = doc._doc_type.mapping.doc_type
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        yield {
+            '_index': index_name,
+            '_type': doc_type,
+            '_id': instance.pk,
+            '_source': doc.prepare(instance),
+        }
+
+
+def swap_alias(client, alias, index_name):
+    """
+    Point alias to index_name in one atomic request.
+    A concrete index with the alias name is removed in the same request.
+    Return names of indices the alias pointed to before.
+    """
+    actions = [{'add': {'index': index_name, 'alias': alias}}]
+    old = []
+    if client.indices.exists_alias(name=alias):
+        old = list(client.indices.get_alias(name=alias))
+        actions += [{'remove': {'index': name, 'alias': alias}} for name in old]
+    elif client.indices.exists(index=alias):
+        actions.append({'remove_index': {'index': alias}})
+    client.indices.update_aliases(body={'actions': actions})
+    return old
+
+
+def reindex(index, doc_class, chunk_size=CHUNK_SIZE,
+            thread_count=THREAD_COUNT, keep_old=False):
+    """
+    Build a new versioned index for documents of doc_class and swap it in
+    under the name of index, which becomes an alias. Search keeps using
+    the old index until the swap. Refresh and replicas are off while
+    documents are loaded and restored before the swap.
+    :return: name of the new index, number of indexed and failed documents
+    """
+    alias = index._name
+    index_name = f'{alias}-{timezone.now():%Y%m%d%H%M%S}'
+    new_index = index.clone(index_name)
+    replicas = index._settings.get('number_of_replicas', 1)
+    refresh_interval = index._settings.get('refresh_interval', '1s')
+    new_index.settings(number_of_replicas=0, refresh_interval='-1')
+    new_index.create()
+
+    doc = doc_class()
+    client = doc.connection
+    indexed = failed = 0
+    actions = get_actions(doc, index_name, doc.get_queryset(), chunk_size)
+    for ok, _ in parallel_bulk(client, actions, thread_count=thread_count,
+                               chunk_size=chunk_size, raise_on_error=False):
+        if ok:
+            indexed += 1
+        else:
+            failed += 1
+
+    new_index.put_settings(body={'index': {
+        'number_of_replicas': replicas,
+        'refresh_interval': refresh_interval,
+    }})
+    new_index.refresh()
+    old = swap_alias(client, alias, index_name)
+    if not keep_old:
+        for name in old:
+            client.indices.delete(index=name)
+    return index_name, indexed, failed
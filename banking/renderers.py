@@ -0,0 +1,66 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+from banking.activity import FIELDS
+
+# Rows joined into one chunk of streamed response
+LINES_PER_CHUNK = 500
+
+
+class Echo:
+    """ File-like object that returns written value instead of storing it """
+    def write(self, value):
+        return value
+
+
+def join_lines(lines):
+    """ Join lines into chunks of LINES_PER_CHUNK """
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= LINES_PER_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+class StatementRenderer(BaseRenderer):
+    """
+    Base renderer of account statement.
+    Statement rows are streamed with stream(), render() is used only
+    for error responses of the statement view.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, cls=DjangoJSONEncoder).encode(self.charset)
+
+    def stream(self, rows):
+        return join_lines(self.lines(rows))
+
+    def lines(self, rows):
+        raise NotImplementedError
+
+
+class CSVStatementRenderer(StatementRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def lines(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(FIELDS)
+        for row in rows:
+            yield writer.writerow([row[field] for field in FIELDS])
+
+
+class NDJSONStatementRenderer(StatementRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def lines(self, rows):
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
@@ -1,13 +1,245 @@
-from elasticsearch_dsl.query import Q, MultiMatch, SF
-from .documents import AccountDocument
+import re
+import uuid
+from functools import lru_cache
 
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.models import BooleanField, CharField, F, Func, Q, Value
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+from elasticsearch.exceptions import RequestError
 from elasticsearch_dsl.connections import connections
 
-# Define a default Elasticsearch client
-connections.create_connection(hosts=['127.0.0.1'])
+from .documents import AccountDocument, TransactionDocument
+from .exceptions import InvalidCursor
+from .models import Account, Transaction
+
+SEARCH_BACKEND = getattr(settings, 'SEARCH_BACKEND',
+                         'banking.search.ElasticsearchBackend')
+SOURCE_FIELDS = ['uid', 'status', 'created', 'holder.email']
+TRANSACTION_FIELDS = ['id', 'merchant', 'amount', 'comment', 'date', 'account']
+
+
+def get_client(alias='default'):
+    """
+    Elasticsearch client of this process. Built on first use from
+    ELASTICSEARCH_DSL setting and shared by all searches and documents.
+    """
+    return connections.get_connection(alias)
+
+
+def reset_clients():
+    """
+    Drop clients so the next use builds new ones, forked processes
+    must not share connection pools with their parent
+    """
+    connections.configure()
+    connections.configure(**settings.ELASTICSEARCH_DSL)
+
 
 def get_search_query(phrase):
-    return AccountDocument.search().query("match", holder=phrase)
+    return AccountDocument.search().query('match', **{'holder.email': phrase})
+
+
+def execute(query, after):
+    """ Run query, sort values Elasticsearch can't use are a client error """
+    try:
+        return query.execute()
+    except RequestError:
+        if after is None:
+            raise
+        raise InvalidCursor()
+
+
+class ElasticsearchBackend:
+    """ Search in Elasticsearch indices, rows come from stored documents """
+
+    def search(self, phrase, user, after=None, size=10):
+        query = get_search_query(phrase) \
+            .filter('term', **{'holder.id': user.pk}) \
+            .source(SOURCE_FIELDS).sort('_score', 'uid') \
+            .extra(size=size)
+        if after is not None:
+            query = query.extra(search_after=after)
+        return [(hit.to_dict(), list(hit.meta.sort))
+                for hit in execute(query, after)]
+
+    def search_transactions(self, phrase, accounts, after=None, size=10):
+        query = TransactionDocument.search() \
+            .filter('terms', account=list(accounts)) \
+            .filter('match', merchant={'query': phrase, 'operator': 'and'}) \
+            .source(TRANSACTION_FIELDS) \
+            .sort({'date': 'desc'}, {'id': 'desc'}) \
+            .extra(size=size)
+        if after is not None:
+            query = query.extra(search_after=after)
+        return [(hit.to_dict(), list(hit.meta.sort))
+                for hit in execute(query, after)]
+
+
+def parse_account_cursor(after):
+    """ Score and uid from sort values of the last row of an account page """
+    try:
+        score, uid = after
+        if isinstance(score, bool) or not isinstance(score, (int, float)):
+            raise TypeError
+        return score, uuid.UUID(uid)
+    except (TypeError, ValueError, AttributeError):
+        raise InvalidCursor()
+
+
+def parse_transaction_cursor(after):
+    """ Date and id from sort values of the last row of a transaction page """
+    try:
+        date, pk = after
+        date = parse_datetime(date)
+        if date is None or isinstance(pk, bool):
+            raise ValueError
+        return date, int(pk)
+    except (TypeError, ValueError):
+        raise InvalidCursor()
+
+
+def operator(joiner, *expressions, output_field):
+    """ SQL operator between expressions, e.g. ILIKE or || """
+    return Func(*expressions, arg_joiner=f' {joiner} ',
+                template='(%(expressions)s)', output_field=output_field)
+
+
+class DatabaseBackend:
+    """
+    Search accounts by holder email and name and transactions by merchant
+    with indexes of the database itself: FTS5 tables on SQLite and trigram
+    indexes on PostgreSQL, created by migrations 0014_account_search and
+    0015_transaction_search. Words of the phrase match as prefixes
+    on SQLite and as substrings on PostgreSQL.
+    """
+
+    def search(self, phrase, user, after=None, size=10):
+        queryset = Account.objects.filter(holder=user)
+        if after is not None:
+            after = parse_account_cursor(after)
+        if connection.vendor == 'postgresql':
+            queryset = self.filter_postgresql(queryset, phrase, after)
+        else:
+            queryset = self.filter_sqlite(queryset, phrase, after)
+        if queryset is None:
+            return []
+        rows = queryset.values('uid', 'status', 'created', 'holder__email',
+                               'score')[:size]
+        return [(
+            {
+                'uid': str(row['uid']),
+                'status': row['status'],
+                'created': row['created'],
+                'holder': {'email': row['holder__email']},
+            },
+            [row['score'], str(row['uid'])],
+        ) for row in rows]
+
+    def filter_sqlite(self, queryset, phrase, after):
+        match = get_match_query(phrase)
+        if match is None:
+            return None
+        where = ['banking_account_search.rowid = banking_account.id',
+                 'banking_account_search MATCH %s']
+        params = [match]
+        if after is not None:
+            # Lower rank is a better match
+            score, uid = after
+            where.append('(banking_account_search.rank > %s OR '
+                         '(banking_account_search.rank = %s AND '
+                         'banking_account.uid > %s))')
+            params += [score, score, uid.hex]
+        return queryset.extra(
+            select={'score': 'banking_account_search.rank'},
+            tables=['banking_account_search'],
+            where=where,
+            params=params,
+        ).order_by('score', 'uid')
+
+    def filter_postgresql(self, queryset, phrase, after):
+        pattern = '%{}%'.format(re.sub(r'([\\%_])', r'\\\1', phrase))
+        # Same expressions as the trigram indexes of 0014_account_search
+        name = operator('||', F('holder__first_name'), Value(' '),
+                        F('holder__last_name'), output_field=CharField())
+        matched = operator(
+            'OR',
+            operator('ILIKE', F('holder__email'), Value(pattern),
+                     output_field=BooleanField()),
+            operator('ILIKE', name, Value(pattern),
+                     output_field=BooleanField()),
+            output_field=BooleanField()
+        )
+        queryset = queryset.annotate(
+            matched=matched,
+            score=TrigramSimilarity('holder__email', phrase)
+        ).filter(matched=True)
+        if after is not None:
+            # Higher similarity is a better match
+            score, uid = after
+            queryset = queryset.filter(
+                Q(score__lt=score) | Q(score=score, uid__gt=uid))
+        return queryset.order_by('-score', 'uid')
+
+    def search_transactions(self, phrase, accounts, after=None, size=10):
+        queryset = Transaction.objects.filter(account_id__in=accounts)
+        if after is not None:
+            after = parse_transaction_cursor(after)
+        if connection.vendor == 'postgresql':
+            # Served by the trigram index on UPPER(merchant)
+            queryset = queryset.filter(merchant__icontains=phrase)
+        else:
+            match = get_match_query(phrase)
+            if match is None:
+                return []
+            queryset = queryset.extra(
+                where=['banking_transaction.id IN (SELECT rowid FROM '
+                       'banking_transaction_search WHERE '
+                       'banking_transaction_search MATCH %s)'],
+                params=[match],
+            )
+        if after is not None:
+            date, pk = after
+            queryset = queryset.filter(
+                Q(date__lt=date) | Q(date=date, id__lt=pk))
+        rows = queryset.order_by('-date', '-id') \
+            .values(*TRANSACTION_FIELDS)[:size]
+        return [(row, [row['date'].isoformat(), row['id']]) for row in rows]
+
+
+def get_match_query(phrase):
+    """ FTS5 query matching every word of phrase as a prefix """
+    words = re.findall(r'\w+', phrase)
+    if not words:
+        return None
+    return ' '.join('"{}"*'.format(word) for word in words)
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    return import_string(SEARCH_BACKEND)()
+
+
+def search(phrase, user, after=None, size=10):
+    """
+    Accounts of user matching phrase as dicts with uid, status, created
+    and holder email, found by SEARCH_BACKEND.
+    :param after: sort values of the last row of the previous page
+    :return: list of (row, sort values) pairs, best match first
+    """
+    return get_backend().search(phrase, user, after, size)
+
 
-def search(phrase):
-    return get_search_query(phrase).to_queryset()
+def search_transactions(phrase, accounts, after=None, size=10):
+    """
+    Transactions of accounts with merchant words starting with words
+    of phrase, as dicts with TRANSACTION_FIELDS keys, newest first
+    :param accounts: ids of accounts to search in
+    :param after: sort values of the last row of the previous page
+    :return: list of (row, sort values) pairs
+    """
+    if not accounts:
+        return []
+    return get_backend().search_transactions(phrase, accounts, after, size)
@@ -1,12 +1,20 @@
 import decimal
+import json
+
 import requests
 
+from django.conf import settings
 from django.core.validators import RegexValidator
 from rest_framework import serializers
 
+from banking.activity import KINDS
 from banking.documents import AccountDocument
-from banking.models import Customer, Account, Transfer, Transaction, Deposit
-from banking.utils import get_currency
+from banking.models import Customer, Account, Transfer, Transaction, Deposit, \
+    DepositImport, LedgerEntry, Operation, ExchangeRate, EmailRun, \
+    WebhookSubscription
+from banking.utils import get_usd_rate
+from banking.imports import MAX_UPLOAD_SIZE
+from banking.webhooks import is_public_url
 from users.serializers import CustomUserSerializer
 
 
@@ -35,6 +43,12 @@ class AccountSerializer(serializers.ModelSerializer):
     holder = serializers.HiddenField(
         default=serializers.CurrentUserDefault()
     )
+    balance = serializers.DecimalField(
+        source='current_balance',
+        max_digits=12,
+        decimal_places=2,
+        read_only=True
+    )
     balance_usd = serializers.SerializerMethodField()
 
     class Meta:
@@ -42,11 +56,59 @@ class AccountSerializer(serializers.ModelSerializer):
         fields = ('uid', 'balance', 'holder', 'created', 'status', 'balance_usd')
         read_only_fields = ('uid', 'balance','holder',  'created', 'status', 'balance_usd')
 
+    def usd_rate(self):
+        """
+        Currency exchange for UAH to USD, looked up once and kept
+        in context shared by all accounts of the response
+        """
+        if 'usd_rate' not in self.context:
+            self.context['usd_rate'] = get_usd_rate()
+        return self.context['usd_rate']
+
     def get_balance_usd(self, obj):
         """Account balance in USD"""
-        decimal.getcontext().prec = 2 # set new precision
-        currency = get_currency().json()[0]['sale'] # currency exchange for UAH to USD
-        return obj.balance/decimal.Decimal(currency)
+        rate = self.usd_rate()
+        if rate is None:
+            return None
+        with decimal.localcontext() as ctx:
+            ctx.prec = 2 # set new precision for this conversion only
+            return obj.current_balance()/rate
+
+
+class AccountSearchSerializer(serializers.Serializer):
+    """ Account found by search, read from the stored document """
+    uid = serializers.CharField(read_only=True)
+    status = serializers.CharField(read_only=True)
+    created = serializers.DateTimeField(read_only=True)
+    email = serializers.CharField(source='holder.email', read_only=True)
+
+
+class TransactionSearchSerializer(serializers.Serializer):
+    """ Transaction found by merchant search """
+    account = serializers.IntegerField(read_only=True)
+    merchant = serializers.CharField(read_only=True)
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2,
+                                      read_only=True)
+    comment = serializers.CharField(read_only=True)
+    date = serializers.DateTimeField(read_only=True)
+
+
+class LedgerEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LedgerEntry
+        fields = ('sequence', 'kind', 'amount', 'balance', 'reference', 'date')
+        read_only_fields = fields
+
+
+class ActivitySerializer(serializers.Serializer):
+    """ Movement of account from any history table """
+    id = serializers.IntegerField(read_only=True)
+    kind = serializers.ChoiceField(choices=KINDS, read_only=True)
+    date = serializers.DateTimeField(read_only=True)
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2,
+                                      read_only=True)
+    comment = serializers.CharField(read_only=True)
+    counterparty = serializers.CharField(read_only=True)
 
 
 class TransferSerializer(serializers.ModelSerializer):
@@ -78,6 +140,51 @@ class TransferSerializer(serializers.ModelSerializer):
         return data
 
 
+class TransferItemSerializer(serializers.Serializer):
+    account_to = serializers.CharField()
+    amount = serializers.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        min_value=decimal.Decimal('0.01')
+    )
+    comment = serializers.CharField(
+        required=False,
+        allow_blank=True,
+        default=''
+    )
+
+
+class TransferBatchSerializer(serializers.Serializer):
+    """
+    Many transfers from one account.
+    Items are validated without queries, receivers are resolved
+    all at once by Transfer.make_batch_transfer
+    """
+    def __init__(self, *args, **kwargs):
+        """
+        Set current user in account_from field
+        """
+        super().__init__(*args, **kwargs)
+        if 'request' in self.context:
+            self.fields['account_from'].queryset = self.fields['account_from'] \
+                .queryset.filter(holder=self.context['view'].request.user)
+
+    account_from = serializers.PrimaryKeyRelatedField(
+        queryset=Account.objects.all()
+    )
+    transfers = TransferItemSerializer(
+        many=True,
+        allow_empty=False
+    )
+
+    def validate_transfers(self, value):
+        max_size = getattr(settings, 'TRANSFER_BATCH_MAX_SIZE', 1000)
+        if len(value) > max_size:
+            raise serializers.ValidationError(
+                f'Ensure this field has no more than {max_size} elements.')
+        return value
+
+
 class TransactionSerializer(serializers.ModelSerializer):
     def __init__(self, *args, **kwargs):
         """
@@ -133,3 +240,71 @@ class WithdrawalSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'amount': {'required': True}
         }
+
+
+class DepositImportSerializer(serializers.ModelSerializer):
+    file = serializers.FileField(
+        write_only=True
+    )
+    name = serializers.CharField(
+        required=False,
+        max_length=255
+    )
+
+    class Meta:
+        model = DepositImport
+        fields = ('name', 'file', 'records', 'deposits', 'errors', 'status',
+                  'created', 'updated')
+        read_only_fields = ('records', 'deposits', 'errors', 'status',
+                            'created', 'updated')
+        extra_kwargs = {
+            'name': {'validators': []}
+        }
+
+    def validate_file(self, value):
+        if value.size > MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError(
+                f'File is larger than {MAX_UPLOAD_SIZE} bytes, '
+                f'use the import_deposits management command.')
+        return value
+
+
+class OperationSerializer(serializers.ModelSerializer):
+    result = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Operation
+        fields = ('uid', 'kind', 'status', 'result', 'created', 'processed')
+        read_only_fields = fields
+
+    def get_result(self, obj):
+        """Result or error of applied operation"""
+        return json.loads(obj.result) if obj.result else None
+
+
+class ExchangeRateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ExchangeRate
+        fields = ('ccy', 'base_ccy', 'buy', 'sale', 'date')
+        read_only_fields = fields
+
+
+class EmailRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = EmailRun
+        fields = ('id', 'subject', 'status', 'chunks', 'chunks_done', 'sent',
+                  'failed', 'created', 'updated')
+        read_only_fields = fields
+
+
+class WebhookSubscriptionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WebhookSubscription
+        fields = ('id', 'url', 'secret', 'active', 'created')
+        read_only_fields = ('secret', 'created')
+
+    def validate_url(self, value):
+        if not is_public_url(value):
+            raise serializers.ValidationError(
+                'Enter an http or https URL of a public host.')
+        return value
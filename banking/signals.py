@@ -0,0 +1,172 @@
+import logging
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models, transaction
+from django_elasticsearch_dsl import fields
+from django_elasticsearch_dsl.apps import DEDConfig
+from django_elasticsearch_dsl.registries import registry
+from django_elasticsearch_dsl.signals import BaseSignalProcessor
+from kombu.exceptions import OperationalError as BrokerError
+
+from banking.utils import chunks
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_BATCH_SIZE = getattr(settings, 'SEARCH_INDEX_BATCH_SIZE', 500)
+
+INDEX = 'index'
+DELETE = 'delete'
+
+
+def get_indexed_fields(model):
+    """ Names of model fields that go to documents of the model """
+    indexed = set()
+    for doc in registry.get_documents([model]):
+        for name in doc._doc_type._fields():
+            indexed.add(name)
+            indexed.add(f'{name}_id')
+    return indexed
+
+
+def get_related_indexed_fields(doc, model):
+    """
+    Names of fields of related model that go to documents of doc, read
+    from object fields on relations to model. None if there is no such
+    field, documents may then use any field of model.
+    """
+    indexed = None
+    for name, field in doc._doc_type._fields().items():
+        if not isinstance(field, fields.ObjectField):
+            continue
+        try:
+            relation = doc._doc_type.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if relation.related_model is model:
+            indexed = indexed or set()
+            for prop in field.to_dict().get('properties', {}):
+                indexed.update((prop, f'{prop}_id'))
+    return indexed
+
+
+def is_indexed_save(indexed, update_fields):
+    """ Whether save with update_fields changes any of indexed fields """
+    return update_fields is None or indexed is None or \
+        bool(set(update_fields) & indexed)
+
+
+def get_pks(instances):
+    if instances is None:
+        return []
+    if isinstance(instances, models.Model):
+        return [instances.pk]
+    return [instance.pk for instance in instances]
+
+
+class IndexBatch:
+    """
+    Ids of instances to update in Elasticsearch, sent to the
+    update_search_index task when called on commit
+    """
+    def __init__(self):
+        self.pks = defaultdict(set)
+
+    def add(self, model, action, pks):
+        self.pks[(model._meta.label, action)].update(pks)
+
+    def __call__(self):
+        from banking.tasks import update_search_index
+
+        for (label, action), pks in self.pks.items():
+            try:
+                update_search_index.delay(label, sorted(pks), action)
+            except BrokerError:
+                # The change is committed already, the index catches up
+                # with the next save or with reindex_accounts
+                logger.exception('Search index update of %s was not queued',
+                                 label)
+
+
+def get_batch(connection):
+    """
+    Batch of the current transaction or savepoint, None if there is none.
+    Batches are commit callbacks, so a rollback drops them with the rest
+    of the callbacks of the rolled back block.
+    """
+    if not connection.in_atomic_block:
+        return None
+    savepoint_ids = set(connection.savepoint_ids)
+    for callback_ids, callback in reversed(connection.run_on_commit):
+        if isinstance(callback, IndexBatch) and callback_ids == savepoint_ids:
+            return callback
+    return None
+
+
+class AsyncSignalProcessor(BaseSignalProcessor):
+    """
+    Update Elasticsearch after the database transaction commits.
+    Ids of saved and deleted instances are collected in a batch of the
+    transaction and sent to the update_search_index task on commit,
+    one task per model and action. Saves with update_fields that do not
+    touch indexed fields are skipped, of document and related models alike.
+    """
+    def setup(self):
+        models.signals.post_save.connect(self.handle_save)
+        models.signals.post_delete.connect(self.handle_delete)
+
+    def teardown(self):
+        models.signals.post_save.disconnect(self.handle_save)
+        models.signals.post_delete.disconnect(self.handle_delete)
+
+    def handle_save(self, sender, instance, update_fields=None, **kwargs):
+        if not DEDConfig.autosync_enabled():
+            return
+        if sender in registry.get_models() and \
+                is_indexed_save(get_indexed_fields(sender), update_fields):
+            self.schedule(sender, INDEX, [instance.pk])
+
+        for doc in registry.get_documents():
+            if sender in doc._doc_type.related_models and is_indexed_save(
+                    get_related_indexed_fields(doc, sender), update_fields):
+                related = doc().get_instances_from_related(instance)
+                self.schedule(doc._doc_type.model, INDEX, get_pks(related))
+
+    def handle_delete(self, sender, instance, **kwargs):
+        if DEDConfig.autosync_enabled() and sender in registry.get_models():
+            self.schedule(sender, DELETE, [instance.pk])
+
+    def schedule(self, model, action, pks):
+        if not pks:
+            return
+        batch = get_batch(transaction.get_connection())
+        if batch is not None:
+            batch.add(model, action, pks)
+            return
+        batch = IndexBatch()
+        batch.add(model, action, pks)
+        # Runs at once outside of a transaction
+        transaction.on_commit(batch)
+
+
+def update_documents(label, pks, action=INDEX):
+    """
+    Index or delete documents of model instances with pks,
+    one bulk request per SEARCH_INDEX_BATCH_SIZE instances
+    """
+    model = apps.get_model(label)
+    for doc_class in registry.get_documents([model]):
+        doc = doc_class()
+        for chunk in chunks(sorted(set(pks)), SEARCH_INDEX_BATCH_SIZE):
+            if action == DELETE:
+                doc.bulk([{
+                    '_op_type': DELETE,
+                    '_index': str(doc._doc_type.index),
+                    '_type': doc._doc_type.mapping.doc_type,
+                    '_id': pk,
+                } for pk in chunk], raise_on_error=False)
+            else:
+                doc.update(doc.get_queryset().filter(pk__in=chunk),
+                           refresh=False)
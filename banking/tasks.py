@@ -1,21 +1,136 @@
+from datetime import timedelta
+
+from celery import group
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.utils import timezone
 
 from bank_project.celery import app
 from bank_project.settings import CONTACT_EMAIL
-from banking.utils import currency_email
+from banking.idempotency import IDEMPOTENCY_TTL
+from banking.models import Account, EmailRun, IdempotencyKey, OutboxEvent, \
+    WebhookDelivery
+from banking.operations import process_partition
+from banking.outbox import dispatch_events
+from banking.signals import update_documents
+from banking.utils import currency_email, iter_id_ranges, \
+    refresh_currency as refresh
+
+EMAIL_CHUNK_SIZE = getattr(settings, 'CURRENCY_EMAIL_CHUNK_SIZE', 500)
+EMAIL_CHUNK_RETRIES = getattr(settings, 'CURRENCY_EMAIL_CHUNK_RETRIES', 5)
+EMAIL_CHUNK_RETRY_DELAY = getattr(settings,
+                                  'CURRENCY_EMAIL_CHUNK_RETRY_DELAY', 60)
+OUTBOX_RETENTION = getattr(settings, 'OUTBOX_RETENTION', 60 * 60 * 24 * 7)
 
 
 @app.task
 def send_currency_email():
-    subject, message, emails = currency_email()
-    con = get_connection()
-    # open connection for mass sending
-    con.open()
-    for email in emails:
-        msg = EmailMessage(subject, message, CONTACT_EMAIL, [email],
-                           connection=con)
-        msg.content_subtype = "html"  # Main content is now text/html
-        msg.send()
-    con.close()
+    """
+    Start a currency email run: users are split into chunks of
+    CURRENCY_EMAIL_CHUNK_SIZE by pk and every chunk is sent by its own
+    task of a group. Progress of the run is kept in EmailRun.
+    """
+    subject, message = currency_email()
+    run = EmailRun.objects.create(subject=subject, message=message)
+    users = get_user_model().objects.all()
+    tasks = [send_currency_email_chunk.s(run.pk, first, last)
+             for first, last in iter_id_ranges(users, EMAIL_CHUNK_SIZE)]
+    run.chunks = len(tasks)
+    if not tasks:
+        run.status = EmailRun.DONE
+    run.save(update_fields=['chunks', 'status', 'updated'])
+    if tasks:
+        group(tasks).apply_async()
+    return run.pk
+
+
+@app.task(bind=True, max_retries=EMAIL_CHUNK_RETRIES,
+          default_retry_delay=EMAIL_CHUNK_RETRY_DELAY)
+def send_currency_email_chunk(self, run_id, first, last, sent=0, failed=0):
+    """
+    Send the letter of run to users with pks from first to last
+    over one SMTP connection. A failed chunk is retried from the
+    recipient it failed on, sent and failed count earlier attempts.
+    """
+    run = EmailRun.objects.only('subject', 'message').get(pk=run_id)
+    users = get_user_model().objects.filter(pk__range=(first, last)) \
+        .order_by('pk').values_list('pk', 'email')
+    try:
+        with get_connection() as con:
+            for pk, email in users:
+                first = pk
+                msg = EmailMessage(run.subject, run.message, CONTACT_EMAIL,
+                                   [email])
+                msg.content_subtype = "html"  # Main content is now text/html
+                if con.send_messages([msg]):
+                    sent += 1
+                else:
+                    failed += 1
+    except OSError as err:
+        if self.request.retries >= self.max_retries:
+            failed += users.filter(pk__gte=first).count()
+            EmailRun.chunk_done(run_id, sent=sent, failed=failed)
+            raise
+        raise self.retry(exc=err, args=(run_id, first, last),
+                         kwargs={'sent': sent, 'failed': failed})
+    EmailRun.chunk_done(run_id, sent=sent, failed=failed)
+    return sent
+
+
+@app.task
+def refresh_currency():
+    """ Update cached currency exchange rate ahead of its expiry """
+    refresh()
+
+
+@app.task
+def compact_balance_shards():
+    """ Fold balance shards of sharded accounts into account rows """
+    accounts = Account.objects.filter(balance_shards__gt=0).only(
+        'pk', 'balance_shards')
+    for account in accounts.iterator():
+        account.compact_shards()
+
 
+@app.task
+def delete_expired_idempotency_keys():
+    """ Remove stored responses older than IDEMPOTENCY_KEY_TTL """
+    created = timezone.now() - timedelta(seconds=IDEMPOTENCY_TTL)
+    IdempotencyKey.objects.filter(created__lt=created).delete()
 
+
+@app.task
+def process_write_partition(partition):
+    """
+    Apply queued operations of one partition of the account write queue.
+    Each partition queue needs a worker with concurrency 1.
+    """
+    return process_partition(partition)
+
+
+@app.task
+def update_search_index(label, pks, action):
+    """ Apply changes of saved and deleted instances to Elasticsearch """
+    update_documents(label, pks, action)
+
+
+@app.task
+def dispatch_outbox():
+    """ Publish pending account events to downstream systems """
+    return dispatch_events()
+
+
+@app.task
+def delete_dispatched_events():
+    """
+    Remove events dispatched and webhook deliveries made or given up
+    more than OUTBOX_RETENTION seconds ago
+    """
+    dispatched = timezone.now() - timedelta(seconds=OUTBOX_RETENTION)
+    OutboxEvent.objects.filter(dispatched__lt=dispatched).delete()
+    WebhookDelivery.objects.filter(
+        Q(delivered__lt=dispatched) |
+        Q(status=WebhookDelivery.FAILED, next_attempt__lt=dispatched)
+    ).delete()
@@ -1,11 +1,12 @@
 import uuid
+from unittest import mock
 
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 
-from banking.models import Account
+from banking.models import Account, Deposit
 from banking.serializers import AccountSerializer
 
 
@@ -90,3 +91,32 @@ class PrivateAccountApiTest(APITestCase):
         res = self.client.patch(ACCOUNT_URL, payload)
         self.assertEqual(res.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
 
+
+    def test_account_ledger(self):
+        Deposit.make_deposit(self.account, 100, 'Cash')
+        Deposit.make_deposit(self.account, 50, 'Cash')
+        url = ACCOUNT_URL + str(self.account.uid) + '/ledger/'
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(e['sequence'], e['balance']) for e in res.data['results']],
+            [(1, '100.00'), (2, '150.00')])
+
+    @mock.patch('banking.utils.get_currency')
+    def test_account_list_one_rate_lookup(self, get_currency):
+        get_currency.return_value = [
+            {'ccy': 'EUR', 'base_ccy': 'UAH', 'buy': '29.0', 'sale': '29.5'},
+            {'ccy': 'USD', 'base_ccy': 'UAH', 'buy': '27.0', 'sale': '27.5'},
+        ]
+        for i in range(3):
+            user = get_user_model().objects.create_user(
+                email=f'test{i}@example.com', password='testpassword')
+            Account.objects.create(holder=user, balance=550)
+
+        data = AccountSerializer(Account.objects.all(), many=True).data
+
+        self.assertEqual(get_currency.call_count, 1)
+        self.assertEqual([item['balance_usd'] for item in data],
+                         [20, 20, 20, 0])
@@ -0,0 +1,123 @@
+import csv
+import io
+import json
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+
+from banking.activity import FIELDS
+from banking.models import Account, Transfer, Transaction, Deposit, Withdrawal
+
+
+class ActivityApiTest(APITestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@email.com',
+                                               password='testpassword')
+        self.user2 = get_user_model().objects.create_user(email='test2@email.com',
+                                               password='testpassword')
+        self.account = Account.objects.create(
+            holder=self.user,
+            status=Account.ACTIVE
+        )
+        self.account2 = Account.objects.create(
+            holder=self.user2,
+            status=Account.ACTIVE
+        )
+        now = timezone.now()
+        self.expected = []
+        for i in range(3):
+            # Rows of every kind share the date to check ties
+            date = now - timedelta(minutes=i)
+            rows = (
+                ('deposit', Deposit.objects.create(
+                    account=self.account, amount=100, comment='Cash')),
+                ('transaction', Transaction.objects.create(
+                    account=self.account, merchant='Shop', amount=10)),
+                ('transfer_in', Transfer.objects.create(
+                    account_from=self.account2, account_to=self.account,
+                    amount=20)),
+                ('transfer_out', Transfer.objects.create(
+                    account_from=self.account, account_to=self.account2,
+                    amount=30)),
+                ('withdrawal', Withdrawal.objects.create(
+                    account=self.account, amount=40)),
+            )
+            for kind, obj in rows:
+                type(obj).objects.filter(pk=obj.pk).update(date=date)
+                self.expected.append((date, kind, obj.pk))
+        self.expected.sort(reverse=True)
+        self.url = reverse('banking:account-activity',
+                           kwargs={'uid': self.account.uid})
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_activity(self):
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        first = res.data['results'][0]
+        self.assertEqual(first['kind'], 'withdrawal')
+        self.assertEqual(first['amount'], '40.00')
+        transfer_out = next(item for item in res.data['results']
+                            if item['kind'] == 'transfer_out')
+        self.assertEqual(transfer_out['counterparty'], str(self.account2.uid))
+
+    def test_activity_pages(self):
+        rows = []
+        url = self.url
+        while url:
+            # Account lookup and one query for the page
+            with self.assertNumQueries(2):
+                res = self.client.get(url)
+            rows += [(item['kind'], item['id']) for item in res.data['results']]
+            url = res.data['next']
+
+        self.assertEqual(rows, [(kind, pk) for _, kind, pk in self.expected])
+
+    def test_activity_limit_for_user(self):
+        url = reverse('banking:account-activity',
+                      kwargs={'uid': self.account2.uid})
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def get_statement(self, fmt):
+        url = reverse('banking:account-statement',
+                      kwargs={'uid': self.account.uid, 'format': fmt})
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        return res, b''.join(res.streaming_content).decode()
+
+    def test_statement_csv(self):
+        res, content = self.get_statement('csv')
+
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertTrue(res['Content-Type'].startswith('text/csv'))
+        self.assertEqual(rows[0], list(FIELDS))
+        self.assertEqual([(row[3], int(row[0])) for row in rows[1:]],
+                         [(kind, pk) for _, kind, pk in self.expected])
+
+    def test_statement_ndjson(self):
+        res, content = self.get_statement('ndjson')
+
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), len(self.expected))
+        self.assertEqual(rows[0]['kind'], 'withdrawal')
+        self.assertEqual(rows[0]['amount'], '40.00')
+        transfer_in = next(row for row in rows if row['kind'] == 'transfer_in')
+        self.assertEqual(transfer_in['counterparty'], str(self.account2.uid))
+
+    def test_statement_limit_for_user(self):
+        url = reverse('banking:account-statement',
+                      kwargs={'uid': self.account2.uid, 'format': 'csv'})
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,298 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+import requests
+from kombu.exceptions import OperationalError as BrokerError
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from bank_project.celery import app
+from banking.currency import fetch_rates, PrivatBankProvider, NBUProvider, \
+    LocalProvider, CIRCUIT_FAILURES, CURRENCY_TIMEOUT, get_latest_rate, \
+    clear_rate_cache
+from banking.exceptions import CurrencyUnavailable
+from banking.models import ExchangeRate, EmailRun
+from banking.tasks import send_currency_email, send_currency_email_chunk
+from banking.utils import get_currency, refresh_currency, CURRENCY_KEY, \
+    CURRENCY_LOCK_KEY, CURRENCY_SCHEDULED_KEY, CURRENCY_STALE_AFTER
+
+CURRENCY_URL = reverse('banking:currency')
+EMAIL_RUN_URL = reverse('banking:emailrun-list')
+
+RATES = [
+    {'ccy': 'USD', 'base_ccy': 'UAH', 'buy': '27.0', 'sale': '27.5'},
+]
+
+LOCMEM_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+@mock.patch('banking.tasks.refresh_currency.delay')
+class CurrencyCacheTests(TestCase):
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_cold_cache(self, delay):
+        self.assertEqual(get_currency(), [])
+        self.assertEqual(get_currency(), [])
+
+        delay.assert_called_once_with()
+
+    def test_fresh_rates(self, delay):
+        cache.set(CURRENCY_KEY, {'rates': RATES, 'fetched': time.time()})
+
+        self.assertEqual(get_currency(), RATES)
+        delay.assert_not_called()
+
+    def test_stale_rates(self, delay):
+        fetched = time.time() - CURRENCY_STALE_AFTER - 1
+        cache.set(CURRENCY_KEY, {'rates': RATES, 'fetched': fetched})
+
+        self.assertEqual(get_currency(), RATES)
+        delay.assert_called_once_with()
+
+    def test_broker_down(self, delay):
+        delay.side_effect = BrokerError('Connection refused')
+        fetched = time.time() - CURRENCY_STALE_AFTER - 1
+        cache.set(CURRENCY_KEY, {'rates': RATES, 'fetched': fetched})
+
+        with self.assertLogs('banking.utils', 'WARNING'):
+            self.assertEqual(get_currency(), RATES)
+            self.assertEqual(get_currency(), RATES)
+
+        self.assertEqual(delay.call_count, 2)
+        self.assertIsNone(cache.get(CURRENCY_SCHEDULED_KEY))
+
+    @mock.patch('banking.utils.fetch_rates', return_value=RATES)
+    def test_refresh(self, fetch_rates, delay):
+        self.assertEqual(refresh_currency(), RATES)
+        self.assertEqual(get_currency(), RATES)
+
+    @mock.patch('banking.utils.fetch_rates')
+    def test_refresh_records_changed_rates(self, fetch_rates, delay):
+        changed = [dict(RATES[0], sale='27.6')]
+        for rates in (RATES, RATES, changed):
+            fetch_rates.return_value = rates
+            refresh_currency()
+
+        self.assertEqual(
+            [str(rate.sale) for rate in ExchangeRate.objects.all()],
+            ['27.60000', '27.50000'])
+
+    @mock.patch('banking.utils.fetch_rates')
+    def test_refresh_single_flight(self, fetch_rates, delay):
+        cache.add(CURRENCY_LOCK_KEY, 1)
+
+        self.assertIsNone(refresh_currency())
+        fetch_rates.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CurrencyProviderTests(TestCase):
+
+    def setUp(self):
+        self.primary = PrivatBankProvider()
+        self.secondary = NBUProvider()
+        patcher = mock.patch('banking.currency.get_providers',
+                             return_value=[self.primary, self.secondary])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_privatbank(self):
+        with mock.patch.object(self.primary.session, 'get') as get:
+            get.return_value.json.return_value = [dict(RATES[0], extra='x')]
+            self.assertEqual(fetch_rates(), RATES)
+
+        self.assertEqual(get.call_args[1]['timeout'], CURRENCY_TIMEOUT)
+
+    def test_failover(self):
+        with mock.patch.object(self.primary.session, 'get',
+                               side_effect=requests.ConnectionError), \
+                mock.patch.object(self.secondary.session, 'get') as get:
+            get.return_value.json.return_value = [
+                {'r030': 840, 'txt': 'Долар США', 'rate': 27.5, 'cc': 'USD'},
+                {'r030': 978, 'txt': 'Євро', 'rate': 32.1, 'cc': 'XAU'},
+            ]
+            rates = fetch_rates()
+
+        self.assertEqual(rates, [{'ccy': 'USD', 'base_ccy': 'UAH',
+                                  'buy': '27.5', 'sale': '27.5'}])
+
+    def test_circuit_breaker(self):
+        with mock.patch.object(self.primary.session, 'get',
+                               side_effect=requests.Timeout) as get, \
+                mock.patch.object(self.secondary.session, 'get',
+                                  side_effect=requests.Timeout):
+            for _ in range(CIRCUIT_FAILURES):
+                with self.assertRaises(CurrencyUnavailable):
+                    fetch_rates()
+            get.reset_mock()
+            with self.assertRaises(CurrencyUnavailable):
+                fetch_rates()
+
+        get.assert_not_called()
+
+    def test_local_provider(self):
+        rates = LocalProvider().fetch()
+
+        self.assertEqual([rate['ccy'] for rate in rates],
+                         ['USD', 'EUR', 'RUR', 'BTC'])
+
+
+class ExchangeRateTests(TestCase):
+
+    def setUp(self):
+        clear_rate_cache()
+        self.now = timezone.now()
+        for days, sale in ((3, '27.1'), (2, '27.2'), (1, '27.3')):
+            ExchangeRate.objects.create(
+                ccy='USD', base_ccy='UAH', buy='27.0', sale=sale,
+                date=self.now - timedelta(days=days))
+        ExchangeRate.objects.create(
+            ccy='EUR', base_ccy='UAH', buy='30.0', sale='30.5',
+            date=self.now - timedelta(days=1))
+
+    def tearDown(self):
+        clear_rate_cache()
+
+    def test_latest_rate(self):
+        self.assertEqual(get_latest_rate('USD').sale, Decimal('27.3'))
+        self.assertIsNone(get_latest_rate('GBP'))
+
+    def test_history_api(self):
+        url = reverse('banking:currency-history')
+        start = (self.now - timedelta(days=2, hours=1)).isoformat()
+
+        res = self.client.get(url, {'ccy': 'usd', 'from': start})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([rate['sale'] for rate in res.data['results']],
+                         ['27.30000', '27.20000'])
+
+    def test_history_api_invalid_date(self):
+        url = reverse('banking:currency-history')
+
+        res = self.client.get(url, {'from': '2020-13-45'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CurrencyApiTest(APITestCase):
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_currency(self):
+        cache.set(CURRENCY_KEY, {'rates': RATES, 'fetched': time.time()})
+
+        res = self.client.get(CURRENCY_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, RATES)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+@mock.patch('banking.tasks.EMAIL_CHUNK_SIZE', 2)
+class CurrencyEmailTests(APITestCase):
+
+    def setUp(self):
+        cache.set(CURRENCY_KEY, {'rates': RATES, 'fetched': time.time()})
+        self.users = [
+            get_user_model().objects.create_user(email=f'test{i}@email.com',
+                                                 password='testpassword')
+            for i in range(5)
+        ]
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_run_in_chunks(self):
+        # Chunks of the group run in this process
+        eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, 'task_always_eager', eager)
+
+        with mock.patch('banking.tasks.get_connection',
+                        wraps=mail.get_connection) as get_connection:
+            run_id = send_currency_email()
+
+        run = EmailRun.objects.get(pk=run_id)
+        self.assertEqual(get_connection.call_count, 3)
+        self.assertEqual((run.chunks, run.chunks_done, run.sent, run.failed),
+                         (3, 3, 5, 0))
+        self.assertEqual(run.status, EmailRun.DONE)
+        self.assertCountEqual([msg.to[0] for msg in mail.outbox],
+                              [user.email for user in self.users])
+        self.assertIn('USD', mail.outbox[0].body)
+
+    def test_failed_chunk(self):
+        run = EmailRun.objects.create(subject='Rates', message='USD', chunks=2)
+        first, last = self.users[0].pk, self.users[1].pk
+
+        with mock.patch('banking.tasks.get_connection') as get_connection:
+            get_connection.return_value.__enter__.return_value \
+                .send_messages.side_effect = OSError
+            result = send_currency_email_chunk.apply((run.pk, first, last))
+
+        self.assertIsInstance(result.result, OSError)
+        self.assertEqual(get_connection.call_count,
+                         send_currency_email_chunk.max_retries + 1)
+        run.refresh_from_db()
+        self.assertEqual((run.chunks_done, run.sent, run.failed), (1, 0, 2))
+        self.assertEqual(run.status, EmailRun.RUNNING)
+
+        send_currency_email_chunk.apply((run.pk, self.users[2].pk,
+                                         self.users[4].pk))
+
+        run.refresh_from_db()
+        self.assertEqual((run.chunks_done, run.sent, run.failed), (2, 3, 2))
+        self.assertEqual(run.status, EmailRun.DONE)
+
+    def test_retry_from_failed_recipient(self):
+        run = EmailRun.objects.create(subject='Rates', message='USD', chunks=1)
+        first, last = self.users[0].pk, self.users[2].pk
+
+        with mock.patch('banking.tasks.get_connection') as get_connection:
+            send_messages = get_connection.return_value.__enter__ \
+                .return_value.send_messages
+            send_messages.side_effect = [1, OSError, 1, 1]
+            send_currency_email_chunk.apply((run.pk, first, last))
+
+        self.assertEqual(get_connection.call_count, 2)
+        self.assertEqual(
+            [call[0][0][0].to[0] for call in send_messages.call_args_list],
+            [self.users[0].email, self.users[1].email,
+             self.users[1].email, self.users[2].email])
+        run.refresh_from_db()
+        self.assertEqual((run.chunks_done, run.sent, run.failed), (1, 3, 0))
+        self.assertEqual(run.status, EmailRun.DONE)
+
+    def test_progress_api(self):
+        EmailRun.objects.create(subject='Rates', message='USD', chunks=2)
+        self.client.force_authenticate(user=self.users[0])
+
+        res = self.client.get(EMAIL_RUN_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.users[0].is_staff = True
+        res = self.client.get(EMAIL_RUN_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'][0]['chunks'], 2)
+        self.assertEqual(res.data['results'][0]['status'], EmailRun.RUNNING)
@@ -1,11 +1,20 @@
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 
-from banking.exceptions import InvalidAmount
-from banking.models import Account, Deposit
+from banking.exceptions import InvalidAmount, ImportConflict
+from banking.imports import import_deposits, get_digest, NDJSON
+from banking.models import Account, Deposit, DepositImport, LedgerEntry
 from banking.serializers import DepositSerializer
 
 
@@ -120,3 +129,146 @@ class PrivateDepositApiTest(APITestCase):
 
         res = self.client.patch(DEPOSIT_URL, payload)
         self.assertEqual(res.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+DEPOSIT_IMPORT_URL = reverse('banking:deposit-import-file')
+
+
+class DepositImportTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@email.com',
+                                               password='testpassword')
+        self.user2 = get_user_model().objects.create_user(email='test2@email.com',
+                                               password='testpassword')
+        self.account = Account.objects.create(
+            holder=self.user,
+            status=Account.ACTIVE
+        )
+        self.account2 = Account.objects.create(
+            holder=self.user2,
+            status=Account.ACTIVE
+        )
+        self.lines = [
+            'account,amount,comment\n',
+            f'{self.account.uid},100.00,Cash\n',
+            f'{self.account2.uid},50.00,\n',
+            f'{self.account.uid},20.00,Cash\n',
+            f'{self.account.uid},1.00,Too small\n',
+            'not-uid,100.00,\n',
+        ]
+
+    def test_import_deposits(self):
+        checkpoint = import_deposits(self.lines, 'march.csv', chunk_size=2)
+
+        self.account.refresh_from_db()
+        self.account2.refresh_from_db()
+        self.assertEqual(self.account.balance, 120)
+        self.assertEqual(self.account2.balance, 50)
+        self.assertEqual(Deposit.objects.count(), 3)
+        self.assertEqual(checkpoint.records, 5)
+        self.assertEqual(checkpoint.deposits, 3)
+        self.assertEqual(checkpoint.errors, 2)
+        self.assertEqual(checkpoint.status, DepositImport.DONE)
+        self.assertEqual(
+            list(LedgerEntry.objects.order_by('account', 'sequence')
+                 .values_list('reference', flat=True)),
+            list(Deposit.objects.order_by('account', 'id')
+                 .values_list('pk', flat=True)))
+
+    def test_import_deposits_resume(self):
+        DepositImport.objects.create(name='march.csv', records=2)
+
+        import_deposits(self.lines, 'march.csv', chunk_size=2)
+
+        self.account.refresh_from_db()
+        self.account2.refresh_from_db()
+        self.assertEqual(self.account.balance, 20)
+        self.assertEqual(self.account2.balance, 0)
+
+    def test_import_deposits_done_once(self):
+        import_deposits(self.lines, 'march.csv')
+        import_deposits(self.lines, 'march.csv')
+
+        self.assertEqual(Deposit.objects.count(), 3)
+
+    def test_import_deposits_ndjson(self):
+        lines = [
+            json.dumps({'account': str(self.account.uid), 'amount': '10.50'}),
+            '{broken',
+            '',
+        ]
+
+        checkpoint = import_deposits(lines, 'march.ndjson', fmt=NDJSON)
+
+        self.account.refresh_from_db()
+        self.assertEqual(str(self.account.balance), '10.50')
+        self.assertEqual(checkpoint.errors, 1)
+
+    def test_import_deposits_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'march.csv')
+            with open(path, 'w') as f:
+                f.writelines(self.lines)
+            call_command('import_deposits', path, chunk_size=1,
+                         stdout=io.StringIO())
+
+        self.assertEqual(Deposit.objects.count(), 3)
+        self.assertTrue(DepositImport.objects.filter(name='march.csv').exists())
+
+    def test_import_deposits_api(self):
+        upload = SimpleUploadedFile('march.csv', ''.join(self.lines).encode())
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+
+        res = client.post(DEPOSIT_IMPORT_URL, {'file': upload})
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = get_user_model().objects.create_superuser(
+            email='admin@email.com',
+            password='testpassword')
+        client.force_authenticate(user=admin)
+        upload.seek(0)
+        res = client.post(DEPOSIT_IMPORT_URL, {'file': upload})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['deposits'], 3)
+        self.assertEqual(res.data['name'], 'march.csv')
+
+    def test_import_deposits_name_reused(self):
+        import_deposits(self.lines, 'march.csv',
+                        digest=get_digest([b'first file']))
+
+        with self.assertRaises(ImportConflict):
+            import_deposits(self.lines[:2], 'march.csv',
+                            digest=get_digest([b'second file']))
+        self.assertEqual(Deposit.objects.count(), 3)
+
+    def test_import_deposits_api_name_reused(self):
+        admin = get_user_model().objects.create_superuser(
+            email='admin@email.com',
+            password='testpassword')
+        client = APIClient()
+        client.force_authenticate(user=admin)
+        client.post(DEPOSIT_IMPORT_URL, {'file': SimpleUploadedFile(
+            'march.csv', ''.join(self.lines).encode())})
+
+        upload = SimpleUploadedFile('march.csv',
+                                    ''.join(self.lines[:2]).encode())
+        res = client.post(DEPOSIT_IMPORT_URL, {'file': upload})
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Deposit.objects.count(), 3)
+
+    @mock.patch('banking.serializers.MAX_UPLOAD_SIZE', 10)
+    def test_import_deposits_api_too_large(self):
+        admin = get_user_model().objects.create_superuser(
+            email='admin@email.com',
+            password='testpassword')
+        client = APIClient()
+        client.force_authenticate(user=admin)
+        upload = SimpleUploadedFile('march.csv', ''.join(self.lines).encode())
+
+        res = client.post(DEPOSIT_IMPORT_URL, {'file': upload})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Deposit.objects.exists())
@@ -0,0 +1,119 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+
+from banking.models import Account, Transfer, Deposit, IdempotencyKey
+
+TRANSFER_URL = reverse('banking:transfer-list')
+DEPOSIT_URL = reverse('banking:deposit-list')
+
+
+class IdempotencyKeyApiTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='test@email.com',
+                                               password='testpassword')
+        self.user2 = get_user_model().objects.create_user(email='test2@email.com',
+                                               password='testpassword')
+        self.account = Account.objects.create(
+            holder=self.user,
+            balance=300,
+            status=Account.ACTIVE
+        )
+        self.account2 = Account.objects.create(
+            holder=self.user2,
+            status=Account.ACTIVE
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.payload = {
+            'account_from': self.account.pk,
+            'account_to': str(self.account2.uid),
+            'amount': '100.00',
+            'comment': 'For you'
+        }
+
+    def test_repeated_key_replays_response(self):
+        res = self.client.post(TRANSFER_URL, self.payload,
+                               HTTP_IDEMPOTENCY_KEY='key-1')
+        res2 = self.client.post(TRANSFER_URL, self.payload,
+                                HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res2.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data, res2.data)
+        self.assertEqual(res2['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transfer.objects.count(), 1)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 200)
+
+    def test_replay_from_table(self):
+        self.client.post(TRANSFER_URL, self.payload,
+                         HTTP_IDEMPOTENCY_KEY='key-1')
+        cache.clear()
+        res = self.client.post(TRANSFER_URL, self.payload,
+                               HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Transfer.objects.count(), 1)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_key_reused_for_other_request(self):
+        self.client.post(TRANSFER_URL, self.payload,
+                         HTTP_IDEMPOTENCY_KEY='key-1')
+        self.payload['amount'] = '50.00'
+        res = self.client.post(TRANSFER_URL, self.payload,
+                               HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertEqual(res.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Transfer.objects.count(), 1)
+
+    def test_keys_are_per_endpoint(self):
+        self.client.post(TRANSFER_URL, self.payload,
+                         HTTP_IDEMPOTENCY_KEY='key-1')
+        res = self.client.post(DEPOSIT_URL, {
+            'account': self.account.pk,
+            'amount': '100.00',
+            'comment': 'Cash'
+        }, HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Deposit.objects.count(), 1)
+
+    def test_without_key(self):
+        self.client.post(TRANSFER_URL, self.payload)
+        self.client.post(TRANSFER_URL, self.payload)
+
+        self.assertEqual(Transfer.objects.count(), 2)
+
+    def test_key_in_flight(self):
+        IdempotencyKey.objects.create(user=self.user, path=TRANSFER_URL,
+                                      key='key-1', fingerprint='')
+
+        res = self.client.post(TRANSFER_URL, self.payload,
+                               HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Transfer.objects.count(), 0)
+
+    def test_stored_with_changes(self):
+        with mock.patch('banking.idempotency.store',
+                        side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.post(TRANSFER_URL, self.payload,
+                                 HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertEqual(Transfer.objects.count(), 0)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        res = self.client.post(TRANSFER_URL, self.payload,
+                               HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(IdempotencyKey.objects.get().state,
+                         IdempotencyKey.DONE)
@@ -1,11 +1,17 @@
 import datetime
 import uuid
+from unittest import mock, skipUnless
 
-from django.test import TestCase
+from django.contrib.admin import site
+from django.db import IntegrityError, connection
+from django.test import TestCase, RequestFactory
 from django.contrib.auth import get_user_model
 
+from banking.exceptions import InvalidAmount
 from banking.models import Account, Customer, Deposit, Withdrawal, Transfer, \
-    Transaction
+    Transaction, LedgerEntry, BalanceShard, can_return_from_update
+from banking.views import TransferView, TransactionView, DepositView, \
+    WithdrawalView
 
 
 class AccountModelTests(TestCase):
@@ -155,3 +161,255 @@ class WithdrawalModelTests(TestCase):
 
         self.assertIsInstance(withdrawal, Withdrawal)
         self.assertEqual(withdrawal.__str__(), f'Account {self.account.uid} made withdrawal a {withdrawal.amount}')
+
+
+class LedgerEntryModelTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@email.com',
+                                               password='testpassword')
+        self.user2 = get_user_model().objects.create_user(email='test2@email.com',
+                                               password='testpassword')
+        self.account = Account.objects.create(
+            holder=self.user,
+            status=Account.ACTIVE
+        )
+        self.account2 = Account.objects.create(
+            holder=self.user2,
+            status=Account.ACTIVE
+        )
+
+    def test_ledger_entries(self):
+        _, deposit = Deposit.make_deposit(self.account, 300, 'Cash')
+        _, _, transfer = Transfer.make_transfer(
+            self.account, self.account2, 100, 'For you')
+        Transaction.make_transaction(self.account, 'GH', 50, '')
+        Withdrawal.make_withdrawal(self.account, 20)
+
+        entries = list(self.account.ledger.values_list(
+            'sequence', 'kind', 'amount', 'balance'))
+        self.assertEqual(entries, [
+            (1, LedgerEntry.DEPOSIT, 300, 300),
+            (2, LedgerEntry.TRANSFER, -100, 200),
+            (3, LedgerEntry.TRANSACTION, -50, 150),
+            (4, LedgerEntry.WITHDRAWAL, -20, 130),
+        ])
+        self.assertEqual(self.account.ledger.first().reference, deposit.pk)
+
+        entry = self.account2.ledger.get()
+        self.assertEqual((entry.sequence, entry.amount), (1, 100))
+        self.assertEqual(entry.reference, transfer.pk)
+
+    def test_ledger_entries_batch_transfer(self):
+        Deposit.make_deposit(self.account, 300, 'Cash')
+        Transfer.make_batch_transfer(self.account, [
+            {'account_to': self.account2.uid, 'amount': 100},
+            {'account_to': self.account2.uid, 'amount': 50},
+        ])
+
+        self.assertEqual(
+            list(self.account.ledger.values_list('sequence', 'balance')),
+            [(1, 300), (2, 200), (3, 150)])
+        self.assertEqual(
+            list(self.account2.ledger.values_list('sequence', 'balance')),
+            [(1, 100), (2, 150)])
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.sequence, 3)
+        self.assertEqual(self.account.balance, self.account.ledger.last().balance)
+
+        transfers = list(Transfer.objects.order_by('id')
+                         .values_list('pk', 'amount'))
+        self.assertEqual(
+            list(self.account.ledger.filter(kind=LedgerEntry.TRANSFER)
+                 .values_list('reference', 'amount')),
+            [(pk, -amount) for pk, amount in transfers])
+        self.assertEqual(
+            list(self.account2.ledger.values_list('reference', 'amount')),
+            transfers)
+
+    def test_reference_required(self):
+        with self.assertRaises(IntegrityError):
+            LedgerEntry.objects.create(account=self.account, sequence=1,
+                                       kind=LedgerEntry.DEPOSIT, amount=10,
+                                       balance=10)
+
+    def test_admin_read_only(self):
+        request = RequestFactory().get('/')
+        request.user = get_user_model().objects.create_superuser(
+            email='admin@email.com', password='testpassword')
+        model_admin = site._registry[LedgerEntry]
+
+        self.assertTrue(model_admin.has_view_permission(request))
+        self.assertFalse(model_admin.has_add_permission(request))
+        self.assertFalse(model_admin.has_change_permission(request))
+        self.assertFalse(model_admin.has_delete_permission(request))
+
+    def test_ledger_failed_debit(self):
+        with self.assertRaises(InvalidAmount):
+            Withdrawal.make_withdrawal(self.account, 20)
+
+        self.assertFalse(self.account.ledger.exists())
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.sequence, 0)
+
+    @skipUnless(can_return_from_update(connection),
+                'Needs UPDATE ... RETURNING')
+    def test_debit_single_query(self):
+        self.account.credit(300)
+
+        with self.assertNumQueries(1):
+            self.account.debit(100)
+
+        self.assertEqual((self.account.balance, self.account.sequence),
+                         (200, 2))
+
+    @mock.patch('banking.models.can_return_from_update', return_value=False)
+    def test_ledger_entries_without_returning(self, _):
+        Deposit.make_deposit(self.account, 300, 'Cash')
+        Withdrawal.make_withdrawal(self.account, 20)
+
+        self.assertEqual(
+            list(self.account.ledger.values_list('sequence', 'balance')),
+            [(1, 300), (2, 280)])
+        self.assertEqual(self.account.balance, 280)
+
+
+class BalanceShardModelTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@email.com',
+                                               password='testpassword')
+        self.user2 = get_user_model().objects.create_user(email='test2@email.com',
+                                               password='testpassword')
+        self.account = Account.objects.create(
+            holder=self.user,
+            balance=1000,
+            status=Account.ACTIVE
+        )
+        self.merchant = Account.objects.create(
+            holder=self.user2,
+            status=Account.ACTIVE
+        )
+        self.merchant.set_balance_shards(4)
+
+    def test_credits_go_to_shards(self):
+        for _ in range(3):
+            Transfer.make_transfer(self.account, self.merchant, 100, '')
+        Deposit.make_deposit(self.merchant, 50, 'Cash')
+        Transfer.make_batch_transfer(self.account, [
+            {'account_to': self.merchant.uid, 'amount': 10},
+        ])
+
+        merchant = Account.objects.get(pk=self.merchant.pk)
+        self.assertEqual(merchant.balance, 0)
+        self.assertEqual(merchant.current_balance(), 360)
+        self.assertEqual(BalanceShard.objects.filter(account=merchant).count(), 4)
+        self.assertFalse(merchant.ledger.exists())
+        self.assertEqual(merchant.shard_credits.count(), 5)
+
+    def test_compact_shards(self):
+        Transfer.make_transfer(self.account, self.merchant, 100, '')
+        Deposit.make_deposit(self.merchant, 50, 'Cash')
+
+        self.assertTrue(self.merchant.compact_shards())
+
+        self.assertEqual(self.merchant.balance, 150)
+        self.assertEqual(self.merchant.sequence, 2)
+        self.assertEqual(
+            list(self.merchant.ledger.values_list('sequence', 'balance')),
+            [(1, 100), (2, 150)])
+        self.assertEqual(self.merchant.current_balance(), 150)
+        self.assertFalse(self.merchant.shard_credits.exists())
+        self.assertFalse(self.merchant.compact_shards())
+
+    def test_compact_shards_appends_entries(self):
+        Deposit.make_deposit(self.merchant, 50, 'Cash')
+        self.merchant.compact_shards()
+        first = self.merchant.ledger.get()
+
+        Deposit.make_deposit(self.merchant, 30, 'Cash')
+        self.merchant.compact_shards()
+
+        self.assertEqual(
+            list(self.merchant.ledger.values_list('pk', 'sequence', 'balance')),
+            [(first.pk, 1, 50), (first.pk + 1, 2, 80)])
+
+    def test_credit_after_shards_taken_away(self):
+        stale = Account.objects.get(pk=self.merchant.pk)
+        self.merchant.set_balance_shards(1)
+
+        randrange = mock.Mock(side_effect=[3, 0])
+
+        with mock.patch('banking.models.random.randrange', randrange):
+            self.assertTrue(stale.credit(100))
+
+        self.assertEqual(stale.balance_shards, 1)
+        self.assertEqual(self.merchant.current_balance(), 100)
+
+    def test_credit_after_shards_turned_off(self):
+        stale = Account.objects.get(pk=self.merchant.pk)
+        self.merchant.set_balance_shards(0)
+
+        self.assertFalse(stale.credit(100))
+
+        self.merchant.refresh_from_db()
+        self.assertEqual(self.merchant.balance, 100)
+        self.assertEqual(self.merchant.sequence, 1)
+
+    def test_credit_many_after_shards_taken_away(self):
+        self.merchant.set_balance_shards(1)
+        randrange = mock.Mock(side_effect=[3, 0])
+
+        with mock.patch('banking.models.random.randrange', randrange):
+            positions = Account.credit_many({self.merchant.pk: [100, 20]})
+
+        self.assertEqual(positions, {self.merchant.pk: (None, None)})
+        self.assertEqual(self.merchant.current_balance(), 120)
+
+    def test_debit_folds_shards(self):
+        Transfer.make_transfer(self.account, self.merchant, 100, '')
+        merchant = Account.objects.get(pk=self.merchant.pk)
+
+        Withdrawal.make_withdrawal(merchant, 60)
+
+        self.assertEqual(merchant.balance, 40)
+        self.assertEqual(
+            list(merchant.ledger.values_list('sequence', 'amount')),
+            [(1, 100), (2, -60)])
+
+    def test_turn_shards_off(self):
+        Deposit.make_deposit(self.merchant, 50, 'Cash')
+
+        self.merchant.set_balance_shards(0)
+        Deposit.make_deposit(self.merchant, 50, 'Cash')
+
+        self.assertEqual(self.merchant.balance, 100)
+        self.assertFalse(BalanceShard.objects.exists())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Checks SQLite query plan')
+class HistoryIndexTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@email.com',
+                                               password='testpassword')
+        Account.objects.create(holder=self.user, status=Account.ACTIVE)
+
+    def get_plan(self, view_class):
+        view = view_class()
+        view.request = RequestFactory().get('/')
+        view.request.user = self.user
+        queryset = view.get_queryset().order_by('-date', '-id')
+        return queryset.explain()
+
+    def test_history_uses_account_date_index(self):
+        views = (
+            (TransferView, 'transfer_from_date_idx'),
+            (TransactionView, 'transaction_account_date_idx'),
+            (DepositView, 'deposit_account_date_idx'),
+            (WithdrawalView, 'withdrawal_account_date_idx'),
+        )
+        for view_class, index in views:
+            with self.subTest(view=view_class.__name__):
+                plan = self.get_plan(view_class)
+                self.assertIn(index, plan)
+                # Rows come in index order, no extra sort
+                self.assertNotIn('TEMP B-TREE', plan)
@@ -0,0 +1,114 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+
+from banking.models import Account, Operation, Transfer, Withdrawal
+from banking.operations import process_partition, get_partition
+
+TRANSFER_URL = reverse('banking:transfer-list')
+WITHDRAWAL_URL = reverse('banking:withdrawal-list')
+
+
+@override_settings(BANKING_ASYNC_WRITES=True)
+class AsyncWriteApiTest(APITestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@email.com',
+                                               password='testpassword')
+        self.user2 = get_user_model().objects.create_user(email='test2@email.com',
+                                               password='testpassword')
+        self.account = Account.objects.create(
+            holder=self.user,
+            balance=300,
+            status=Account.ACTIVE
+        )
+        self.account2 = Account.objects.create(
+            holder=self.user2,
+            status=Account.ACTIVE
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_transfer_queued(self):
+        res = self.client.post(TRANSFER_URL, {
+            'account_from': self.account.pk,
+            'account_to': str(self.account2.uid),
+            'amount': '100.00',
+            'comment': 'For you'
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data['status'], Operation.PENDING)
+        self.assertEqual(Transfer.objects.count(), 0)
+
+        operation = Operation.objects.get(uid=res.data['uid'])
+        self.assertEqual(operation.partition, get_partition(self.account))
+        self.assertEqual(process_partition(operation.partition), 1)
+
+        res = self.client.get(res['Location'])
+        transfer = Transfer.objects.get()
+        self.assertEqual(res.data['status'], Operation.DONE)
+        self.assertEqual(res.data['result'], {'transfer': transfer.pk})
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 200)
+
+    def test_operations_applied_in_order(self):
+        uids = []
+        for amount in ('200.00', '200.00', '100.00'):
+            res = self.client.post(WITHDRAWAL_URL, {
+                'account': self.account.pk,
+                'amount': amount
+            })
+            uids.append(res.data['uid'])
+
+        process_partition(get_partition(self.account))
+
+        statuses = [Operation.objects.get(uid=uid).status for uid in uids]
+        self.assertEqual(
+            statuses, [Operation.DONE, Operation.FAILED, Operation.DONE])
+        self.assertEqual(Withdrawal.objects.count(), 2)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 0)
+
+    def test_unexpected_error_fails_operation(self):
+        uids = []
+        for amount in ('100.00', '50.00'):
+            res = self.client.post(WITHDRAWAL_URL, {
+                'account': self.account.pk,
+                'amount': amount
+            })
+            uids.append(res.data['uid'])
+        make_withdrawal = Withdrawal.make_withdrawal
+
+        def fail_first(account, amount):
+            if Withdrawal.make_withdrawal.call_count == 1:
+                raise ValueError('broken')
+            return make_withdrawal(account, amount)
+
+        with mock.patch.object(Withdrawal, 'make_withdrawal',
+                               side_effect=fail_first), \
+                self.assertLogs('banking.operations', 'ERROR'):
+            process_partition(get_partition(self.account))
+
+        failed, done = [Operation.objects.get(uid=uid) for uid in uids]
+        self.assertEqual(failed.status, Operation.FAILED)
+        self.assertEqual(failed.result, '{"error": "Operation failed."}')
+        self.assertEqual(done.status, Operation.DONE)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 250)
+
+    def test_operation_limit_for_user(self):
+        res = self.client.post(WITHDRAWAL_URL, {
+            'account': self.account.pk,
+            'amount': '100.00'
+        })
+        client = APIClient()
+        client.force_authenticate(user=self.user2)
+
+        res = client.get(res['Location'])
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
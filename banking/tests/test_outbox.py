@@ -0,0 +1,200 @@
+import json
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from banking.exceptions import InvalidAmount
+from banking.imports import import_deposits
+from banking.models import Account, Deposit, OutboxEvent, Transaction, \
+    Transfer, Withdrawal
+from banking.outbox import dispatch_events
+from banking.tasks import delete_dispatched_events
+
+
+class OutboxEventTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@email.com',
+                                               password='testpassword')
+        self.user2 = get_user_model().objects.create_user(email='test2@email.com',
+                                               password='testpassword')
+        self.account = Account.objects.create(holder=self.user, balance=1000,
+                                              status=Account.ACTIVE)
+        self.account2 = Account.objects.create(holder=self.user2,
+                                               status=Account.ACTIVE)
+
+    def payload(self, event):
+        return json.loads(event.payload)
+
+    def test_transfer_events(self):
+        _, _, transfer = Transfer.make_transfer(
+            self.account, self.account2, Decimal('100.00'), 'rent')
+
+        out, received = OutboxEvent.objects.order_by('id')
+        self.assertEqual((out.kind, out.account), (OutboxEvent.TRANSFER_OUT,
+                                                   self.account))
+        self.assertEqual((received.kind, received.account),
+                         (OutboxEvent.TRANSFER_IN, self.account2))
+        payload = self.payload(out)
+        # JSON dates are cut to milliseconds
+        self.assertLess(abs(parse_datetime(payload.pop('date')) - transfer.date),
+                        timedelta(milliseconds=1))
+        self.assertEqual(payload, {
+            'account': str(self.account.uid),
+            'id': transfer.pk,
+            'amount': '100.00',
+            'comment': 'rent',
+            'counterparty': str(self.account2.uid),
+        })
+        self.assertEqual(self.payload(received)['counterparty'],
+                         str(self.account.uid))
+
+    def test_no_event_without_change(self):
+        with self.assertRaises(InvalidAmount):
+            Transfer.make_transfer(self.account, self.account2,
+                                   Decimal('5000.00'), '')
+
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_batch_transfer_events(self):
+        Transfer.make_batch_transfer(self.account, [
+            {'account_to': str(self.account2.uid), 'amount': Decimal('10')},
+        ] * 3)
+
+        self.assertEqual(
+            OutboxEvent.objects.filter(kind=OutboxEvent.TRANSFER_OUT,
+                                       account=self.account).count(), 3)
+        self.assertEqual(
+            OutboxEvent.objects.filter(kind=OutboxEvent.TRANSFER_IN,
+                                       account=self.account2).count(), 3)
+
+    def test_batch_transfer_event_ids(self):
+        Transfer.make_transfer(self.account, self.account2, Decimal('1'), '')
+        _, results = Transfer.make_batch_transfer(self.account, [
+            {'account_to': str(self.account2.uid), 'amount': Decimal(amount),
+             'comment': amount}
+            for amount in ('10.00', '20.00')
+        ])
+
+        transfers = Transfer.objects.filter(comment__in=['10.00', '20.00']) \
+            .order_by('id')
+        for kind in (OutboxEvent.TRANSFER_OUT, OutboxEvent.TRANSFER_IN):
+            payloads = [self.payload(event) for event in OutboxEvent.objects
+                        .filter(kind=kind).order_by('id')[1:]]
+            self.assertEqual(
+                [(payload['id'], payload['amount']) for payload in payloads],
+                [(transfer.pk, str(transfer.amount))
+                 for transfer in transfers])
+
+    def test_import_event_ids(self):
+        Deposit.make_deposit(self.account2, Decimal('5.00'), '')
+        lines = ['account,amount,comment'] + [
+            f'{self.account.uid},{amount},' for amount in ('10.00', '20.00')]
+
+        import_deposits(lines, 'march.csv')
+
+        deposits = Deposit.objects.filter(account=self.account).order_by('id')
+        payloads = [self.payload(event) for event in OutboxEvent.objects
+                    .filter(account=self.account).order_by('id')]
+        self.assertEqual(
+            [(payload['id'], payload['amount']) for payload in payloads],
+            [(deposit.pk, str(deposit.amount)) for deposit in deposits])
+
+    def test_movement_events(self):
+        Deposit.make_deposit(self.account, Decimal('50.00'), 'salary')
+        Transaction.make_transaction(self.account, 'Coffee House',
+                                     Decimal('5.00'), '')
+        Withdrawal.make_withdrawal(self.account, Decimal('20.00'))
+
+        events = OutboxEvent.objects.order_by('id')
+        self.assertEqual([event.kind for event in events], [
+            OutboxEvent.DEPOSIT, OutboxEvent.TRANSACTION,
+            OutboxEvent.WITHDRAWAL,
+        ])
+        self.assertEqual(self.payload(events[1])['counterparty'],
+                         'Coffee House')
+        self.assertEqual(self.payload(events[2])['comment'], '')
+
+    def test_status_event(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('banking:account-block', args=[self.account.uid])
+
+        res = client.put(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.kind, OutboxEvent.STATUS)
+        self.assertEqual(self.payload(event), {
+            'account': str(self.account.uid),
+            'status': Account.BLOCKED,
+        })
+
+
+class DispatchTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(email='test@email.com',
+                                                    password='testpassword')
+        self.account = Account.objects.create(holder=user, balance=1000,
+                                              status=Account.ACTIVE)
+        for _ in range(5):
+            OutboxEvent.record(OutboxEvent.STATUS, self.account,
+                               status=Account.ACTIVE)
+
+    @mock.patch('banking.outbox.get_publishers')
+    def test_dispatch_in_batches(self, get_publishers):
+        publisher = mock.Mock()
+        get_publishers.return_value = [publisher]
+        publish = publisher.publish
+
+        with CaptureQueriesContext(connection) as queries:
+            dispatched = dispatch_events(size=2)
+
+        self.assertEqual(dispatched, 5)
+        self.assertEqual([len(call[0][0]) for call in publish.call_args_list],
+                         [2, 2, 1])
+        first = publish.call_args_list[0][0][0][0]
+        self.assertEqual(first['kind'], OutboxEvent.STATUS)
+        self.assertEqual(first['data']['status'], Account.ACTIVE)
+        self.assertFalse(
+            OutboxEvent.objects.filter(dispatched__isnull=True).exists())
+        updates = [query for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE')
+                   and '"dispatched" = \'' in query['sql']]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(dispatch_events(size=2), 0)
+
+    @mock.patch('banking.outbox.get_publishers')
+    def test_failed_publish_keeps_batch(self, get_publishers):
+        publisher = mock.Mock()
+        publisher.publish.side_effect = ConnectionError
+        get_publishers.return_value = [publisher]
+
+        with self.assertRaises(ConnectionError):
+            dispatch_events(size=2)
+
+        self.assertEqual(
+            OutboxEvent.objects.filter(dispatched__isnull=True).count(), 5)
+
+    def test_delete_dispatched(self):
+        old, recent = OutboxEvent.objects.order_by('id')[:2]
+        OutboxEvent.objects.filter(pk=old.pk).update(
+            dispatched=timezone.now() - timedelta(days=30))
+        OutboxEvent.objects.filter(pk=recent.pk).update(
+            dispatched=timezone.now())
+
+        delete_dispatched_events()
+
+        self.assertFalse(OutboxEvent.objects.filter(pk=old.pk).exists())
+        self.assertEqual(OutboxEvent.objects.count(), 4)
@@ -0,0 +1,69 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+
+from banking.models import Account, Deposit
+
+DEPOSIT_URL = reverse('banking:deposit-list')
+
+
+class KeysetPaginationTest(APITestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@email.com',
+                                               password='testpassword')
+        self.account = Account.objects.create(
+            holder=self.user,
+            status=Account.ACTIVE
+        )
+        now = timezone.now()
+        for i in range(25):
+            deposit = Deposit.objects.create(
+                account=self.account,
+                amount=100,
+                comment=f'Deposit {i}'
+            )
+            # Pairs of deposits share the date to check ties on id
+            Deposit.objects.filter(pk=deposit.pk).update(
+                date=now - timedelta(minutes=i // 2))
+        self.expected = list(
+            Deposit.objects.order_by('-date', '-id').values_list('comment', flat=True))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_walk_pages(self):
+        ids = []
+        url = DEPOSIT_URL
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', res.data)
+            ids += [item['comment'] for item in res.data['results']]
+            last, url = url, res.data['next']
+
+        self.assertEqual(ids, self.expected)
+
+        ids = []
+        url = last
+        while url:
+            res = self.client.get(url)
+            ids = [item['comment'] for item in res.data['results']] + ids
+            url = res.data['previous']
+
+        self.assertEqual(ids, self.expected)
+
+    def test_count_opt_in(self):
+        res = self.client.get(DEPOSIT_URL, {'count': 'true'})
+
+        self.assertEqual(res.data['count'], 25)
+        self.assertIsNone(res.data['previous'])
+
+    def test_invalid_cursor(self):
+        res = self.client.get(DEPOSIT_URL, {'cursor': 'broken'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['detail'].code, 'cursor_error')
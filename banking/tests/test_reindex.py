@@ -0,0 +1,63 @@
+import io
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from banking.models import Account
+
+
+def fake_parallel_bulk(client, actions, **kwargs):
+    for action in actions:
+        yield True, {'index': {'_id': action['_id']}}
+
+
+@mock.patch('banking.reindex.parallel_bulk', side_effect=fake_parallel_bulk)
+@mock.patch('elasticsearch_dsl.connections.connections.get_connection')
+class ReindexAccountsTests(TestCase):
+
+    def setUp(self):
+        for i in range(3):
+            user = get_user_model().objects.create_user(
+                email=f'test{i}@email.com', password='testpassword')
+            Account.objects.create(holder=user)
+
+    def reindex(self, *args):
+        out = io.StringIO()
+        call_command('reindex_accounts', *args, stdout=out)
+        return out.getvalue()
+
+    def test_reindex_swaps_alias(self, get_connection, parallel_bulk):
+        client = get_connection.return_value
+        client.indices.exists_alias.return_value = True
+        client.indices.get_alias.return_value = {'accounts-old': {}}
+
+        out = self.reindex('--chunk-size', '2', '--threads', '3')
+
+        self.assertIn('3 accounts indexed, 0 failed', out)
+        self.assertEqual(parallel_bulk.call_args[1]['thread_count'], 3)
+        self.assertEqual(parallel_bulk.call_args[1]['chunk_size'], 2)
+        create = client.indices.create.call_args[1]
+        name = create['index']
+        self.assertTrue(name.startswith('accounts-'))
+        self.assertEqual(create['body']['settings']['refresh_interval'], '-1')
+        self.assertEqual(create['body']['settings']['number_of_replicas'], 0)
+        actions = client.indices.update_aliases.call_args[1]['body']['actions']
+        self.assertEqual(actions, [
+            {'add': {'index': name, 'alias': 'accounts'}},
+            {'remove': {'index': 'accounts-old', 'alias': 'accounts'}},
+        ])
+        client.indices.delete.assert_called_once_with(index='accounts-old')
+
+    def test_reindex_replaces_concrete_index(self, get_connection,
+                                             parallel_bulk):
+        client = get_connection.return_value
+        client.indices.exists_alias.return_value = False
+        client.indices.exists.return_value = True
+
+        self.reindex()
+
+        actions = client.indices.update_aliases.call_args[1]['body']['actions']
+        self.assertEqual(actions[1], {'remove_index': {'index': 'accounts'}})
+        client.indices.delete.assert_not_called()
@@ -0,0 +1,332 @@
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from elasticsearch.exceptions import RequestError
+from elasticsearch_dsl import Search
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+
+from banking.documents import transactions
+from banking.exceptions import InvalidCursor
+from banking.models import Account, Transaction
+from banking.pagination import SearchPagination
+from banking.search import DatabaseBackend, ElasticsearchBackend, \
+    get_client, reset_clients
+
+ACCOUNT_URL = reverse('banking:account-list')
+TRANSACTION_URL = reverse('banking:transaction-list')
+
+
+class SearchClientTests(SimpleTestCase):
+
+    def tearDown(self):
+        reset_clients()
+
+    def test_client_from_settings(self):
+        client = get_client()
+
+        hosts = settings.ELASTICSEARCH_DSL['default']['hosts']
+        self.assertEqual(len(client.transport.hosts), len(hosts))
+        self.assertIs(get_client(), client)
+        self.assertTrue(client.transport.retry_on_timeout)
+
+    def test_reset_clients(self):
+        client = get_client()
+
+        reset_clients()
+
+        self.assertIsNot(get_client(), client)
+
+
+def make_hit(uid, sort):
+    hit = mock.Mock()
+    hit.to_dict.return_value = {
+        'uid': uid,
+        'status': 'active',
+        'created': '2020-03-01T10:00:00+00:00',
+        'holder': {'email': 'test@email.com'},
+    }
+    hit.meta.sort = sort
+    return hit
+
+
+@mock.patch.object(Search, 'execute', autospec=True)
+class AccountSearchApiTest(APITestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@email.com',
+                                               password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_search_from_source(self, execute):
+        execute.return_value = [make_hit(f'uid-{i}', [1.5, f'uid-{i}'])
+                                for i in range(11)]
+
+        with self.assertNumQueries(0):
+            res = self.client.get(ACCOUNT_URL, {'q': 'test'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 10)
+        self.assertEqual(res.data['results'][0], {
+            'uid': 'uid-0',
+            'status': 'active',
+            'created': '2020-03-01T10:00:00+00:00',
+            'email': 'test@email.com',
+        })
+        query = execute.call_args[0][0].to_dict()
+        self.assertEqual(query['query']['bool']['filter'],
+                         [{'term': {'holder.id': self.user.pk}}])
+        self.assertEqual(query['size'], 11)
+        self.assertNotIn('search_after', query)
+
+        execute.return_value = [make_hit('uid-10', [1.5, 'uid-10'])]
+        res = self.client.get(res.data['next'])
+
+        query = execute.call_args[0][0].to_dict()
+        self.assertEqual(query['search_after'], [1.5, 'uid-9'])
+        self.assertIsNone(res.data['next'])
+
+    def test_search_staff(self, execute):
+        execute.return_value = []
+        self.user.is_staff = True
+
+        self.client.get(ACCOUNT_URL, {'q': 'test'})
+
+        query = execute.call_args[0][0].to_dict()
+        self.assertEqual(query['query']['bool']['filter'],
+                         [{'term': {'holder.id': self.user.pk}}])
+
+    def test_search_after_rejected(self, execute):
+        execute.side_effect = RequestError(
+            400, 'search_phase_execution_exception')
+        paginator = SearchPagination()
+
+        res = self.client.get(ACCOUNT_URL, {
+            'q': 'test',
+            paginator.cursor_query_param: 'WyJ4Il0=',
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_malformed_cursor(self, execute):
+        for cursor in ('broken', 'e30='):
+            res = self.client.get(ACCOUNT_URL, {'q': 'test', 'cursor': cursor})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(res.data['detail'].code, 'cursor_error')
+        execute.assert_not_called()
+
+
+class DatabaseBackendTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(
+            email='john.smith@email.com', password='testpassword',
+            first_name='John', last_name='Smith')
+        self.user2 = User.objects.create_user(
+            email='jane.smith@email.com', password='testpassword',
+            first_name='Jane', last_name='Smith', is_staff=True)
+        self.account = Account.objects.create(holder=self.user)
+        self.account2 = Account.objects.create(holder=self.user2)
+        self.backend = DatabaseBackend()
+
+    def uids(self, rows):
+        return [row['uid'] for row, _ in rows]
+
+    def test_prefix_of_email_and_name(self):
+        rows = self.backend.search('smi', self.user)
+
+        self.assertEqual(self.uids(rows), [str(self.account.uid)])
+        self.assertEqual(self.uids(self.backend.search('jan', self.user2)),
+                         [str(self.account2.uid)])
+        row, sort = rows[0]
+        self.assertEqual(set(row), {'uid', 'status', 'created', 'holder'})
+        self.assertEqual(sort[1], row['uid'])
+
+    def test_own_accounts_only(self):
+        self.assertEqual(self.backend.search('john', self.user2), [])
+        # Staff users search their own accounts too
+        rows = self.backend.search('smith', self.user2)
+
+        self.assertEqual(self.uids(rows), [str(self.account2.uid)])
+        self.assertEqual(rows[0][0]['holder'],
+                         {'email': 'jane.smith@email.com'})
+
+    def test_holder_update(self):
+        self.user.email = 'johnny@email.com'
+        self.user.save()
+
+        self.assertEqual(self.uids(self.backend.search('johnny', self.user)),
+                         [str(self.account.uid)])
+        self.account.delete()
+        self.assertEqual(self.backend.search('johnny', self.user), [])
+
+    def test_after(self):
+        first = self.backend.search('smith', self.user, size=1)
+        rest = self.backend.search('smith', self.user, after=first[0][1])
+
+        self.assertEqual(len(first), 1)
+        self.assertEqual(rest, [])
+
+    def test_invalid_after(self):
+        for after in ([], ['x'], ['x', str(self.account.uid)], [1, 'x'],
+                      [1, 2], [True, str(self.account.uid)]):
+            with self.assertRaises(InvalidCursor):
+                self.backend.search('smith', self.user, after=after)
+
+    def test_postgresql_query(self):
+        queryset = self.backend.filter_postgresql(
+            Account.objects.filter(holder=self.user), 'smith',
+            (0.5, self.account.uid))
+
+        sql = str(queryset.values('uid', 'score').query)
+        self.assertIn('FROM "banking_account" INNER JOIN "users_customuser" '
+                      'ON ("banking_account"."holder_id" = '
+                      '"users_customuser"."id")', sql)
+        self.assertIn('SIMILARITY("users_customuser"."email", smith) '
+                      'AS "score"', sql)
+        self.assertIn('("users_customuser"."email" ILIKE %smith%)', sql)
+        self.assertIn('(("users_customuser"."first_name" ||   || '
+                      '"users_customuser"."last_name") ILIKE %smith%)', sql)
+
+    def test_no_words(self):
+        self.assertEqual(self.backend.search('"*', self.user), [])
+
+    def test_search_api(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+
+        with mock.patch('banking.search.get_backend',
+                        return_value=self.backend), \
+                mock.patch.object(SearchPagination, 'page_size', 1):
+            res = client.get(ACCOUNT_URL, {'q': 'smith'})
+            self.assertEqual(len(res.data['results']), 1)
+            self.assertIsNone(res.data['next'])
+            res = client.get(ACCOUNT_URL, {'q': 'jane'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], [])
+
+    def test_search_api_invalid_cursor(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        paginator = SearchPagination()
+
+        with mock.patch('banking.search.get_backend',
+                        return_value=self.backend):
+            res = client.get(ACCOUNT_URL, {
+                'q': 'smith',
+                paginator.cursor_query_param: 'WyJ4Il0=',
+            })
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TransactionSearchTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(email='test@email.com',
+                                             password='testpassword')
+        self.user2 = User.objects.create_user(email='test2@email.com',
+                                              password='testpassword')
+        self.account = Account.objects.create(holder=self.user)
+        self.account2 = Account.objects.create(holder=self.user2)
+        for merchant in ('Coffee House', 'Book Store', 'Coffee Point'):
+            Transaction.objects.create(account=self.account, amount=10,
+                                       merchant=merchant)
+        Transaction.objects.create(account=self.account2, amount=10,
+                                   merchant='Coffee House')
+        self.backend = DatabaseBackend()
+
+    def merchants(self, rows):
+        return [row['merchant'] for row, _ in rows]
+
+    def test_edge_ngram_mapping(self):
+        index = transactions.to_dict()
+
+        analysis = index['settings']['analysis']
+        self.assertEqual(analysis['filter']['merchant_edge_ngram']['type'],
+                         'edge_ngram')
+        merchant = index['mappings']['doc']['properties']['merchant']
+        self.assertEqual(merchant['analyzer'], 'merchant_prefix')
+        self.assertEqual(merchant['search_analyzer'], 'standard')
+
+    @mock.patch.object(Search, 'execute', autospec=True)
+    def test_elasticsearch_query(self, execute):
+        execute.return_value = []
+
+        ElasticsearchBackend().search_transactions(
+            'cof', [self.account.pk], after=[1583056800000, 3], size=11)
+
+        query = execute.call_args[0][0].to_dict()
+        self.assertIn({'terms': {'account': [self.account.pk]}},
+                      query['query']['bool']['filter'])
+        self.assertEqual(query['sort'], [{'date': 'desc'}, {'id': 'desc'}])
+        self.assertEqual(query['search_after'], [1583056800000, 3])
+
+    def test_prefix_in_own_accounts(self):
+        rows = self.backend.search_transactions('cof', [self.account.pk])
+
+        self.assertEqual(self.merchants(rows), ['Coffee Point',
+                                                'Coffee House'])
+        row, sort = rows[0]
+        self.assertEqual(row['account'], self.account.pk)
+        self.assertEqual(sort, [row['date'].isoformat(), row['id']])
+        self.assertEqual(self.backend.search_transactions('', [1]), [])
+
+    def test_after(self):
+        first = self.backend.search_transactions('coffee', [self.account.pk],
+                                                 size=1)
+        rest = self.backend.search_transactions('coffee', [self.account.pk],
+                                                after=first[0][1])
+
+        self.assertEqual(self.merchants(first), ['Coffee Point'])
+        self.assertEqual(self.merchants(rest), ['Coffee House'])
+
+    def test_invalid_after(self):
+        for after in ([], ['x', 1], [None, 1], ['2020-01-01T00:00:00', 'x'],
+                      ['2020-01-01T00:00:00', None], [1, 2, 3]):
+            with self.assertRaises(InvalidCursor):
+                self.backend.search_transactions('coffee', [self.account.pk],
+                                                 after=after)
+
+    def test_merchant_update(self):
+        tran = Transaction.objects.get(merchant='Book Store')
+        tran.merchant = 'Bakery'
+        tran.save()
+
+        self.assertEqual(
+            self.merchants(self.backend.search_transactions(
+                'bak', [self.account.pk])), ['Bakery'])
+        self.assertEqual(self.backend.search_transactions(
+            'book', [self.account.pk]), [])
+        tran.delete()
+        self.assertEqual(self.backend.search_transactions(
+            'bak', [self.account.pk]), [])
+
+    def test_search_api(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+
+        with mock.patch('banking.search.get_backend',
+                        return_value=self.backend), \
+                mock.patch.object(SearchPagination, 'page_size', 1):
+            res = client.get(TRANSACTION_URL, {'search': 'coffee'})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(res.data['results'][0]['merchant'],
+                             'Coffee Point')
+            self.assertEqual(res.data['results'][0]['amount'], '10.00')
+            res = client.get(res.data['next'])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.merchants_of(res), ['Coffee House'])
+        self.assertIsNone(res.data['next'])
+
+    def merchants_of(self, res):
+        return [row['merchant'] for row in res.data['results']]
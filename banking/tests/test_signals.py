@@ -0,0 +1,143 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from kombu.exceptions import OperationalError as BrokerError
+
+from banking.models import Account, Deposit
+from banking.signals import update_documents
+
+
+def run_commit_callbacks():
+    """ Run what a commit would, TestCase never commits """
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
+
+
+@override_settings(ELASTICSEARCH_DSL_AUTOSYNC=True)
+class AsyncSignalProcessorTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@email.com',
+                                               password='testpassword')
+        self.account = Account.objects.create(
+            holder=self.user,
+            status=Account.ACTIVE
+        )
+        # Drop what setUp saved
+        connection.run_on_commit = []
+        patcher = mock.patch('banking.tasks.update_search_index.delay')
+        self.delay = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_save_indexed_after_commit(self):
+        self.account.status = Account.BLOCKED
+        self.account.save(update_fields=['status'])
+        self.account.save()
+        self.delay.assert_not_called()
+
+        run_commit_callbacks()
+
+        self.delay.assert_called_once_with(
+            'banking.Account', [self.account.pk], 'index')
+
+    def test_save_not_indexed_fields(self):
+        self.account.save(update_fields=['balance'])
+        Deposit.make_deposit(self.account, 100, 'Cash')
+
+        run_commit_callbacks()
+
+        self.delay.assert_not_called()
+
+    def test_related_user_save(self):
+        self.user.email = 'new@email.com'
+        self.user.save()
+
+        run_commit_callbacks()
+
+        self.delay.assert_called_once_with(
+            'banking.Account', [self.account.pk], 'index')
+
+    def test_related_user_save_not_indexed_fields(self):
+        self.assertTrue(self.client.login(email='test@email.com',
+                                          password='testpassword'))
+        self.user.save(update_fields=['password'])
+        run_commit_callbacks()
+        self.delay.assert_not_called()
+
+        self.user.email = 'new@email.com'
+        self.user.save(update_fields=['email'])
+        run_commit_callbacks()
+
+        self.delay.assert_called_once_with(
+            'banking.Account', [self.account.pk], 'index')
+
+    def test_delete(self):
+        pk = self.account.pk
+        self.account.delete()
+
+        run_commit_callbacks()
+
+        self.delay.assert_called_once_with('banking.Account', [pk], 'delete')
+
+    def test_rollback_drops_batch(self):
+        pk = self.account.pk
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                self.account.delete()
+                raise IntegrityError
+
+        self.user.save()
+        run_commit_callbacks()
+
+        self.delay.assert_called_once_with('banking.Account', [pk], 'index')
+
+    def test_nested_rollback_drops_batch(self):
+        pk = self.account.pk
+        with transaction.atomic():
+            self.user.save()
+            with self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    self.account.delete()
+                    raise IntegrityError
+
+        run_commit_callbacks()
+
+        self.delay.assert_called_once_with('banking.Account', [pk], 'index')
+
+    def test_broker_down(self):
+        self.delay.side_effect = BrokerError('Connection refused')
+
+        self.account.save()
+
+        with self.assertLogs('banking.signals', 'ERROR'):
+            run_commit_callbacks()
+
+
+class UpdateDocumentsTests(TestCase):
+
+    def setUp(self):
+        self.users = [
+            get_user_model().objects.create_user(email=f'test{i}@email.com',
+                                                 password='testpassword')
+            for i in range(3)
+        ]
+        self.accounts = [Account.objects.create(holder=user)
+                         for user in self.users]
+
+    @mock.patch('django_elasticsearch_dsl.documents.bulk')
+    def test_bulk_per_batch(self, bulk):
+        pks = [account.pk for account in self.accounts]
+
+        with mock.patch('banking.signals.SEARCH_INDEX_BATCH_SIZE', 2):
+            update_documents('banking.Account', pks + pks)
+
+        self.assertEqual(bulk.call_count, 2)
+        actions = [action for call in bulk.call_args_list
+                   for action in call[1]['actions']]
+        self.assertEqual(sorted(action['_id'] for action in actions), pks)
+        self.assertIn('test0@email.com',
+                      [action['_source']['holder']['email']
+                       for action in actions])
@@ -1,6 +1,9 @@
 import uuid
+from unittest import mock
 
-from django.test import TestCase
+from django.db import OperationalError, connection
+from django.test import TestCase, SimpleTestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework import status
@@ -10,8 +13,10 @@ from banking.exceptions import InvalidAmount, InvalidAccount, \
     InvalidAccountReceiver
 from banking.models import Account, Transfer
 from banking.serializers import TransferSerializer
+from banking.utils import retry_on_conflict
 
 TRANSFER_URL = reverse('banking:transfer-list')
+TRANSFER_BATCH_URL = reverse('banking:transfer-batch')
 
 
 class TransferTests(TestCase):
@@ -109,6 +114,35 @@ class TransferTests(TestCase):
             )
 
 
+@mock.patch('banking.utils.time.sleep')
+class RetryOnConflictTests(SimpleTestCase):
+
+    def test_retry_deadlock(self, sleep):
+        func = mock.Mock(side_effect=[
+            OperationalError('database is locked'),
+            'done'
+        ])
+
+        self.assertEqual(retry_on_conflict(func)(), 'done')
+        self.assertEqual(func.call_count, 2)
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_retry_gives_up(self, sleep):
+        func = mock.Mock(side_effect=OperationalError('database is locked'))
+
+        with self.assertRaises(OperationalError):
+            retry_on_conflict(func)()
+        self.assertEqual(func.call_count, 3)
+
+    def test_no_retry_other_errors(self, sleep):
+        func = mock.Mock(side_effect=OperationalError('no such table'))
+
+        with self.assertRaises(OperationalError):
+            retry_on_conflict(func)()
+        self.assertEqual(func.call_count, 1)
+        sleep.assert_not_called()
+
+
 class PublicTransferApiTest(APITestCase):
 
     def test_transaction_auth_required(self):
@@ -163,3 +197,94 @@ class PrivateTransferApiTest(APITestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(len(res.data['results']), 1)
         self.assertEqual(res.data['results'], serializer.data)
+
+
+class BatchTransferTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@email.com',
+                                               password='testpassword')
+        self.account = Account.objects.create(
+            holder=self.user,
+            balance=1000,
+            status=Account.ACTIVE
+        )
+        self.receivers = []
+        for i in range(3):
+            user = get_user_model().objects.create_user(
+                email=f'receiver{i}@email.com',
+                password='testpassword')
+            self.receivers.append(Account.objects.create(
+                holder=user,
+                status=Account.ACTIVE
+            ))
+
+    def test_batch_transfer(self):
+        transfers = [
+            {'account_to': account.uid, 'amount': 100, 'comment': 'Salary'}
+            for account in self.receivers
+        ]
+        transfers.append({'account_to': self.receivers[0].uid, 'amount': 50})
+
+        _, results = Transfer.make_batch_transfer(self.account, transfers)
+
+        self.account.refresh_from_db()
+        self.receivers[0].refresh_from_db()
+        self.assertEqual(self.account.balance, 650)
+        self.assertEqual(self.receivers[0].balance, 150)
+        self.assertEqual(Transfer.objects.count(), 4)
+        self.assertTrue(all(r['status'] == 'created' for r in results))
+
+    def test_batch_transfer_fail_receivers(self):
+        self.receivers[1].status = Account.BLOCKED
+        self.receivers[1].save()
+        transfers = [
+            {'account_to': self.receivers[0].uid, 'amount': 100},
+            {'account_to': self.receivers[1].uid, 'amount': 100},
+            {'account_to': uuid.uuid4(), 'amount': 100},
+            {'account_to': 'not-uid', 'amount': 100},
+            {'account_to': self.account.uid, 'amount': 100},
+        ]
+
+        _, results = Transfer.make_batch_transfer(self.account, transfers)
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 900)
+        self.assertEqual(Transfer.objects.count(), 1)
+        self.assertEqual(
+            [r['status'] for r in results],
+            ['created', 'failed', 'failed', 'failed', 'failed'])
+        self.assertIn(InvalidAccount.default_code, results[4])
+
+    def test_batch_transfer_fail_amount(self):
+        transfers = [
+            {'account_to': account.uid, 'amount': 400}
+            for account in self.receivers
+        ]
+
+        with self.assertRaises(InvalidAmount):
+            Transfer.make_batch_transfer(self.account, transfers)
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 1000)
+        self.assertEqual(Transfer.objects.count(), 0)
+
+    def test_batch_transfer_api(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        payload = {
+            'account_from': self.account.pk,
+            'transfers': [
+                {'account_to': str(account.uid), 'amount': '10.00'}
+                for account in self.receivers * 10
+            ]
+        }
+
+        with CaptureQueriesContext(connection) as queries:
+            res = client.post(TRANSFER_BATCH_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data['results']), 30)
+        self.assertEqual(Transfer.objects.count(), 30)
+        # Constant however many transfers, one insert for outbox events
+        self.assertLessEqual(len(queries), 10)
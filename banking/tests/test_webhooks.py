@@ -0,0 +1,320 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import socket
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from aiohttp import web
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from banking.models import Account, Deposit, WebhookSubscription, \
+    WebhookDelivery
+from banking.outbox import dispatch_events
+from banking.tasks import delete_dispatched_events
+from banking.webhooks import WebhookWorker, SIGNATURE_HEADER, \
+    claim_deliveries, is_public_url, record_results, WEBHOOK_LEASE, \
+    WEBHOOK_MAX_ATTEMPTS
+
+WEBHOOK_URL = reverse('banking:webhooksubscription-list')
+
+
+def make_user(email):
+    return get_user_model().objects.create_user(email=email,
+                                                password='testpassword')
+
+
+@mock.patch('banking.outbox.CeleryPublisher.publish')
+class WebhookPublisherTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user('test@email.com')
+        self.user2 = make_user('test2@email.com')
+        self.account = Account.objects.create(holder=self.user,
+                                              status=Account.ACTIVE)
+        self.account2 = Account.objects.create(holder=self.user2,
+                                               status=Account.ACTIVE)
+        self.webhook = WebhookSubscription.objects.create(
+            user=self.user, url='http://127.0.0.1/hook')
+        WebhookSubscription.objects.create(
+            user=self.user, url='http://127.0.0.1/off', active=False)
+
+    def test_delivery_per_event_of_holder(self, publish):
+        _, deposit = Deposit.make_deposit(self.account, Decimal('50.00'), '')
+        Deposit.make_deposit(self.account2, Decimal('50.00'), '')
+
+        dispatch_events()
+
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual(delivery.subscription, self.webhook)
+        self.assertEqual(delivery.status, WebhookDelivery.PENDING)
+        event = json.loads(delivery.payload)
+        self.assertEqual(event['id'], str(delivery.event))
+        self.assertEqual(event['data']['id'], deposit.pk)
+        self.assertEqual(len(publish.call_args[0][0]), 2)
+
+    @mock.patch('socket.getaddrinfo',
+                return_value=[(2, 1, 6, '', ('93.184.216.34', 443))])
+    def test_subscription_api(self, getaddrinfo, publish):
+        client = APIClient()
+        client.force_authenticate(user=self.user2)
+
+        res = client.post(WEBHOOK_URL, {'url': 'https://example.com/hook'})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data['secret']), 64)
+        res = client.get(WEBHOOK_URL)
+        self.assertEqual([hook['url'] for hook in res.data['results']],
+                         ['https://example.com/hook'])
+
+    def test_subscription_api_internal_hosts(self, publish):
+        client = APIClient()
+        client.force_authenticate(user=self.user2)
+
+        for url in ('ftp://example.com/hook', 'http://localhost/hook',
+                    'http://127.0.0.1:8000/hook', 'http://10.0.0.5/hook',
+                    'http://169.254.169.254/latest/meta-data',
+                    'http://[::1]/hook', 'http://[::ffff:127.0.0.1]/hook'):
+            res = client.post(WEBHOOK_URL, {'url': url})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('url', res.data)
+        self.assertFalse(self.user2.webhooks.exists())
+
+    def test_internal_host_by_name(self, publish):
+        with mock.patch('socket.getaddrinfo', return_value=[
+            (2, 1, 6, '', ('93.184.216.34', 80)),
+            (2, 1, 6, '', ('192.168.1.10', 80)),
+        ]):
+            self.assertFalse(is_public_url('http://intranet.example.com/'))
+        with mock.patch('socket.getaddrinfo', side_effect=socket.gaierror):
+            self.assertFalse(is_public_url('http://unknown.example.com/'))
+
+
+class RecordResultsTests(TestCase):
+
+    def setUp(self):
+        user = make_user('test@email.com')
+        webhook = WebhookSubscription.objects.create(
+            user=user, url='http://127.0.0.1/hook')
+        self.delivery = WebhookDelivery.objects.create(
+            subscription=webhook, event='00000000-0000-0000-0000-000000000001',
+            payload='{}')
+
+    def test_backoff(self):
+        delays = []
+        for attempt in range(1, 4):
+            record_results([], [(self.delivery, 'HTTP 500')])
+            self.delivery.refresh_from_db()
+            delays.append(self.delivery.next_attempt - timezone.now())
+
+        self.assertEqual(self.delivery.attempts, 3)
+        self.assertEqual(self.delivery.status, WebhookDelivery.PENDING)
+        self.assertEqual(self.delivery.last_error, 'HTTP 500')
+        self.assertLess(delays[0], delays[2])
+
+    def test_give_up(self):
+        self.delivery.attempts = WEBHOOK_MAX_ATTEMPTS - 1
+
+        record_results([], [(self.delivery, 'HTTP 500')])
+
+        self.delivery.refresh_from_db()
+        self.assertEqual(self.delivery.status, WebhookDelivery.FAILED)
+        self.assertLessEqual(self.delivery.next_attempt, timezone.now())
+
+    def test_claimed_until_recorded(self):
+        self.assertEqual(claim_deliveries(), [self.delivery])
+        self.delivery.refresh_from_db()
+        self.assertEqual(self.delivery.status, WebhookDelivery.SENDING)
+
+        later = timezone.now() + timedelta(seconds=WEBHOOK_LEASE - 1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(claim_deliveries(), [])
+
+        record_results([self.delivery], [])
+
+        self.delivery.refresh_from_db()
+        self.assertEqual(self.delivery.status, WebhookDelivery.DONE)
+        self.assertEqual(claim_deliveries(), [])
+
+    def test_lease_of_stopped_worker_expires(self):
+        claim_deliveries()
+
+        later = timezone.now() + timedelta(seconds=WEBHOOK_LEASE + 1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(claim_deliveries(), [self.delivery])
+
+    def test_delete_failed(self):
+        pending = WebhookDelivery.objects.create(
+            subscription=self.delivery.subscription,
+            event='00000000-0000-0000-0000-000000000002', payload='{}')
+        old = timezone.now() - timedelta(days=30)
+        WebhookDelivery.objects.update(next_attempt=old)
+        WebhookDelivery.objects.filter(pk=self.delivery.pk).update(
+            status=WebhookDelivery.FAILED)
+
+        delete_dispatched_events()
+
+        self.assertEqual(list(WebhookDelivery.objects.all()), [pending])
+
+
+class StubServer:
+    """ Local webhook endpoints recording requests, /fail answers 500 """
+
+    def __init__(self):
+        self.events = defaultdict(list)
+        self.requests = defaultdict(int)
+        self.active = defaultdict(int)
+        self.max_active = defaultdict(int)
+        self.signatures = []
+
+    async def handle(self, request):
+        path = request.path
+        self.requests[path] += 1
+        self.active[path] += 1
+        self.max_active[path] = max(self.max_active[path], self.active[path])
+        body = await request.read()
+        self.signatures.append((path, body,
+                                request.headers[SIGNATURE_HEADER]))
+        await asyncio.sleep(0.01)
+        self.active[path] -= 1
+        if path == '/fail':
+            return web.Response(status=500)
+        if path == '/redirect':
+            raise web.HTTPFound('/a')
+        self.events[path] += json.loads(body)
+        return web.Response()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/{name}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{port}'
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class WebhookWorkerTests(TransactionTestCase):
+    """ Deliveries sent to a stub server, the worker uses a thread for
+    database work so data has to be committed """
+
+    def setUp(self):
+        self.user = make_user('test@email.com')
+        self.stub = StubServer()
+
+    def add_deliveries(self, webhook, count):
+        WebhookDelivery.objects.bulk_create([
+            WebhookDelivery(
+                subscription=webhook,
+                event=f'00000000-0000-0000-0000-{webhook.pk:06d}{i:06d}',
+                payload=json.dumps({'id': i, 'kind': 'deposit'}))
+            for i in range(count)
+        ])
+
+    def run_worker(self, worker, urls, host='127.0.0.1'):
+        async def main():
+            base = (await self.stub.start()).replace('127.0.0.1', host)
+            webhooks = [
+                WebhookSubscription.objects.create(user=self.user,
+                                                   url=f'{base}/{name}')
+                for name in urls
+            ]
+            for webhook, count in zip(webhooks, urls.values()):
+                self.add_deliveries(webhook, count)
+            try:
+                return await worker.run(once=True)
+            finally:
+                await self.stub.stop()
+        return asyncio.run(main())
+
+    def test_throughput(self):
+        worker = WebhookWorker(concurrency=2, batch_size=10, claim_size=100,
+                               public_only=False)
+
+        delivered = self.run_worker(worker, {'a': 150, 'b': 60, 'c': 5})
+
+        self.assertEqual(delivered, 215)
+        self.assertEqual({path: len(events) for path, events
+                          in self.stub.events.items()},
+                         {'/a': 150, '/b': 60, '/c': 5})
+        self.assertEqual(self.stub.requests['/a'], 15)
+        self.assertEqual(self.stub.requests['/c'], 1)
+        self.assertLessEqual(max(self.stub.max_active.values()), 2)
+        self.assertEqual(WebhookDelivery.objects.filter(
+            status=WebhookDelivery.DONE, attempts=1).count(), 215)
+
+        path, body, signature = self.stub.signatures[0]
+        secret = WebhookSubscription.objects.get(url__endswith=path).secret
+        expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        self.assertEqual(signature, f'sha256={expected}')
+
+    def test_failed_endpoint_retried_later(self):
+        worker = WebhookWorker(concurrency=2, batch_size=10,
+                               public_only=False)
+
+        delivered = self.run_worker(worker, {'ok': 3, 'fail': 3})
+
+        self.assertEqual(delivered, 3)
+        failed = WebhookDelivery.objects.filter(
+            status=WebhookDelivery.PENDING)
+        self.assertEqual(failed.count(), 3)
+        for delivery in failed:
+            self.assertEqual(delivery.attempts, 1)
+            self.assertEqual(delivery.last_error, 'HTTP 500')
+            self.assertGreater(delivery.next_attempt,
+                               timezone.now() + timedelta(seconds=1))
+
+    def test_redirect_not_followed(self):
+        worker = WebhookWorker(public_only=False)
+
+        delivered = self.run_worker(worker, {'redirect': 2})
+
+        self.assertEqual(delivered, 0)
+        self.assertEqual(self.stub.requests['/a'], 0)
+        self.assertEqual(
+            set(WebhookDelivery.objects.values_list('last_error', flat=True)),
+            {'HTTP 302'})
+
+    def test_internal_address(self):
+        delivered = self.run_worker(WebhookWorker(), {'a': 2})
+
+        self.assertEqual(delivered, 0)
+        self.assertFalse(self.stub.requests)
+        self.assertEqual(
+            set(WebhookDelivery.objects.values_list('last_error', flat=True)),
+            {'Not a public address'})
+
+    def test_internal_address_by_name(self):
+        delivered = self.run_worker(WebhookWorker(), {'a': 2},
+                                    host='localhost')
+
+        self.assertEqual(delivered, 0)
+        self.assertFalse(self.stub.requests)
+        error = WebhookDelivery.objects.values_list('last_error',
+                                                    flat=True).first()
+        self.assertIn('Cannot connect to host localhost', error)
+
+    def test_failed_wave_logged(self):
+        async def process(deliveries):
+            raise RuntimeError('Database is gone')
+
+        worker = WebhookWorker(waves=1)
+        worker.process = process
+
+        with self.assertLogs('banking.webhooks', 'ERROR') as logs:
+            self.run_worker(worker, {'a': 2})
+
+        self.assertIn('Database is gone', logs.output[0])
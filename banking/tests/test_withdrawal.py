@@ -4,6 +4,7 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 
+from banking.exceptions import InvalidAmount
 from banking.models import Account, Withdrawal
 from banking.serializers import WithdrawalSerializer
 
@@ -33,6 +34,30 @@ class WithdrawalTests(TestCase):
         self.assertEqual(account.balance, expected_balance)
         self.assertEqual(len(withdrawal), 1)
 
+    def test_withdrawal_stale_account(self):
+        initial_balance = 150
+        withdrawal_amount = 100
+        account = Account.objects.create(
+            holder=self.user,
+            balance=initial_balance,
+            status=Account.ACTIVE
+        )
+        stale_account = Account.objects.get(pk=account.pk)
+        Withdrawal.make_withdrawal(
+            account=account,
+            amount=withdrawal_amount,
+        )
+
+        with self.assertRaises(InvalidAmount):
+            Withdrawal.make_withdrawal(
+                account=stale_account,
+                amount=withdrawal_amount,
+            )
+
+        account.refresh_from_db()
+        self.assertEqual(account.balance, initial_balance - withdrawal_amount)
+        self.assertEqual(Withdrawal.objects.count(), 1)
+
 WITHDRAWAL_URL = reverse('banking:withdrawal-list')
 
 class PublicWithdrawalApiTest(APITestCase):
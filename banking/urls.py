@@ -2,7 +2,8 @@ from django.urls import path
 from rest_framework.routers import DefaultRouter
 
 from banking.views import CustomerList, CustomerDetail, AccountView, \
-    TransferView, TransactionView, CurrencyRate, DepositView, WithdrawalView
+    TransferView, TransactionView, CurrencyRate, DepositView, WithdrawalView, \
+    OperationView, CurrencyHistory, EmailRunView, WebhookView
 
 app_name = 'banking'
 
@@ -13,10 +14,15 @@ router.register('transfer', TransferView)
 router.register('transaction', TransactionView)
 router.register('deposit', DepositView)
 router.register('withdrawal', WithdrawalView)
+router.register('operation', OperationView)
+router.register('email-run', EmailRunView)
+router.register('webhook', WebhookView)
 
 urlpatterns = [
     path('customers/', CustomerList.as_view(), name='customers'),
     path('customer/', CustomerDetail.as_view(), name='customer'),
     path('currency/', CurrencyRate.as_view(), name='currency'),
+    path('currency/history/', CurrencyHistory.as_view(),
+         name='currency-history'),
 ]
 urlpatterns += router.urls
\ No newline at end of file
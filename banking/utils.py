@@ -1,39 +1,187 @@
-import requests
+import logging
+import random
+import time
+from functools import wraps
+from itertools import islice
 
-from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.conf import settings
 from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import OperationalError, connection
 from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from kombu.exceptions import OperationalError as BrokerError
+from rest_framework.exceptions import ValidationError
 
-from datetime import date
+from banking.currency import fetch_rates, record_rates, get_latest_rate
 
+from datetime import date, datetime
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
 
 CACHE_TTL = getattr(settings, 'CACHE_TTL', DEFAULT_TIMEOUT)
+RETRY_ATTEMPTS = getattr(settings, 'TRANSFER_RETRY_ATTEMPTS', 3)
+RETRY_BACKOFF = getattr(settings, 'TRANSFER_RETRY_BACKOFF', 0.05)
+RETRY_BACKOFF_MAX = getattr(settings, 'TRANSFER_RETRY_BACKOFF_MAX', 1)
+
+CURRENCY_STALE_AFTER = getattr(settings, 'CURRENCY_STALE_AFTER', 60 * 15)
+CURRENCY_MAX_AGE = getattr(settings, 'CURRENCY_MAX_AGE', 60 * 60 * 24)
+CURRENCY_LOCK_TIMEOUT = 60
+CURRENCY_KEY = 'currency'
+CURRENCY_LOCK_KEY = 'currency:lock'
+CURRENCY_SCHEDULED_KEY = 'currency:scheduled'
+
+# PostgreSQL serialization_failure and deadlock_detected
+CONFLICT_PGCODES = ('40001', '40P01')
+
+
+def refresh_currency():
+    """
+    Fetch currency exchange rate from providers and store it in cache
+    and in ExchangeRate history.
+    Only one caller fetches at a time, others return None at once.
+    """
+    if not cache.add(CURRENCY_LOCK_KEY, 1, timeout=CURRENCY_LOCK_TIMEOUT):
+        return None
+    try:
+        previous = cache.get(CURRENCY_KEY)
+        rates = fetch_rates()
+        record_rates(rates, previous and previous['rates'])
+        cache.set(CURRENCY_KEY, {'rates': rates, 'fetched': time.time()},
+                  timeout=CURRENCY_MAX_AGE)
+        return rates
+    finally:
+        cache.delete(CURRENCY_LOCK_KEY)
+
+
+def schedule_currency_refresh():
+    """
+    Queue one refresh task however many requests see stale rates.
+    If the broker is down the caller goes on with the rates it has
+    and the next request tries to queue the refresh again.
+    """
+    if cache.add(CURRENCY_SCHEDULED_KEY, 1, timeout=CURRENCY_LOCK_TIMEOUT):
+        from banking.tasks import refresh_currency as refresh_task
+        try:
+            refresh_task.delay()
+        except BrokerError as err:
+            logger.warning('Currency refresh was not queued: %s', err)
+            cache.delete(CURRENCY_SCHEDULED_KEY)
 
 
 def get_currency():
-    """ Cache currency exchange rate """
-    if 'currency' in cache:
-        currency = cache.get('currency') # get results from cache
-    else:
-        url = 'https://api.privatbank.ua/p24api/pubinfo?json&exchange&coursid=11'
-        currency = requests.get(url)
-        cache.set('currency', currency, timeout=CACHE_TTL) # store data in cache
-    return currency
+    """
+    Cached currency exchange rate as list of dicts with ccy, base_ccy,
+    buy and sale. Never calls the bank: stale rates are served while
+    a refresh is queued, an empty list is returned until the first one.
+    """
+    stored = cache.get(CURRENCY_KEY)
+    if stored is None:
+        schedule_currency_refresh()
+        return []
+    if time.time() - stored['fetched'] > CURRENCY_STALE_AFTER:
+        schedule_currency_refresh()
+    return stored['rates']
+
+
+def get_usd_rate():
+    """ Sale rate of UAH to USD """
+    for rate in get_currency():
+        if rate['ccy'] == 'USD':
+            return Decimal(rate['sale'])
+    # Cache is cold, use the last stored rate
+    rate = get_latest_rate('USD')
+    return rate.sale if rate is not None else None
 
 
 def currency_email():
     """
-    Send letter to user about currency exchange rate
-    :return: subject, message, list of users' email
+    Letter to users about currency exchange rate
+    :return: subject, message
     """
-    users_email = list(get_user_model().objects.values_list('email', flat=True))
     current_date = date.today().strftime("%d %B %Y")
     subject = f'Currency rate on {current_date}'
 
-    currency_list = get_currency().json()
+    # Worker can wait for the bank if the cache is cold
+    currency_list = get_currency() or refresh_currency() or []
     message = render_to_string('currency_rate.html', {
         'object_list': currency_list
     })
-    return subject, message, users_email
\ No newline at end of file
+    return subject, message
+
+
+def chunks(records, size):
+    """ Split records into lists of size """
+    records = iter(records)
+    chunk = list(islice(records, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(records, size))
+
+
+def iter_id_ranges(queryset, size):
+    """
+    Yield (first, last) pks of consecutive chunks of size rows,
+    reading pks page by page from the last one seen
+    """
+    last = None
+    while True:
+        page = queryset.order_by('pk')
+        if last is not None:
+            page = page.filter(pk__gt=last)
+        pks = list(page.values_list('pk', flat=True)[:size])
+        if not pks:
+            return
+        yield pks[0], pks[-1]
+        last = pks[-1]
+
+
+def is_conflict(error):
+    """ Check if database error is a deadlock or serialization failure """
+    pgcode = getattr(error.__cause__, 'pgcode', None)
+    if pgcode is not None:
+        return pgcode in CONFLICT_PGCODES
+    # SQLite reports a busy database as "database is locked"
+    return 'locked' in str(error)
+
+
+def retry_on_conflict(func):
+    """
+    Retry func on deadlock or serialization failure.
+    Sleeps with bounded exponential backoff and jitter between attempts.
+    Nothing is retried inside an outer atomic block, because the whole
+    outer transaction is already rolled back by the database.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as err:
+                if (attempt == RETRY_ATTEMPTS or connection.in_atomic_block
+                        or not is_conflict(err)):
+                    raise
+                delay = min(RETRY_BACKOFF * 2 ** (attempt - 1),
+                            RETRY_BACKOFF_MAX)
+                time.sleep(random.uniform(delay / 2, delay))
+    return wrapper
+
+
+def parse_time(params, name):
+    """ Read date or date and time from query param """
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value) or parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: 'Enter a valid date or date and time.'})
+    if not isinstance(parsed, datetime):
+        parsed = datetime.combine(parsed, datetime.min.time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
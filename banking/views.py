@@ -1,21 +1,76 @@
+import codecs
 from sys import exc_info
 
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from rest_framework import generics, status, mixins, filters
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.reverse import reverse
 from rest_framework import viewsets
 from rest_framework.views import APIView
 
+from banking.activity import iter_statement
 from banking.exceptions import InvalidAmount, InvalidAccount, \
-    InvalidAccountReceiver
+    InvalidAccountReceiver, ImportConflict
 from banking.models import Customer, Account, Transfer, Transaction, Deposit, \
-    Withdrawal
-from banking.search import search
+    Withdrawal, Operation, ExchangeRate, EmailRun, WebhookSubscription
+from banking.idempotency import idempotent
+from banking.imports import import_deposits, get_format, get_digest
+from banking.operations import enqueue
+from banking.pagination import KeysetPagination, ActivityPagination, \
+    SearchPagination, TransactionSearchPagination
+from banking.renderers import CSVStatementRenderer, NDJSONStatementRenderer
 from banking.serializers import CustomerSerializer, CustomerUserSerializer, \
     AccountSerializer, TransferSerializer, TransactionSerializer, \
-    DepositSerializer, WithdrawalSerializer
-from banking.utils import get_currency
+    DepositSerializer, WithdrawalSerializer, TransferBatchSerializer, \
+    DepositImportSerializer, LedgerEntrySerializer, OperationSerializer, \
+    ActivitySerializer, ExchangeRateSerializer, AccountSearchSerializer, \
+    TransactionSearchSerializer, EmailRunSerializer, \
+    WebhookSubscriptionSerializer
+from banking.utils import get_currency, parse_time
+
+
+class AsyncWriteMixin:
+    """
+    Queue validated writes for the account write queue instead of
+    running them in the request when BANKING_ASYNC_WRITES is on
+    """
+    operation_kind = None
+
+    def is_async(self):
+        return getattr(settings, 'BANKING_ASYNC_WRITES', False)
+
+    def enqueue(self, serializer):
+        operation = enqueue(self.operation_kind, serializer.validated_data)
+        url = reverse('banking:operation-detail',
+                      kwargs={'uid': operation.uid}, request=self.request)
+        return Response(OperationSerializer(operation).data,
+                        status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': url})
+
+
+class AccountHistoryMixin:
+    """
+    Limit history to accounts of current user.
+    Account ids are read first and passed as values, so the database
+    walks the (account, -date, -id) index instead of joining a subquery.
+    """
+    account_field = 'account_id'
+
+    def get_account_ids(self):
+        return list(Account.objects.filter(holder=self.request.user)
+                    .values_list('pk', flat=True))
+
+    def get_queryset(self):
+        accounts = self.get_account_ids()
+        if len(accounts) == 1:
+            return self.queryset.filter(**{self.account_field: accounts[0]})
+        return self.queryset.filter(
+            **{f'{self.account_field}__in': accounts})
 
 
 class CustomerList(generics.ListCreateAPIView):
@@ -50,17 +105,60 @@ class AccountView(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """ Return object for current authenticated user only """
-        q = self.request.query_params.get('q')
-        if q is not None:
-            return search(q)
         return self.queryset.filter(holder=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        """ List accounts or search them with ?q= """
+        q = request.query_params.get('q')
+        if q is None:
+            return super().list(request, *args, **kwargs)
+        paginator = SearchPagination()
+        page = paginator.paginate_search(q, request)
+        serializer = AccountSearchSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(methods=['get'], detail=True)
+    def ledger(self, request, **kwargs):
+        """ Balance changes of account in the order they were made """
+        account = self.get_object()
+        page = self.paginate_queryset(account.ledger.all())
+        serializer = LedgerEntrySerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['get'], detail=True)
+    def activity(self, request, **kwargs):
+        """
+        Transfers, transactions, deposits and withdrawals of account
+        in one feed, newest first
+        """
+        account = self.get_object()
+        paginator = ActivityPagination()
+        page = paginator.paginate_activity(account, request)
+        serializer = ActivitySerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(methods=['get'], detail=True,
+            renderer_classes=[CSVStatementRenderer, NDJSONStatementRenderer])
+    def statement(self, request, **kwargs):
+        """
+        Stream all movements of account as a file,
+        statement.csv or statement.ndjson
+        """
+        account = self.get_object()
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(iter_statement(account.pk)),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        filename = f'statement-{account.uid}.{renderer.format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
     @action(methods=['put'], detail=True)
     def activate(self, request, **kwargs):
         """ Change account status to active """
         account = self.get_object()
-        account.status = Account.ACTIVE
-        account.save()
+        account.set_status(Account.ACTIVE)
 
         return Response(status=status.HTTP_200_OK)
 
@@ -68,8 +166,7 @@ class AccountView(viewsets.ModelViewSet):
     def deactivate(self, request, **kwargs):
         """ Change account status to inactive """
         account = self.get_object()
-        account.status = Account.INACTIVE
-        account.save()
+        account.set_status(Account.INACTIVE)
 
         return Response(status=status.HTTP_200_OK)
 
@@ -77,13 +174,13 @@ class AccountView(viewsets.ModelViewSet):
     def block(self, request, **kwargs):
         """ Change account status to block """
         account = self.get_object()
-        account.status = Account.BLOCKED
-        account.save()
+        account.set_status(Account.BLOCKED)
 
         return Response(status=status.HTTP_200_OK)
 
 
-class TransferView(viewsets.GenericViewSet,
+class TransferView(AsyncWriteMixin, AccountHistoryMixin,
+                   viewsets.GenericViewSet,
                    mixins.ListModelMixin,
                    mixins.CreateModelMixin,
                    mixins.RetrieveModelMixin):
@@ -93,17 +190,24 @@ class TransferView(viewsets.GenericViewSet,
     serializer_class = TransferSerializer
     queryset = Transfer.objects.all()
     permission_classes = (IsAuthenticated,)
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    operation_kind = Operation.TRANSFER
+    pagination_class = KeysetPagination
+    filter_backends = [filters.SearchFilter]
     search_fields = ['account_to']
-    ordering_fields = ['account_to', 'date']
 
-    def get_queryset(self):
-        account = Account.objects.filter(holder_id=self.request.user)
-        return self.queryset.filter(account_from__in=account)
+    account_field = 'account_from_id'
+
+    def get_serializer_class(self):
+        if self.action == 'batch':
+            return TransferBatchSerializer
+        return self.serializer_class
 
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        if self.is_async():
+            return self.enqueue(serializer)
         try:
             Transfer.make_transfer(**serializer.validated_data)
         except (InvalidAmount, InvalidAccount, InvalidAccountReceiver) as err:
@@ -113,8 +217,29 @@ class TransferView(viewsets.GenericViewSet,
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(methods=['post'], detail=False)
+    @idempotent
+    def batch(self, request, *args, **kwargs):
+        """ Make many transfers from one account in a single request """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            _, results = Transfer.make_batch_transfer(
+                **serializer.validated_data)
+        except InvalidAmount as err:
+            content = {err.default_code: err.detail}
+            status_code = err.status_code
+            return Response(content, status=status_code)
+
+        if any(result['status'] == 'created' for result in results):
+            status_code = status.HTTP_201_CREATED
+        else:
+            status_code = status.HTTP_400_BAD_REQUEST
+        return Response({'results': results}, status=status_code)
 
-class TransactionView(mixins.ListModelMixin,
+
+class TransactionView(AsyncWriteMixin, AccountHistoryMixin,
+                      mixins.ListModelMixin,
                       mixins.CreateModelMixin,
                       mixins.RetrieveModelMixin,
                       viewsets.GenericViewSet):
@@ -124,17 +249,25 @@ class TransactionView(mixins.ListModelMixin,
     serializer_class = TransactionSerializer
     queryset = Transaction.objects.all()
     permission_classes = (IsAuthenticated,)
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['merchant']
-    ordering_fields = ['merchant', 'date']
-
-    def get_queryset(self):
-        account = Account.objects.filter(holder_id=self.request.user)
-        return self.queryset.filter(account__in=account)
-
+    operation_kind = Operation.TRANSACTION
+    pagination_class = KeysetPagination
+
+    def list(self, request, *args, **kwargs):
+        """ List transactions or search them by merchant with ?search= """
+        phrase = request.query_params.get(api_settings.SEARCH_PARAM)
+        if not phrase:
+            return super().list(request, *args, **kwargs)
+        paginator = TransactionSearchPagination(self.get_account_ids())
+        page = paginator.paginate_search(phrase, request)
+        serializer = TransactionSearchSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        if self.is_async():
+            return self.enqueue(serializer)
         try:
             Transaction.make_transaction(**serializer.validated_data)
         except InvalidAmount as err:
@@ -145,26 +278,26 @@ class TransactionView(mixins.ListModelMixin,
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class DepositView(mixins.ListModelMixin,
-                      mixins.CreateModelMixin,
-                      mixins.RetrieveModelMixin,
-                      viewsets.GenericViewSet):
+class DepositView(AsyncWriteMixin, AccountHistoryMixin,
+                  mixins.ListModelMixin,
+                  mixins.CreateModelMixin,
+                  mixins.RetrieveModelMixin,
+                  viewsets.GenericViewSet):
     """
     Make deposit to account
     """
     serializer_class = DepositSerializer
     queryset = Deposit.objects.all()
     permission_classes = (IsAuthenticated,)
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    ordering_fields = ['date']
-
-    def get_queryset(self):
-        account = Account.objects.filter(holder_id=self.request.user)
-        return self.queryset.filter(account__in=account)
+    operation_kind = Operation.DEPOSIT
+    pagination_class = KeysetPagination
 
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        if self.is_async():
+            return self.enqueue(serializer)
         try:
             Deposit.make_deposit(**serializer.validated_data)
         except InvalidAmount as err:
@@ -174,27 +307,61 @@ class DepositView(mixins.ListModelMixin,
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(methods=['post'], detail=False, url_path='import',
+            serializer_class=DepositImportSerializer,
+            parser_classes=[MultiPartParser],
+            permission_classes=[IsAdminUser])
+    def import_file(self, request, *args, **kwargs):
+        """
+        Import deposits from uploaded CSV or NDJSON file.
+        Upload the same file with the same name again to resume an
+        interrupted import. A name used for another file is rejected.
+        Files are applied within the request and limited to
+        DEPOSIT_IMPORT_MAX_UPLOAD_SIZE, larger ones go through the
+        import_deposits management command.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.validated_data['file']
+        name = serializer.validated_data.get('name', upload.name)
+        digest = get_digest(upload.chunks())
+        upload.seek(0)
 
-class WithdrawalView(mixins.ListModelMixin,
-                      mixins.CreateModelMixin,
-                      mixins.RetrieveModelMixin,
-                      viewsets.GenericViewSet):
+        try:
+            checkpoint = import_deposits(
+                codecs.iterdecode(upload, 'utf-8'),
+                name,
+                fmt=get_format(upload.name),
+                digest=digest
+            )
+        except ImportConflict as err:
+            content = {err.default_code: err.detail}
+            return Response(content, status=err.status_code)
+
+        return Response(self.get_serializer(checkpoint).data,
+                        status=status.HTTP_201_CREATED)
+
+
+class WithdrawalView(AsyncWriteMixin, AccountHistoryMixin,
+                     mixins.ListModelMixin,
+                     mixins.CreateModelMixin,
+                     mixins.RetrieveModelMixin,
+                     viewsets.GenericViewSet):
     """
     Make withdrawal from account
     """
     serializer_class = WithdrawalSerializer
     queryset = Withdrawal.objects.all()
     permission_classes = (IsAuthenticated,)
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    ordering_fields = ['date']
-
-    def get_queryset(self):
-        account = Account.objects.filter(holder_id=self.request.user)
-        return self.queryset.filter(account__in=account)
+    operation_kind = Operation.WITHDRAWAL
+    pagination_class = KeysetPagination
 
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        if self.is_async():
+            return self.enqueue(serializer)
         try:
             Withdrawal.make_withdrawal(**serializer.validated_data)
         except InvalidAmount as err:
@@ -205,11 +372,70 @@ class WithdrawalView(mixins.ListModelMixin,
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+class OperationView(mixins.RetrieveModelMixin,
+                    viewsets.GenericViewSet):
+    """
+    Status of operation queued for the account write queue
+    """
+    serializer_class = OperationSerializer
+    queryset = Operation.objects.all()
+    lookup_field = 'uid'
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return self.queryset.filter(account__holder=self.request.user)
+
+
+class EmailRunView(viewsets.ReadOnlyModelViewSet):
+    """
+    Progress of mass email runs
+    """
+    serializer_class = EmailRunSerializer
+    queryset = EmailRun.objects.all()
+    permission_classes = (IsAdminUser,)
+
+
+class WebhookView(viewsets.ModelViewSet):
+    """
+    Endpoints called with events of the user's account.
+    Requests carry events as a JSON array, signed with the secret
+    in X-Webhook-Signature as sha256=<HMAC of the body>.
+    """
+    serializer_class = WebhookSubscriptionSerializer
+    queryset = WebhookSubscription.objects.all()
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return self.queryset.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+
 class CurrencyRate(APIView):
     """
     View currency exchange rate.
     USD, EUR, RUR, BTC
     """
     def get(self, request, format=None):
-        currency = get_currency()
-        return Response(currency.json())
+        return Response(get_currency())
+
+
+class CurrencyHistory(generics.ListAPIView):
+    """
+    Currency exchange rate history, newest first.
+    ?ccy=USD&from=2020-03-01&to=2020-03-31T12:00
+    """
+    serializer_class = ExchangeRateSerializer
+    queryset = ExchangeRate.objects.all()
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        params = self.request.query_params
+        queryset = self.queryset.filter(ccy=params.get('ccy', 'USD').upper())
+        start, end = parse_time(params, 'from'), parse_time(params, 'to')
+        if start is not None:
+            queryset = queryset.filter(date__gte=start)
+        if end is not None:
+            queryset = queryset.filter(date__lte=end)
+        return queryset
@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import random
+import socket
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp.resolver import DefaultResolver
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from banking.models import WebhookSubscription, WebhookDelivery
+from banking.utils import chunks
+
+WEBHOOK_POOL_SIZE = getattr(settings, 'WEBHOOK_POOL_SIZE', 100)
+WEBHOOK_ENDPOINT_CONCURRENCY = getattr(settings,
+                                       'WEBHOOK_ENDPOINT_CONCURRENCY', 4)
+WEBHOOK_BATCH_SIZE = getattr(settings, 'WEBHOOK_BATCH_SIZE', 50)
+WEBHOOK_CLAIM_SIZE = getattr(settings, 'WEBHOOK_CLAIM_SIZE', 1000)
+WEBHOOK_TIMEOUT = getattr(settings, 'WEBHOOK_TIMEOUT', 10)
+# Longer than a wave of claimed deliveries takes to send
+WEBHOOK_LEASE = getattr(settings, 'WEBHOOK_LEASE', 60 * 15)
+WEBHOOK_MAX_ATTEMPTS = getattr(settings, 'WEBHOOK_MAX_ATTEMPTS', 10)
+WEBHOOK_BACKOFF = getattr(settings, 'WEBHOOK_BACKOFF', 10)
+WEBHOOK_BACKOFF_MAX = getattr(settings, 'WEBHOOK_BACKOFF_MAX', 60 * 60)
+WEBHOOK_POLL_INTERVAL = getattr(settings, 'WEBHOOK_POLL_INTERVAL', 1)
+
+SIGNATURE_HEADER = 'X-Webhook-Signature'
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookPublisher:
+    """ Outbox publisher adding a delivery per event and webhook of holder """
+
+    def publish(self, events):
+        by_account = defaultdict(list)
+        for event in events:
+            by_account[event['data']['account']].append(event)
+        subscriptions = WebhookSubscription.objects.filter(
+            active=True, user__account__uid__in=list(by_account)
+        ).values_list('pk', 'user__account__uid')
+        WebhookDelivery.objects.bulk_create([
+            WebhookDelivery(subscription_id=pk, event=event['id'],
+                            payload=json.dumps(event))
+            for pk, uid in subscriptions
+            for event in by_account[str(uid)]
+        ])
+
+
+def sign(secret, body):
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return f'sha256={digest}'
+
+
+def is_public_url(url):
+    """
+    Whether url is http(s) and its host resolves to public addresses
+    only, so that webhooks can't reach hosts of the internal network
+    """
+    try:
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            return False
+        addresses = socket.getaddrinfo(parts.hostname, parts.port or 0,
+                                       proto=socket.IPPROTO_TCP)
+    except (OSError, UnicodeError, ValueError):
+        return False
+    return all(is_public_address(sockaddr[0])
+               for *_, sockaddr in addresses)
+
+
+def is_public_address(address):
+    """ Whether IP address is reachable on the internet, ValueError if
+    address is not an IP address """
+    address = ipaddress.ip_address(address.split('%')[0])
+    return address.is_global and not address.is_multicast
+
+
+def is_internal_ip(host):
+    """ Whether host is an IP address, not a name, of an internal host """
+    try:
+        return not is_public_address(host)
+    except ValueError:
+        return False
+
+
+class PublicResolver(DefaultResolver):
+    """
+    Resolver giving public addresses only, so that a webhook host can't
+    be pointed at the internal network by DNS after it was validated
+    """
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        hosts = await super().resolve(host, port, family)
+        public = [item for item in hosts if is_public_address(item['host'])]
+        if not public:
+            raise OSError(f'{host} has no public address')
+        return public
+
+
+def get_backoff(attempts):
+    """ Seconds before the next attempt, doubled after every failure """
+    delay = min(WEBHOOK_BACKOFF * 2 ** (attempts - 1), WEBHOOK_BACKOFF_MAX)
+    return random.uniform(delay / 2, delay)
+
+
+def claim_deliveries(size=WEBHOOK_CLAIM_SIZE):
+    """
+    Take up to size due deliveries, oldest first, and mark them sending
+    until record_results. Sending ones come due again after WEBHOOK_LEASE,
+    that is if the worker sending them stopped before recording results.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        due = WebhookDelivery.objects.filter(
+            status__in=[WebhookDelivery.PENDING, WebhookDelivery.SENDING],
+            next_attempt__lte=now
+        )
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True, of=('self',))
+        else:
+            # SQLite has no row locks. An empty UPDATE takes the database
+            # write lock before reading, so workers claim one after another.
+            due.filter(pk=None).update(next_attempt=now)
+        deliveries = list(due.select_related('subscription')
+                          .order_by('next_attempt', 'id')[:size])
+        WebhookDelivery.objects.filter(
+            pk__in=[delivery.pk for delivery in deliveries]
+        ).update(status=WebhookDelivery.SENDING,
+                 next_attempt=now + timedelta(seconds=WEBHOOK_LEASE))
+    return deliveries
+
+
+def record_results(delivered, failed):
+    """
+    Mark delivered deliveries done with one UPDATE and schedule failed
+    ones for a retry, or give them up after WEBHOOK_MAX_ATTEMPTS
+    :param delivered: list of deliveries
+    :param failed: list of (delivery, error) pairs
+    """
+    now = timezone.now()
+    if delivered:
+        WebhookDelivery.objects.filter(
+            pk__in=[delivery.pk for delivery in delivered]
+        ).update(status=WebhookDelivery.DONE, delivered=now,
+                 attempts=F('attempts') + 1)
+    for delivery, error in failed:
+        delivery.attempts += 1
+        delivery.last_error = error
+        if delivery.attempts >= WEBHOOK_MAX_ATTEMPTS:
+            # Time of giving up, old failed deliveries are deleted by it
+            delivery.status = WebhookDelivery.FAILED
+            delivery.next_attempt = now
+        else:
+            delivery.status = WebhookDelivery.PENDING
+            delivery.next_attempt = now + timedelta(
+                seconds=get_backoff(delivery.attempts))
+    if failed:
+        WebhookDelivery.objects.bulk_update(
+            [delivery for delivery, _ in failed],
+            ['attempts', 'last_error', 'status', 'next_attempt']
+        )
+
+
+def log_errors(waves):
+    """ Log exceptions of finished waves, results of their deliveries
+    stay unrecorded until the lease runs out """
+    for wave in waves:
+        if not wave.cancelled() and wave.exception() is not None:
+            logger.error('Webhook wave failed', exc_info=wave.exception())
+
+
+class WebhookWorker:
+    """
+    Deliver due webhook events over one pool of keep-alive connections.
+    Deliveries are claimed from the database in waves of claim_size, a
+    new wave is claimed while earlier ones are still being sent. Events
+    of one endpoint are posted together, up to batch_size in one JSON
+    array, with at most concurrency requests to the endpoint at a time.
+    Database work runs in a thread of its own, off the event loop.
+    With public_only, endpoints are called on public addresses only.
+    """
+    def __init__(self, pool_size=WEBHOOK_POOL_SIZE,
+                 concurrency=WEBHOOK_ENDPOINT_CONCURRENCY,
+                 batch_size=WEBHOOK_BATCH_SIZE, claim_size=WEBHOOK_CLAIM_SIZE,
+                 waves=4, public_only=True):
+        self.public_only = public_only
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.claim_size = claim_size
+        self.waves = waves
+        self.delivered = 0
+
+    async def run(self, once=False):
+        """
+        Send deliveries until stopped, or until nothing is due with once
+        :return: number of delivered events
+        """
+        self.loop = asyncio.get_event_loop()
+        self.db = ThreadPoolExecutor(max_workers=1)
+        self.semaphores = defaultdict(
+            lambda: asyncio.Semaphore(self.concurrency))
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            resolver=PublicResolver() if self.public_only else None)
+        timeout = aiohttp.ClientTimeout(total=WEBHOOK_TIMEOUT)
+        waves = set()
+        try:
+            async with aiohttp.ClientSession(connector=connector,
+                                             timeout=timeout) as session:
+                self.session = session
+                while True:
+                    if len(waves) >= self.waves:
+                        done, waves = await asyncio.wait(
+                            waves, return_when=asyncio.FIRST_COMPLETED)
+                        log_errors(done)
+                    deliveries = await self.loop.run_in_executor(
+                        self.db, claim_deliveries, self.claim_size)
+                    if deliveries:
+                        waves.add(self.loop.create_task(
+                            self.process(deliveries)))
+                    elif once:
+                        break
+                    else:
+                        await asyncio.sleep(WEBHOOK_POLL_INTERVAL)
+                if waves:
+                    done, _ = await asyncio.wait(waves)
+                    log_errors(done)
+        finally:
+            await self.loop.run_in_executor(self.db, connections.close_all)
+            self.db.shutdown()
+        return self.delivered
+
+    async def process(self, deliveries):
+        by_subscription = defaultdict(list)
+        for delivery in deliveries:
+            by_subscription[delivery.subscription].append(delivery)
+        batches = [
+            batch
+            for items in by_subscription.values()
+            for batch in chunks(items, self.batch_size)
+        ]
+        errors = await asyncio.gather(*[
+            self.send_batch(batch[0].subscription, batch) for batch in batches
+        ])
+
+        delivered, failed = [], []
+        for batch, error in zip(batches, errors):
+            if error is None:
+                delivered += batch
+            else:
+                failed += [(delivery, error) for delivery in batch]
+        await self.loop.run_in_executor(self.db, record_results,
+                                        delivered, failed)
+        self.delivered += len(delivered)
+
+    async def send_batch(self, subscription, deliveries):
+        """
+        Post events to the endpoint of subscription
+        :return: None if the endpoint took them, error text otherwise
+        """
+        body = '[{}]'.format(
+            ','.join(delivery.payload for delivery in deliveries)).encode()
+        headers = {
+            'Content-Type': 'application/json',
+            SIGNATURE_HEADER: sign(subscription.secret, body),
+        }
+        if self.public_only and is_internal_ip(
+                urlsplit(subscription.url).hostname):
+            return 'Not a public address'
+        async with self.semaphores[subscription.url]:
+            try:
+                # A redirect could lead to an internal host
+                async with self.session.post(
+                        subscription.url, data=body, headers=headers,
+                        allow_redirects=False) as response:
+                    # Read the body so the connection goes back to the pool
+                    await response.read()
+                    if response.status >= 300:
+                        return f'HTTP {response.status}'
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                return f'{type(err).__name__}: {err}'
+        return None